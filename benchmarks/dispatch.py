@@ -0,0 +1,66 @@
+#!/usr/bin/python
+"""Benchmarks the per-request dispatch overhead of NewWeb.
+
+Usage: python -m benchmarks.dispatch [iterations]
+
+Compares PageMaker construction plus handler dispatch through the prebuilt
+handler table against the previous approach: re-running the class path setup
+for every PageMaker and looking up the handler by name with getattr.
+"""
+
+# Standard modules
+import cStringIO
+import sys
+import timeit
+
+# newWeb modules
+import newweb
+
+
+class PageMaker(newweb.pagemaker.BasePageMaker):
+  """PageMaker with a trivial handler, so only the dispatch cost is measured."""
+  def Item(self, item):
+    """Returns the item unchanged."""
+    return item
+
+
+def Environ(path):
+  """Returns a minimal WSGI environment for a GET request to `path`."""
+  return {'PATH_INFO': path, 'REQUEST_METHOD': 'GET', 'QUERY_STRING': '',
+          'wsgi.input': cStringIO.StringIO()}
+
+
+def Benchmark(iterations):
+  """Prints the time per request for both dispatch approaches."""
+  app = newweb.NewWeb(PageMaker, [('/item/(\w+)', 'Item')], config={})
+  req = newweb.request.Request(Environ('/item/spam'), app.registry)
+
+  def TableDispatch():
+    """Dispatches through the handler table resolved at startup."""
+    page_maker = PageMaker(req, config=app.config)
+    handler, args = app.router(req.path, req.method)
+    return handler(page_maker, *args)
+
+  def NameDispatch():
+    """Dispatches by handler name, with path setup for every PageMaker."""
+    page_maker = PageMaker(req, config=app.config)
+    # pylint: disable=W0212
+    page_maker._BasePageMaker__SetupPaths()
+    # pylint: enable=W0212
+    handler, args = app.router(req.path, req.method)
+    return getattr(page_maker, handler.__name__)(*args)
+
+  def FullRequest():
+    """Processes a complete WSGI request."""
+    return list(app(Environ('/item/spam'), lambda *args: None))
+
+  assert TableDispatch() == NameDispatch() == 'spam'
+  for label, function in (('getattr dispatch', NameDispatch),
+                          ('table dispatch', TableDispatch),
+                          ('full WSGI request', FullRequest)):
+    duration = min(timeit.repeat(function, number=iterations, repeat=3))
+    print '%-20s %8.2f us' % (label, duration / iterations * 1e6)
+
+
+if __name__ == '__main__':
+  Benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
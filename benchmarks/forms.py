@@ -0,0 +1,93 @@
+#!/usr/bin/python
+"""Benchmarks newweb's urlencoded form decoding against the cgi based parsing.
+
+Usage: python -m benchmarks.forms [iterations]
+
+For forms of 10, 1000 and 50000 fields (half of them in the 'foo[bar]' form),
+this reports the time to parse a POST body and read the indexed group and ten
+other fields from it, and the time to parse a query string of the same size.
+"""
+
+# Standard modules
+import cgi
+import cStringIO
+import sys
+import timeit
+import urllib
+
+# newWeb modules
+from newweb import request
+
+
+class CgiFieldStorage(cgi.FieldStorage):
+  """IndexedFieldStorage as it was before request.ParseUrlencoded."""
+  def getfirst(self, key, default=None):
+    return cgi.FieldStorage.getfirst(self, key, default)
+
+  def read_urlencoded(self):
+    indexed = {}
+    self.list = []
+    for field, value in cgi.parse_qsl(self.fp.read(self.length),
+                                      self.keep_blank_values,
+                                      self.strict_parsing):
+      if request.FIELD_AS_ARRAY.match(field):
+        field_group, field_key = request.FIELD_AS_ARRAY.match(field).groups()
+        indexed.setdefault(field_group, cgi.MiniFieldStorage(field_group, {}))
+        indexed[field_group].value[field_key] = value.decode('utf8')
+      else:
+        self.list.append(cgi.MiniFieldStorage(field, value.decode('utf8')))
+    self.list = indexed.values() + self.list
+    self.skip_lines()
+
+
+def FormData(count):
+  """Returns urlencoded data with `count` fields, like a bulk-edit form."""
+  fields = []
+  for num in range(count):
+    if num % 2:
+      fields.append(('item[%d]' % num, 'value %d' % num))
+    else:
+      fields.append(('field%d' % num, 'caf\xc3\xa9 %d' % num))
+  return urllib.urlencode(fields)
+
+
+def Benchmark(iterations):
+  """Prints the time per parse for the cgi and newweb decoders."""
+  for count in (10, 1000, 50000):
+    data = FormData(count)
+    environ = {'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': str(len(data)),
+               'CONTENT_TYPE': 'application/x-www-form-urlencoded'}
+    names = ['field%d' % num for num in range(0, count, max(2, count // 10))]
+    names.append('item')
+
+    def CgiPost(storage_class=CgiFieldStorage):
+      """Parses the POST body and reads the first value of some fields."""
+      storage = storage_class(fp=cStringIO.StringIO(data), environ=environ)
+      return [storage.getfirst(name) for name in names]
+
+    def NewWebPost():
+      """Parses the POST body with IndexedFieldStorage."""
+      return CgiPost(request.IndexedFieldStorage)
+
+    def CgiQuery():
+      """Parses the query string with cgi.parse_qs."""
+      return request.QueryArgsDict(cgi.parse_qs(data))
+
+    def NewWebQuery():
+      """Parses the query string with request.ParseUrlencoded."""
+      return request.ParseUrlencoded(data, indexed=False, encoding=None)
+
+    assert CgiPost() == NewWebPost()
+    assert CgiQuery() == NewWebQuery()
+    number = max(1, iterations // count)
+    print '%d fields:' % count
+    for label, function in (('cgi POST', CgiPost),
+                            ('newweb POST', NewWebPost),
+                            ('cgi query', CgiQuery),
+                            ('newweb query', NewWebQuery)):
+      duration = min(timeit.repeat(function, number=number, repeat=3))
+      print '  %-14s %12.2f us' % (label, duration / number * 1e6)
+
+
+if __name__ == '__main__':
+  Benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
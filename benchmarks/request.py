@@ -0,0 +1,83 @@
+#!/usr/bin/python
+"""Benchmarks constructing a Request and reading a few of its headers.
+
+Usage: python -m benchmarks.request [iterations]
+
+Compares the request.EnvironHeaders view over the WSGI environment against the
+previous approach of building a dictionary of all headers for every request.
+The environment holds the headers of a typical browser request.
+"""
+
+# Standard modules
+import cStringIO
+import sys
+import timeit
+
+# newWeb modules
+from newweb import request
+
+
+def HeadersFromEnv(env):
+  """Yields the request headers in the environment, as newWeb used to."""
+  for key, value in env.iteritems():
+    if key.startswith('HTTP_'):
+      yield key[5:].lower().replace('_', '-'), value
+
+
+class DictHeadersRequest(request.Request):
+  """Request that builds a dict of its headers, as before EnvironHeaders."""
+  @property
+  def headers(self):
+    if self._headers is None:
+      self._headers = dict(HeadersFromEnv(self.env))
+    return self._headers
+
+
+def Environ():
+  """Returns a WSGI environment like that of a browser's GET request."""
+  env = {'PATH_INFO': '/item/spam', 'REQUEST_METHOD': 'GET',
+         'QUERY_STRING': 'page=2', 'SERVER_NAME': 'localhost',
+         'SERVER_PORT': '8000', 'SERVER_PROTOCOL': 'HTTP/1.1',
+         'REMOTE_ADDR': '127.0.0.1', 'SCRIPT_NAME': '', 'CONTENT_LENGTH': '',
+         'CONTENT_TYPE': 'text/plain', 'wsgi.input': cStringIO.StringIO(),
+         'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0),
+         'wsgi.multithread': True, 'wsgi.multiprocess': False,
+         'wsgi.run_once': False, 'wsgi.errors': sys.stderr}
+  env.update({
+      'HTTP_HOST': 'localhost:8000',
+      'HTTP_USER_AGENT': 'Mozilla/5.0 (X11; Linux x86_64) Firefox/60.0',
+      'HTTP_ACCEPT': 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.8',
+      'HTTP_ACCEPT_LANGUAGE': 'en-US,en;q=0.5',
+      'HTTP_ACCEPT_ENCODING': 'gzip, deflate',
+      'HTTP_REFERER': 'http://localhost:8000/',
+      'HTTP_COOKIE': 'session=0123456789abcdef; theme=dark',
+      'HTTP_CONNECTION': 'keep-alive',
+      'HTTP_UPGRADE_INSECURE_REQUESTS': '1',
+      'HTTP_CACHE_CONTROL': 'max-age=0'})
+  return env
+
+
+def Benchmark(iterations):
+  """Prints the time per request for both header implementations."""
+  env = Environ()
+
+  def Construct(request_class):
+    """Returns a function that creates a request and reads three headers."""
+    def construct():
+      """Creates a request and reads the headers newWeb itself uses."""
+      req = request_class(env, None)
+      headers = req.headers
+      return (headers.get('range'), headers.get('if-range'),
+              headers.get('accept-encoding'))
+    return construct
+
+  assert (Construct(DictHeadersRequest)() ==
+          Construct(request.Request)() == (None, None, 'gzip, deflate'))
+  for label, function in (('header dict', Construct(DictHeadersRequest)),
+                          ('header view', Construct(request.Request))):
+    duration = min(timeit.repeat(function, number=iterations, repeat=3))
+    print '%-14s %8.2f us' % (label, duration / iterations * 1e6)
+
+
+if __name__ == '__main__':
+  Benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
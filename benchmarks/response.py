@@ -0,0 +1,117 @@
+#!/usr/bin/python
+"""Benchmarks constructing and serializing a Response.
+
+Usage: python -m benchmarks.response [iterations]
+
+Compares response.Response against the dictionary based Response as it was
+before the Headers class, for a typical page response with a few headers. The
+time includes construction, adding headers and producing the status line,
+header list and body as a WSGI server would.
+"""
+
+# Standard modules
+import httplib
+import sys
+import timeit
+
+# newWeb modules
+from newweb import response
+
+
+class DictResponse(object):
+  """The parts of Response used in serving, as they were before Headers."""
+  def __init__(self, content='', content_type='text/html',
+               httpcode=200, headers=None, **kwds):
+    self.charset = kwds.get('charset', 'utf8')
+    self.text = content
+    self.httpcode = httpcode
+    self.headers = headers or {}
+    if ';' not in content_type:
+      content_type = '%s; charset=%s' % (content_type, self.charset)
+    self.content_type = content_type
+
+  @property
+  def content_type(self):
+    return self.headers['Content-Type']
+
+  @content_type.setter
+  def content_type(self, content_type):
+    current = self.headers.get('Content-Type', '')
+    if ';' in current:
+      content_type = '%s; %s' % (content_type, current.split(';', 1)[-1])
+    self.headers['Content-Type'] = content_type
+
+  @property
+  def text(self):
+    return self.content
+
+  @text.setter
+  def text(self, content):
+    if isinstance(content, unicode):
+      self.content = content.encode(self.charset)
+    elif isinstance(content, str):
+      self.content = content
+    else:
+      self.content = str(content)
+
+  @property
+  def streaming(self):
+    return not isinstance(self.content, str)
+
+  @property
+  def content_length(self):
+    if isinstance(self.content, str):
+      return len(self.content)
+    return None
+
+  @property
+  def app_iter(self):
+    if not self.streaming:
+      return [self.content]
+    return iter(self.content)
+
+  @property
+  def headerlist(self):
+    headers = [(key, val.encode('ascii'))
+               for key, val in self.headers.iteritems()]
+    if ('Content-Length' not in self.headers and
+        self.httpcode not in response.BODILESS_STATUS):
+      content_length = self.content_length
+      if content_length is not None:
+        headers.append(('Content-Length', str(content_length)))
+    return headers
+
+  @property
+  def status(self):
+    return '%d %s' % (self.httpcode, httplib.responses[self.httpcode])
+
+
+def Benchmark(iterations):
+  """Prints the time per response for both Response implementations."""
+  content = u'<!DOCTYPE html><html><body>%s</body></html>' % (u'caf\xe9 ' * 200)
+
+  def Serve(response_class):
+    """Returns a function that builds and serializes a response."""
+    def serve():
+      """Builds a response and serializes it like NewWeb and the server do."""
+      resp = response_class(content, headers={
+          'Cache-Control': 'no-cache', 'X-Frame-Options': 'DENY'})
+      resp.headers['Vary'] = 'Accept-Encoding'
+      status = resp.status
+      headers = resp.headerlist
+      # The header list is inspected again, e.g. by logging middleware.
+      headers = resp.headerlist
+      return status, headers, ''.join(resp.app_iter)
+    return serve
+
+  new, old = Serve(response.Response)(), Serve(DictResponse)()
+  assert new[0] == old[0] and new[2] == old[2]
+  assert sorted(new[1]) == sorted(old[1])
+  for label, function in (('dict Response', Serve(DictResponse)),
+                          ('slots Response', Serve(response.Response))):
+    duration = min(timeit.repeat(function, number=iterations, repeat=3))
+    print '%-16s %8.2f us' % (label, duration / iterations * 1e6)
+
+
+if __name__ == '__main__':
+  Benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
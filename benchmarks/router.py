@@ -0,0 +1,69 @@
+#!/usr/bin/python
+"""Benchmarks newweb.router against the original linear scan of routes.
+
+Usage: python -m benchmarks.router [iterations]
+
+For route tables of 10, 100 and 1000 routes (plus a catch-all), this reports
+the time per lookup for the first route, the last route and the catch-all.
+"""
+
+# Standard modules
+import re
+import sys
+import timeit
+
+# newWeb modules
+import newweb
+
+
+def LinearRouter(routes):
+  """Returns a request router that tries every route pattern in order.
+
+  This is the routing implementation as it was before routing.RouteTable.
+  """
+  req_routes = [(re.compile(pattern + '$', re.UNICODE), methods, handler)
+                for pattern, methods, handler in routes]
+
+  def request_router(url, method):
+    for pattern, methods, handler in req_routes:
+      match = pattern.match(url)
+      if match and (method in methods):
+        return handler, match.groups()
+    raise newweb.NoRouteError(url +' cannot be handled')
+  return request_router
+
+
+def Routes(count):
+  """Returns `count` realistic routes followed by a catch-all route."""
+  methods = ('GET', 'POST')
+  routes = []
+  for num in range(count):
+    routes.append(('/section%d/item/(\d+)' % num, methods, 'Item%d' % num))
+  routes.append(('/(.*)', methods, 'FourOhFour'))
+  return routes
+
+
+def Benchmark(iterations):
+  """Prints lookup timings of both routers for several route table sizes."""
+  print '%6s  %-10s  %12s  %12s  %8s' % (
+      'routes', 'url', 'linear (us)', 'table (us)', 'speedup')
+  for count in (10, 100, 1000):
+    routes = Routes(count)
+    linear = LinearRouter(routes)
+    table = newweb.router(routes)
+    urls = (('first', u'/section0/item/42'),
+            ('last', u'/section%d/item/42' % (count - 1)),
+            ('catch-all', u'/no/such/page'))
+    for label, url in urls:
+      assert linear(url, 'GET') == table(url, 'GET')
+      linear_time = min(timeit.repeat(
+          lambda: linear(url, 'GET'), number=iterations, repeat=3))
+      table_time = min(timeit.repeat(
+          lambda: table(url, 'GET'), number=iterations, repeat=3))
+      print '%6d  %-10s  %12.2f  %12.2f  %7.1fx' % (
+          count, label, linear_time / iterations * 1e6,
+          table_time / iterations * 1e6, linear_time / table_time)
+
+
+if __name__ == '__main__':
+  Benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+"""Benchmarks loading all templates of an application at startup.
+
+Usage: python -m benchmarks.templatecache [templates]
+
+Writes a number of page-sized templates to a temporary directory and times how
+long a new Parser takes to load all of them: without a cache, with an empty
+cache (which is filled while loading) and with a warm cache, as left behind by
+`python -m newweb.templateparser` at deploy time.
+"""
+
+# Standard modules
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# newWeb modules
+from newweb import templateparser
+
+TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head><title>[title] - page %(index)d</title></head>
+<body>
+<h1>[title|html]</h1>
+{{ if [user] }}<p>Logged in as [user:name] ([user:email|html])</p>
+{{ else }}<p><a href="/login?next=[path|url]">Log in</a></p>{{ endif }}
+<table>
+{{ for row in [rows] }}
+  <tr>
+    <td>[row:id]</td><td>[row:name|html]</td><td>[row:price|html]</td>
+    {{ ifpresent [row:tags] }}<td>[row:tags|len] tags</td>{{ endif }}
+  </tr>
+{{ endfor }}
+</table>
+%(filler)s
+</body>
+</html>
+'''
+
+
+def WriteTemplates(directory, count):
+  """Writes `count` templates to the given directory."""
+  filler = '\n'.join('<p class="[css:%d]">Paragraph %d of [title]</p>' % (
+      line, line) for line in range(40))
+  for index in range(count):
+    name = os.path.join(directory, 'page%03d.html' % index)
+    with file(name, 'w') as template:
+      template.write(TEMPLATE % {'index': index, 'filler': filler})
+
+
+def LoadAll(template_dir, cache_dir=None):
+  """Returns the seconds taken by a new Parser to load all templates."""
+  start = time.time()
+  parser = templateparser.Parser(template_dir, cache_dir=cache_dir)
+  for name in sorted(os.listdir(template_dir)):
+    if not name.startswith('.'):
+      parser[name]
+  return time.time() - start
+
+
+def Benchmark(count):
+  """Prints the startup time of loading templates with and without cache."""
+  template_dir = tempfile.mkdtemp()
+  try:
+    WriteTemplates(template_dir, count)
+    cache_dir = os.path.join(template_dir, '.cache')
+    timings = [
+        ('no cache', min(LoadAll(template_dir) for _ in range(3))),
+        ('cold cache', LoadAll(template_dir, cache_dir)),
+        ('warm cache', min(LoadAll(template_dir, cache_dir) for _ in range(3)))]
+    for label, duration in timings:
+      print '%-12s %8.2f ms' % (label, duration * 1e3)
+  finally:
+    shutil.rmtree(template_dir)
+
+
+if __name__ == '__main__':
+  Benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+"""Benchmarks rendering realistic pages with the templateparser.
+
+Usage: python -m benchmarks.templates [iterations]
+
+Compares the compiled rendering of templates against parsing their node tree,
+as Template.Parse did before the TemplateCompiler. The pages are a product
+listing with a table of 10 and 200 rows, rendered in a layout with a header
+and footer that are added with {{ inline }}.
+
+For a listing of 10000 rows, Template.Parse is then compared to streaming with
+Template.Stream: the time until the first chunk, the total time, and the size
+of the largest string held (the full page, or the largest chunk).
+"""
+
+# Standard modules
+import sys
+import time
+import timeit
+
+# newWeb modules
+from newweb import templateparser
+
+HEADER = """<!DOCTYPE html>
+<html><head><title>[title] - [site:name]</title></head><body>
+<div id="menu">{{ for item in [menu] }}
+  <a href="[item:url]"{{ if [item:url] == [path] }} class="active"{{ endif }}>
+    [item:label]</a>{{ endfor }}
+</div>
+{{ ifpresent [user:name] }}<p>Logged in as [user:name]</p>
+{{ else }}<p><a href="/login?next=[path|url]">Log in</a></p>{{ endif }}"""
+
+FOOTER = """<div id="footer">&copy; [site:year] [site:name]</div>
+</body></html>"""
+
+LISTING = """{{ inline header }}
+<h1>[title]</h1>
+<table>{{ for product in [products] }}
+  <tr class="[product:status]">
+    <td><a href="/product/[product:id]">[product:name]</a></td>
+    <td>[product:description|limit(40)]</td>
+    <td>[product:price]</td>
+    <td>{{ if [product:stock] }}[product:stock] in stock
+      {{ else }}sold out{{ endif }}</td>
+    <td>{{ for tag in [product:tags] }}<span>[tag]</span>{{ endfor }}</td>
+  </tr>{{ endfor }}
+</table>
+<p>[products|len] products</p>
+{{ inline footer }}"""
+
+
+class NodeTreeTemplate(templateparser.Template):
+  """Template that parses its node tree, as before the TemplateCompiler."""
+  def Parse(self, **kwds):
+    return templateparser.SafeString(''.join(
+        part.Parse(**kwds) for part in self))
+
+
+def Limit(length):
+  """Returns a tag function that limits text to the given length."""
+  return lambda text: text[:length]
+
+
+def Replacements(rows):
+  """Returns the replacements for a listing with the given number of rows."""
+  return {
+      'title': 'Products & services',
+      'path': '/products',
+      'site': {'name': 'Example shop', 'year': 2018},
+      'user': {'name': u'J\xf6rg'},
+      'menu': [{'url': url, 'label': label} for url, label in (
+          ('/', 'Home'), ('/products', 'Products'), ('/about', 'About us'))],
+      'products': [{
+          'id': number, 'name': 'Product <%d>' % number,
+          'description': 'A fine product, ' * 5, 'price': '%d.95' % number,
+          'status': 'new' if number % 5 else 'sale',
+          'stock': number % 3, 'tags': ('red', 'large')[:number % 3]}
+                   for number in range(rows)]}
+
+
+def Benchmark(iterations):
+  """Prints the time per page for node tree parsing and compiled rendering."""
+  templateparser.Parser.RegisterFunction('limit', Limit)
+  listings = []
+  for template_class in (NodeTreeTemplate, templateparser.Template):
+    parser = templateparser.Parser()
+    parser['header'] = template_class(HEADER, parser=parser)
+    parser['footer'] = template_class(FOOTER, parser=parser)
+    listings.append(template_class(LISTING, parser=parser))
+  node_tree, compiled = listings
+
+  for rows in (10, 200):
+    kwds = Replacements(rows)
+    assert node_tree.Parse(**kwds) == compiled.Parse(**kwds)
+    number = max(1, iterations * 10 // rows)
+    for label, function in (('node tree', lambda: node_tree.Parse(**kwds)),
+                            ('compiled', lambda: compiled.Parse(**kwds))):
+      duration = min(timeit.repeat(function, number=number, repeat=3))
+      print '%3d rows  %-10s %10.2f us' % (
+          rows, label, duration / number * 1e6)
+  StreamBenchmark(compiled, Replacements(10000))
+
+
+def StreamBenchmark(template, kwds):
+  """Prints the time and largest output string for parsing and streaming."""
+  start = time.time()
+  page = template.Parse(**kwds)
+  print 'parse     total %8.2f ms, largest string %8d bytes' % (
+      (time.time() - start) * 1e3, len(page))
+  start = time.time()
+  stream = template.Stream(**kwds)
+  largest = len(next(stream))
+  first_chunk = time.time() - start
+  for chunk in stream:
+    largest = max(largest, len(chunk))
+  print 'stream    total %8.2f ms, largest string %8d bytes' % (
+      (time.time() - start) * 1e3, largest)
+  print '          first chunk after %.2f ms' % (first_chunk * 1e3)
+
+
+if __name__ == '__main__':
+  Benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
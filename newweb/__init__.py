@@ -7,8 +7,8 @@ __version__ = '0.4.0-dev'
 import ConfigParser
 import logging
 import os
-import re
 import sys
+import types
 from wsgiref.simple_server import make_server
 
 # Add the ext_lib directory to the path
@@ -18,14 +18,22 @@ sys.path.append(
 # Package modules
 from . import pagemaker
 from . import request
+from . import routing
 
 # Package classes
+from .response import BLOCK_SIZE
+from .response import BODILESS_STATUS
 from .response import Response
 from .response import Redirect
 from .pagemaker import PageMaker
 from .pagemaker import DebuggingPageMaker
 
 
+# Content types that are compressed unless configured otherwise.
+COMPRESSIBLE_CONTENT_TYPES = ('text/* application/javascript application/json '
+                              'application/xml image/svg+xml')
+
+
 class Error(Exception):
   """Superclass used for inheritance and external excepion handling."""
 
@@ -38,6 +46,17 @@ class NoRouteError(Error):
   """The server does not know how to route this request"""
 
 
+class MethodNotAllowedError(NoRouteError):
+  """The requested url is routed, but not for the request method."""
+  def __init__(self, message, allowed):
+    super(MethodNotAllowedError, self).__init__(message)
+    self.allowed = allowed
+
+
+class UnknownHandlerError(Error):
+  """A route refers to a handler that the PageMaker class does not provide."""
+
+
 class Registry(object):
   """Something to hook stuff to"""
 
@@ -52,6 +71,10 @@ class NewWeb(object):
   The url in the received `req` object is taken and matches against the
   `router`` (refer to Router() for more documentation on this).
 
+  The handler names in the routes are resolved against the `page_class` once,
+  when the application is created. Routes referring to a handler that does not
+  exist raise UnknownHandlerError at that time.
+
 
   Takes:
     @ page_class: PageMaker
@@ -60,7 +83,16 @@ class NewWeb(object):
       The result of the Router() function.
     @ config: dict
       Configuration for the PageMaker. Typically contains entries for database
-      connections, default search paths etc.
+      connections, default search paths etc. A `cache_size` in the [routing]
+      section enables an LRU cache of resolved routes of that size. Response
+      compression is configured in the [compression] section: `level` (1 to
+      9, compression is disabled by default), `minimum_size` in bytes and
+      `content_types`.
+      The [request] section sets the `max_body_size` of POST data in bytes (0
+      for unlimited) and the `spool_size` above which uploads go to disk.
+      Handlers decorated with pagemaker.MaxBodySize have their own maximum.
+      Requests with a larger Content-Length get a 413 response before the
+      handler runs; chunked bodies are cut off as soon as they exceed it.
 
   Returns:
     RequestHandler: Configured closure that is ready to process requests.
@@ -69,14 +101,43 @@ class NewWeb(object):
     self.page_class = page_class
     self.registry = Registry()
     self.registry.logger = logging.getLogger('root')
-    self.router = router(routes)
     self.config = config if config is not None else {}
+    self.router = router(
+        tuple(route[:-1]) + (self._ResolveHandler(route[-1]),)
+        for route in routes)
+    self.route_cache = None
+    cache_size = int(self.config.get('routing', {}).get('cache_size', 0))
+    if cache_size:
+      self.route_cache = self.router = routing.RouteCache(
+          self.router, cache_size)
+    request_config = self.config.get('request', {})
+    self.registry.max_body_size = int(
+        request_config.get('max_body_size', 0)) or None
+    self.registry.spool_size = int(
+        request_config.get('spool_size', request.SPOOL_SIZE))
+    compression = self.config.get('compression', {})
+    self.compress_level = int(compression.get('level', 0))
+    self.compress_minimum = int(compression.get('minimum_size', 1024))
+    self.compress_types = pagemaker.MimeTypeDict(
+        (content_type, True) for content_type in compression.get(
+            'content_types', COMPRESSIBLE_CONTENT_TYPES).split())
 
   def __call__(self, env, start_response):
     """WSGI request handler.
 
     Accpepts the WSGI `environment` dictionary and a function to start the
-    response and returns a response iterator.
+    response and returns a response iterator. Streaming response bodies are
+    passed on to the WSGI server chunk by chunk, they are never joined. Files
+    are handed to the server's `wsgi.file_wrapper` when it provides one, which
+    allows it to use platform specific means of sending files (e.g. sendfile).
+
+    Responses that accept byte ranges are limited to the ranges requested in
+    GET requests; refer to Response.ApplyRange for details.
+
+    HEAD requests are handled like GET requests, after which the body is
+    dropped without being sent or read. The headers, including Content-Length,
+    are those of the GET response. Bodies that would be compressed are not;
+    the response gets the headers of a compressed body, without its length.
     """
     req = request.Request(env, self.registry)
     page_maker = self.page_class(req, config=self.config)
@@ -84,25 +145,109 @@ class NewWeb(object):
     if not isinstance(response, Response):
       req.response.text = response
       response = req.response
+    if req.method == 'GET':
+      response.ApplyRange(req.headers.get('range'), req.headers.get('if-range'))
+    if req.is_head:
+      response.DiscardBody(gzip=self.should_compress(req, response))
+    else:
+      self.compress_response(req, response)
     start_response(response.status, response.headerlist)
-    yield response.content
+    if response.file_backed and 'wsgi.file_wrapper' in env:
+      return env['wsgi.file_wrapper'](response.content, BLOCK_SIZE)
+    return response.app_iter
+
+  def compress_response(self, req, response):
+    """Applies gzip content-coding to the response where that is worthwhile.
+
+    Refer to should_compress for the responses that are compressed.
+    """
+    if self.should_compress(req, response):
+      response.Gzip(self.compress_level)
+
+  def should_compress(self, req, response):
+    """Returns whether gzip content-coding should be applied to the response.
+
+    Only bodies of compressible content types are compressed, and only if the
+    client accepts gzip and their size is unknown or above the minimum size.
+    Responses that already have a Content-Encoding and partial responses are
+    left alone. Responses of compressible types get `Vary: Accept-Encoding`.
+
+    File-backed bodies and responses that accept byte ranges (static files) are
+    not compressed either. These are sent as-is through wsgi.file_wrapper, with
+    ranges referring to their bytes; their gzipped version is provided by a
+    precompressed '.gz' sibling file instead, refer to BasePageMaker.Static,
+    which also adds the Vary header for the files that have one.
+    """
+    if (not self.compress_level or response.httpcode in BODILESS_STATUS or
+        response.file_backed or 'Content-Encoding' in response.headers or
+        'Content-Range' in response.headers or
+        response.headers.get('Accept-Ranges', 'none') != 'none'):
+      return False
+    content_type = response.headers.get('Content-Type', '').split(';', 1)[0]
+    if not self.compress_types.get(content_type.strip()):
+      return False
+    response.AddVary('Accept-Encoding')
+    if not req.AcceptsEncoding('gzip'):
+      return False
+    content_length = response.content_length
+    return content_length is None or content_length >= self.compress_minimum
 
   def get_response(self, page_maker, path, method):
     try:
+      handler, args = self.router(path, method)
+      # The handler's body size limit also applies to reads in _PostInit.
+      if hasattr(handler, 'max_body_size'):
+        page_maker.req.max_body_size = handler.max_body_size
+      page_maker.req.CheckBodySize()
       # We're specifically calling _PostInit here as promised in documentation.
       # pylint: disable=W0212
       page_maker._PostInit()
       # pylint: enable=W0212
-      handler, args = self.router(path, method)
-      return getattr(page_maker, handler)(*args)
+      return handler(page_maker, *args)
     except pagemaker.ReloadModules, message:
+      if self.route_cache is not None:
+        self.route_cache.Flush()
       reload_message = reload(sys.modules[self.page_class.__module__])
       return Response(content='%s\n%s' % (message, reload_message))
     except ImmediateResponse as err:
       return err[0]
+    except MethodNotAllowedError as err:
+      return page_maker.MethodNotAllowed(err.allowed)
+    except request.RequestTooLargeError:
+      return page_maker.RequestTooLarge()
     except (NoRouteError, Exception):
       return page_maker.InternalServerError(*sys.exc_info())
 
+  def _ResolveHandler(self, name):
+    """Returns a function that calls the named handler on a given PageMaker.
+
+    Regular methods are returned as the plain function, which takes the
+    PageMaker instance as its first argument. Other attributes (staticmethods
+    and the like) are wrapped so they are bound on the PageMaker when called.
+
+    Raises:
+      UnknownHandlerError: The `page_class` has no callable of this name.
+    """
+    for cls in self.page_class.__mro__:
+      if name in vars(cls):
+        handler = vars(cls)[name]
+        break
+    else:
+      raise UnknownHandlerError('%s has no handler %r' % (
+          self.page_class.__name__, name))
+    if isinstance(handler, types.FunctionType):
+      return handler
+    if not callable(getattr(self.page_class, name)):
+      raise UnknownHandlerError('%s.%s is not callable' % (
+          self.page_class.__name__, name))
+
+    def bound_handler(page_maker, *args):
+      """Calls the handler as bound on the given PageMaker."""
+      return getattr(page_maker, name)(*args)
+    bound_handler.__name__ = name
+    bound_handler.__dict__.update(getattr(self.page_class, name).__dict__)
+    return bound_handler
+
   def serve(self):
     """Sets up and starts WSGI development server for the current app."""
     host = self.config['development'].get('host', 'localhost')
@@ -128,9 +273,12 @@ def router(routes):
 
   The `routes` argument is an iterable of 3-tuples, each of which contain a
   pattern (regex), request methods and the name of the handler to use for matching requests.
+  Routes that accept GET requests implicitly accept HEAD requests as well.
 
-  Before returning the closure, all regexes are compiled, and handler methods
-  are retrieved from the provided `page_class`.
+  Before returning the closure, the routes for each request method are compiled
+  into their own routing.RouteTable, which keeps lookup cost flat as the route
+  table grows. A request for a url that is only routed for other methods raises
+  MethodNotAllowedError, which lists the methods that would be accepted.
 
   Arguments:
     @ routes: iterable of 3-tuples.
@@ -146,13 +294,25 @@ def router(routes):
       pattern, methods, handler = route
     except ValueError:
       pattern, handler = route
-      methods = default_routes
-    req_routes.append((re.compile(pattern + '$', re.UNICODE), methods, handler))
+      methods = default_methods
+    methods = set(methods)
+    if 'GET' in methods:
+      methods.add('HEAD')
+    req_routes.append((pattern, methods, handler))
+  all_methods = set(method for _pattern, methods, _handler in req_routes
+                    for method in methods)
+  method_tables = dict(
+      (method, routing.RouteTable((pattern, handler)
+                                  for pattern, methods, handler in req_routes
+                                  if method in methods))
+      for method in all_methods)
+  any_method_table = routing.RouteTable(
+      (pattern, methods) for pattern, methods, _handler in req_routes)
 
   def request_router(url, method):
     """Returns the appropriate handler and arguments for the given `url`.
 
-    The`url` is matched against the compiled patterns in the `req_routes`
+    The`url` is matched against the route table for the request `method`, as
     provided by the outer scope. Upon finding a pattern that matches, the
     match groups from the regex and the unbound handler method are returned.
 
@@ -163,16 +323,25 @@ def router(routes):
     Arguments:
       @ url: str
         The URL requested by the client.
+      @ method: str
+        The HTTP method of the request.
 
     Raises:
+      MethodNotAllowedError: Patterns match the `url`, but not for `method`.
       NoRouteError: None of the patterns match the requested `url`.
 
     Returns:
       2-tuple: handler method (unbound), and tuple of pattern matches.
     """
-    for pattern, methods, handler in req_routes:
-      match = pattern.match(url)
-      if match and (method in methods):
-        return handler, match.groups()
+    if method in method_tables:
+      match = method_tables[method].Match(url)
+      if match is not None:
+        return match
+    allowed = set()
+    for methods, _groups in any_method_table.MatchAll(url):
+      allowed.update(methods)
+    if allowed:
+      raise MethodNotAllowedError(
+          '%s cannot be handled for %s' % (url, method), allowed)
     raise NoRouteError(url +' cannot be handled')
   return request_router
@@ -2,11 +2,16 @@
 """newWeb PageMaker class and its various Mixins."""
 
 # Standard modules
+import calendar
+import collections
 import datetime
+import email.utils
 import mimetypes
 import os
+import stat
 import sys
 import threading
+import time
 
 # Package modules
 from .. import response
@@ -15,6 +20,25 @@ from .. import templateparser
 RFC_1123_DATE = '%a, %d %b %Y %T GMT'
 
 
+def MaxBodySize(size):
+  """Returns a decorator that sets the maximum request body size of a handler.
+
+  Requests routed to the decorated handler may have a body of at most `size`
+  bytes, rather than the `max_body_size` from the [request] config section.
+  A size of None lifts the limit for the handler.
+  """
+  def decorator(handler):
+    """Sets the maximum request body size on the handler function."""
+    handler.max_body_size = size
+    return handler
+  return decorator
+
+
+def StaticETag(file_stat):
+  """Returns an entity tag for a static file, from its modification and size."""
+  return '"%x-%x"' % (int(file_stat.st_mtime * 1000000), file_stat.st_size)
+
+
 class ReloadModules(Exception):
   """Signals the handler that it should reload the pageclass"""
 
@@ -69,6 +93,113 @@ class CacheStorage(object):
       return self._dict.setdefault(key, default)
 
 
+class StaticFile(object):
+  """Metadata of a static file, and its content when it is cached."""
+  def __init__(self, path, content_type, file_stat, encoding=None):
+    self.path = path
+    self.content = None
+    self.content_type = content_type
+    self.encoding = encoding
+    self.has_variants = False
+    self.mtime = file_stat.st_mtime
+    self.size = file_stat.st_size
+    self.etag = StaticETag(file_stat)
+    self.last_modified = time.strftime(RFC_1123_DATE, time.gmtime(self.mtime))
+    self.checked = time.time()
+
+
+class StaticCache(object):
+  """A process-wide LRU cache for the content of small static files.
+
+  The cache is bounded by the total number of bytes of file content it holds;
+  when adding a file exceeds it, the least recently used files are evicted.
+  Cached files are checked against their modification time and size on disk,
+  but no more often than once every `revalidate` seconds.
+  """
+  def __init__(self, max_bytes, max_file_size, revalidate):
+    """Initializes an empty StaticCache.
+
+    Arguments:
+      @ max_bytes: int
+        The maximum total size of the cached file contents.
+      @ max_file_size: int
+        The maximum size of a single file for it to be cached.
+      @ revalidate: float
+        Minimum number of seconds between checks of a file on disk.
+    """
+    self.max_bytes = max_bytes
+    self.max_file_size = max_file_size
+    self.revalidate = revalidate
+    self.bytes_held = 0
+    self.hits = 0
+    self.misses = 0
+    self._files = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._files)
+
+  def Get(self, key):
+    """Returns the StaticFile cached for `key`, or None.
+
+    Files that have changed on disk since they were cached are removed, and
+    None is returned for them.
+    """
+    with self._lock:
+      static = self._files.pop(key, None)
+      if static is None:
+        self.misses += 1
+        return None
+      self._files[key] = static
+    now = time.time()
+    if now - static.checked > self.revalidate:
+      try:
+        file_stat = os.stat(static.path)
+        changed = (file_stat.st_mtime != static.mtime or
+                   file_stat.st_size != static.size)
+      except OSError:
+        changed = True
+      if changed:
+        with self._lock:
+          self.misses += 1
+          if self._files.get(key) is static:
+            self._Remove(key)
+        return None
+      static.checked = now
+    with self._lock:
+      self.hits += 1
+    return static
+
+  def Set(self, key, static):
+    """Caches the StaticFile under `key`, evicting others when necessary."""
+    size = len(static.content)
+    if size > self.max_file_size or size > self.max_bytes:
+      return
+    with self._lock:
+      if key in self._files:
+        self._Remove(key)
+      while self.bytes_held + size > self.max_bytes:
+        self._Remove(next(iter(self._files)))
+      self._files[key] = static
+      self.bytes_held += size
+
+  def _Remove(self, key):
+    """Removes the file cached for `key`; the caller should hold the lock."""
+    self.bytes_held -= len(self._files.pop(key).content)
+
+  def Flush(self):
+    """Removes all files from the cache."""
+    with self._lock:
+      self._files.clear()
+      self.bytes_held = 0
+
+  @property
+  def hit_ratio(self):
+    """Returns the fraction of lookups answered from the cache."""
+    lookups = self.hits + self.misses
+    return float(self.hits) / lookups if lookups else 0.0
+
+
 class MimeTypeDict(dict):
   """Dictionary that defines special behavior for mimetypes.
 
@@ -163,14 +294,42 @@ class BasePageMaker(object):
         Configuration for the pagemaker, with database connection information
         and other settings. This will be available through `self.options`.
     """
-    self.__SetupPaths()
+    if 'LOCAL_DIR' not in vars(type(self)):
+      self.__SetupPaths()
     self.req = req
-    self.cookies = req.vars['cookie']
-    self.get = req.vars['get']
-    self.post = req.vars['post']
     self.options = config or {}
     self.persistent = self.PERSISTENT
 
+  @property
+  def cookies(self):
+    """Returns the request cookies, which are parsed on first access."""
+    return self.req.vars['cookie']
+
+  @cookies.setter
+  def cookies(self, cookies):
+    """Replaces the request cookies, they are then not parsed at all."""
+    self.req.vars['cookie'] = cookies
+
+  @property
+  def get(self):
+    """Returns the query arguments, which are parsed on first access."""
+    return self.req.vars['get']
+
+  @get.setter
+  def get(self, get):
+    """Replaces the query arguments, they are then not parsed at all."""
+    self.req.vars['get'] = get
+
+  @property
+  def post(self):
+    """Returns the POST data, which is parsed on first access."""
+    return self.req.vars['post']
+
+  @post.setter
+  def post(self, post):
+    """Replaces the POST data, the request body is then not parsed at all."""
+    self.req.vars['post'] = post
+
   def _PostInit(self):
     """Method that gets called for derived classes of BasePageMaker."""
 
@@ -181,6 +340,8 @@ class BasePageMaker(object):
     From the passed in `cls`, it retrieves the filename. Of that path, the
     directory is used as the working directory. Then, the module constants
     PUBLIC_DIR and TEMPLATE_DIR are used to define class constants from.
+
+    This is done once for every class, setting LOCAL_DIR on it marks it as done.
     """
     # Unfortunately, mod_python does not always support retrieving the caller
     # filename using sys.modules. In those cases we need to query the stack.
@@ -211,12 +372,34 @@ class BasePageMaker(object):
     If the config file specificied a [templates] section and a `path` is
     assigned in there, this path will be used.
     Otherwise, the `TEMPLATE_DIR` will be used to load templates from.
+
+    A `cache_dir` in the [templates] section enables the cache of parsed
+    templates, refer to templateparser.TemplateCache.
     """
     if '__parser' not in self.persistent:
+      config = self.options.get('templates', {})
       self.persistent.Set('__parser', templateparser.Parser(
-          self.options.get('templates', {}).get('path', self.TEMPLATE_DIR)))
+          config.get('path', self.TEMPLATE_DIR),
+          cache_dir=config.get('cache_dir') or None))
     return self.persistent.Get('__parser')
 
+  @property
+  def static_cache(self):
+    """Provides the process-wide StaticCache, or None if it is not enabled.
+
+    The cache is configured in the [static] section of the config file:
+      cache_size: Maximum total bytes of cached file content, 0 disables it.
+      cache_file_size: Maximum size of a single cached file (64 KiB).
+      cache_revalidate: Seconds between checks of a file on disk (5).
+    """
+    if '__static_cache' not in self.persistent:
+      config = self.options.get('static', {})
+      max_bytes = int(config.get('cache_size', 0))
+      self.persistent.SetDefault('__static_cache', StaticCache(
+          max_bytes, int(config.get('cache_file_size', 64 * 1024)),
+          float(config.get('cache_revalidate', 5))) if max_bytes else None)
+    return self.persistent.Get('__static_cache')
+
   def InternalServerError(self, exc_type, exc_value, traceback):
     """Returns a plain text notification about an internal server error."""
     error = 'INTERNAL SERVER ERROR (HTTP 500) DURING PROCESSING OF %r' % (
@@ -226,6 +409,26 @@ class BasePageMaker(object):
     return response.Response(
         content=error, content_type='text/plain', httpcode=500)
 
+  def MethodNotAllowed(self, allowed):
+    """Returns a plain text notification that the request method is rejected.
+
+    Arguments:
+      @ allowed: iterable of str
+        The request methods that are accepted for the requested url. These are
+        listed in the required `Allow` header.
+    """
+    message = 'Method %s is not allowed for %r' % (
+        self.req.method, self.req.path)
+    return response.Response(
+        content=message, content_type='text/plain', httpcode=405,
+        headers={'Allow': ', '.join(sorted(allowed))})
+
+  def RequestTooLarge(self):
+    """Returns a plain text notification that the request body is too large."""
+    message = 'Request body for %r exceeds the maximum size' % self.req.path
+    return response.Response(
+        content=message, content_type='text/plain', httpcode=413)
+
   @staticmethod
   def Reload():
     """Raises `ReloadModules`, telling the Handler() to reload its pageclass."""
@@ -236,8 +439,23 @@ class BasePageMaker(object):
 
     The requested `path` is truncated against a root (removing any uplevels),
     and then added to the working dir + PUBLIC_DIR. If the request file exists,
-    then the requested file is retrieved, its mimetype guessed, and returned
-    to the client performing the request.
+    then the requested file is opened, its mimetype guessed, and returned
+    to the client performing the request. The file is not read here, but
+    streamed by the WSGI server (using wsgi.file_wrapper where available).
+
+    The response has ETag and Last-Modified headers based on the file's stat
+    data. Conditional requests for a file that was not modified are answered
+    with a 304 response, without opening the file.
+
+    When the [static] config section sets a `cache_size` (in bytes), small files
+    are kept in memory in a process-wide StaticCache; refer to `static_cache`.
+
+    Clients that accept gzip content-coding are sent a precompressed version of
+    the file if it exists next to it, with '.gz' added to the filename. Both
+    versions of such a file are sent with `Vary: Accept-Encoding`.
+
+    Static files accept byte range requests, for which only the requested
+    parts of the file are read and sent (refer to Response.ApplyRange).
 
     Should the requested file not exist, a 404 page is returned instead.
 
@@ -250,19 +468,100 @@ class BasePageMaker(object):
             page if the file was not available on the local path.
     """
     rel_path = os.path.abspath(os.path.join(os.path.sep, rel_path))[1:]
+    accepts_gzip = self.req.AcceptsEncoding('gzip')
+    cache = self.static_cache
+    if cache is not None:
+      cache_key = self.PUBLIC_DIR, rel_path, accepts_gzip
+      static = cache.Get(cache_key)
+      if static is not None:
+        if self._StaticNotModified(static.etag, static.mtime):
+          return self._StaticResponse(static, None)
+        return self._StaticResponse(static, static.content)
     abs_path = os.path.join(self.PUBLIC_DIR, rel_path)
     try:
-      with file(abs_path) as staticfile:
-        content_type, _encoding = mimetypes.guess_type(abs_path)
-        if not content_type:
-          content_type = 'text/plain'
-        cache_days = self.CACHE_DURATION.get(content_type, 0)
-        expires = datetime.datetime.utcnow() + datetime.timedelta(cache_days)
-        return response.Response(content=staticfile.read(),
-                        content_type=content_type,
-                        headers={'Expires': expires.strftime(RFC_1123_DATE)})
+      file_stat = os.stat(abs_path)
+    except OSError:
+      return self._StaticNotFound(rel_path)
+    if not stat.S_ISREG(file_stat.st_mode):
+      return self._StaticNotFound(rel_path)
+    content_type, _encoding = mimetypes.guess_type(abs_path)
+    static = StaticFile(abs_path, content_type or 'text/plain', file_stat)
+    precompressed = self._StaticPrecompressed(static)
+    if precompressed is not None:
+      static.has_variants = precompressed.has_variants = True
+      if accepts_gzip:
+        static = precompressed
+    if self._StaticNotModified(static.etag, static.mtime):
+      return self._StaticResponse(static, None)
+    try:
+      staticfile = open(static.path, 'rb')
     except IOError:
       return self._StaticNotFound(rel_path)
+    if cache is not None and static.size <= cache.max_file_size:
+      with staticfile:
+        static.content = staticfile.read()
+      cache.Set(cache_key, static)
+      return self._StaticResponse(static, static.content)
+    return self._StaticResponse(static, staticfile)
+
+  def _StaticResponse(self, static, content):
+    """Returns the response for a StaticFile, with its caching headers.
+
+    The `content` is the file content or an open file. If it is None, the
+    client's cached copy is current and a bodiless 304 response is returned.
+    """
+    cache_days = self.CACHE_DURATION.get(static.content_type, 0)
+    expires = datetime.datetime.utcnow() + datetime.timedelta(cache_days)
+    headers = {'Accept-Ranges': 'bytes',
+               'ETag': static.etag,
+               'Expires': expires.strftime(RFC_1123_DATE),
+               'Last-Modified': static.last_modified}
+    if static.encoding is not None:
+      headers['Content-Encoding'] = static.encoding
+    if static.has_variants:
+      headers['Vary'] = 'Accept-Encoding'
+    if content is None:
+      return response.Response(
+          content_type=static.content_type, httpcode=304, headers=headers)
+    return response.Response(
+        content=content, content_type=static.content_type, headers=headers)
+
+  @staticmethod
+  def _StaticPrecompressed(static):
+    """Returns a StaticFile for the gzipped sibling of the given static file.
+
+    The sibling has the same name, with '.gz' appended. It is only used if it
+    is at least as recent as the uncompressed file, otherwise None is returned.
+    """
+    gzip_path = static.path + '.gz'
+    try:
+      gzip_stat = os.stat(gzip_path)
+    except OSError:
+      return None
+    if stat.S_ISREG(gzip_stat.st_mode) and gzip_stat.st_mtime >= static.mtime:
+      return StaticFile(gzip_path, static.content_type, gzip_stat, 'gzip')
+    return None
+
+  def _StaticNotModified(self, etag, mtime):
+    """Returns whether the client's cached copy of a static file is current.
+
+    When the request has an If-None-Match header, the file is not modified if
+    its ETag is listed (or the header is '*'). Otherwise, an If-Modified-Since
+    date at or after the file's modification time means it is not modified.
+    """
+    if_none_match = self.req.headers.get('if-none-match')
+    if if_none_match is not None:
+      if if_none_match.strip() == '*':
+        return True
+      client_tags = (tag.strip() for tag in if_none_match.split(','))
+      return any((tag[2:] if tag.startswith('W/') else tag) == etag
+                 for tag in client_tags)
+    if_modified_since = self.req.headers.get('if-modified-since')
+    if if_modified_since is not None:
+      parsed = email.utils.parsedate(if_modified_since.split(';', 1)[0])
+      if parsed is not None:
+        return int(mtime) <= calendar.timegm(parsed)
+    return False
 
   def _StaticNotFound(self, _path):
     message = 'This is not the path you\'re looking for. No such file %r' % (
@@ -6,56 +6,360 @@ import cgi
 import cStringIO
 import Cookie as cookie
 import re
+import tempfile
+import urllib
+
+# Third-party modules
+import simplejson
 
 # newWeb modules
 from . import response
 
+# Number of bytes read from the request body at once.
+CHUNK_SIZE = 64 * 1024
+# Uploaded files larger than this many bytes are spooled to disk.
+SPOOL_SIZE = 1024 * 1024
+# Field names in the form 'foo[bar]', which are grouped in a dictionary 'foo'.
+FIELD_AS_ARRAY = re.compile(r'(.*)\[(.*)\]')
+# Decoder for JSON request bodies, and the whitespace it allows between values.
+JSON_DECODER = simplejson.JSONDecoder()
+JSON_WHITESPACE = ' \t\n\r'
+JSON_ITEM_ENDS = frozenset(JSON_WHITESPACE + ',]')
+# Request headers that WSGI provides without the 'HTTP_' prefix.
+UNPREFIXED_HEADERS = frozenset(('CONTENT_LENGTH', 'CONTENT_TYPE'))
+# Upper limit on the number of header names kept in the name mapping tables.
+HEADER_NAMES_MAX = 512
+# Placeholder for request attributes that have not been computed yet.
+NOT_LOADED = object()
+# Percent-escaped separators of fields, names and values in urlencoded data.
+ESCAPED_SEPARATORS = re.compile('%(26|3[BbDd])')
+# A name=value pair of a Cookie header, the value may be a quoted string.
+COOKIE_PAIR = re.compile(r'''
+    ([^=;]*)                            # name
+    (?:=\s*(                            # optional value:
+      "(?:[^"\\]|\\.)*"(?=\s*(?:;|$))     # quoted string ending the pair
+      |[^;]*))?                         # or plain text
+    (?:;|$)                             # end of pair''', re.VERBOSE)
+
+
+class Error(Exception):
+  """Superclass used for inheritance and external exception handling."""
+
+
+class MultipartError(Error, ValueError):
+  """The request body is not valid multipart/form-data."""
+
+
+class RequestTooLargeError(Error):
+  """The request body is larger than the configured maximum body size."""
+
+
+class CookieDict(dict):
+  """Dictionary of the cookie names and values of a request's Cookie header.
+
+  The header is parsed without creating Morsel objects. Following RFC 2965, the
+  first occurrence of a cookie name is the most specific one and is kept, rather
+  than overwritten by later ones. Cookie attributes (names starting with a
+  dollar sign, or reserved ones like 'path') are not cookies and are skipped.
+
+  Quoted values may contain semicolons, and are decoded as SimpleCookie does.
+  Decoding happens eagerly while parsing: only quoted values need it, which is
+  rare and cheap, and storing the decoded values in a plain dictionary keeps
+  every dictionary method (get, items, iteration, copying) consistent.
+
+  Headers without any quotes are split on semicolons, which is much faster than
+  tokenizing them with the COOKIE_PAIR regex.
+  """
+  def __init__(self, header=None):
+    super(CookieDict, self).__init__()
+    if header:
+      self._Parse(header)
+
+  def _Parse(self, header):
+    """Adds the cookies in the header that are not already present."""
+    reserved = cookie.Morsel._reserved
+    if '"' in header:
+      pairs = (match.groups() for match in COOKIE_PAIR.finditer(header))
+    else:
+      pairs = (pair.partition('=')[::2] if '=' in pair else (pair, None)
+               for pair in header.split(';'))
+    for name, value in pairs:
+      if value is None:
+        continue
+      name = name.strip()
+      if not name or name in self or name[0] == '$' or name.lower() in reserved:
+        continue
+      value = value.strip()
+      if len(value) > 1 and value[0] == value[-1] == '"':
+        value = cookie._unquote(value)
+      self[name] = value
+
+
+class LazyRequestVars(object):
+  """Provides the request variables, parsing each kind on first access.
+
+  The kinds of variables are 'cookie', 'get' and 'post'. Each of these is
+  parsed by the loader function given for it, only when it is first requested.
+  After that, the parsed result is kept and returned on every next access.
+  """
+  def __init__(self, loaders):
+    self._loaders = loaders
+    self._values = {}
+
+  # ############################################################################
+  # Methods for delayed value retrieval
+  #
+  def __getitem__(self, key):
+    try:
+      return self._values[key]
+    except KeyError:
+      return self._values.setdefault(key, self._loaders[key]())
+
+  def __setitem__(self, key, value):
+    self._values[key] = value
+
+  # ############################################################################
+  # Methods for minimum dictionary likeness
+  #
+  def __contains__(self, key):
+    return key in self._loaders or key in self._values
+
+  def __iter__(self):
+    return iter(set(self._loaders).union(self._values))
 
-class Cookie(cookie.SimpleCookie):
-  """Cookie class that uses the most specific value for a cookie name.
+  def get(self, key, default=None):
+    """Returns the value for the given key, or the default if it's unknown."""
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def iteritems(self):
+    """Returns an iterator for the items of the LazyRequestVars dict."""
+    return ((key, self[key]) for key in self)
+
+  def iterkeys(self):
+    """Returns an iterator for the keys of the LazyRequestVars dict."""
+    return iter(self)
+
+  def itervalues(self):
+    """Returns an iterator for the values of the LazyRequestVars dict."""
+    return (self[key] for key in self)
+
+  def items(self):
+    """Returns a list with the items of the LazyRequestVars dict."""
+    return list(self.iteritems())
+
+  def keys(self):
+    """Returns a list with the keys of the LazyRequestVars dict."""
+    return list(self)
+
+  def values(self):
+    """Returns a list with the values of the LazyRequestVars dict."""
+    return list(self.itervalues())
 
-  According to RFC2965 (http://tools.ietf.org/html/rfc2965):
-      If multiple cookies satisfy the criteria above, they are ordered in
-      the Cookie header such that those with more specific Path attributes
-      precede those with less specific.  Ordering with respect to other
-      attributes (e.g., Domain) is unspecified.
 
-  This class adds this behaviour to cookie parsing. That is, a key:value pair
-  WILL NOT overwrite an already existing (and thus more specific) pair.
+class EnvironHeaders(object):
+  """Case-insensitive, read-only view of the request headers in a WSGI env.
 
-  N.B.: this class assumes the given cookie to follow the standards outlined in
-  the RFC. At the moment (2011Q1) this assumption proves to be correct for both
-  Chromium (and likely Webkit in general) and Firefox. Other browsers have not
-  been testsed, and might possibly deviate from the suggested standard.
-  As such, it's recommended not to re-use the cookie name with different values
-  for different paths.
+  Header names are translated to their environment keys on lookup ('Accept'
+  to 'HTTP_ACCEPT'), so no dictionary of headers is built for the request. The
+  translations in both directions are kept in mapping tables shared by all
+  requests, which are bounded to the HEADER_NAMES_MAX most recent names.
+  Iteration yields lowercase header names.
   """
-  # Unfortunately this works by redefining a private method.
-  def _BaseCookie__set(self, key, real_value, coded_value):
-    """Inserts a morsel into the Cookie, strictly on the first occurrance."""
-    if key not in self:
-      morsel = cookie.Morsel()
-      morsel.set(key, real_value, coded_value)
-      dict.__setitem__(self, key, morsel)
+  ENV_KEYS = {}
+  HEADER_NAMES = {}
+
+  def __init__(self, env):
+    self.env = env
+
+  @classmethod
+  def EnvKey(cls, name):
+    """Returns the WSGI environment key for the given header name."""
+    try:
+      return cls.ENV_KEYS[name]
+    except KeyError:
+      key = name.upper().replace('-', '_')
+      if key not in UNPREFIXED_HEADERS:
+        key = 'HTTP_' + key
+      if len(cls.ENV_KEYS) >= HEADER_NAMES_MAX:
+        cls.ENV_KEYS.clear()
+      cls.ENV_KEYS[name] = key
+      return key
+
+  @classmethod
+  def HeaderName(cls, key):
+    """Returns the lowercase header name for a WSGI environment key.
+
+    Returns None for environment keys that do not hold a request header.
+    """
+    try:
+      return cls.HEADER_NAMES[key]
+    except KeyError:
+      if key.startswith('HTTP_'):
+        name = key[5:].lower().replace('_', '-')
+      elif key in UNPREFIXED_HEADERS:
+        name = key.lower().replace('_', '-')
+      else:
+        name = None
+      if len(cls.HEADER_NAMES) >= HEADER_NAMES_MAX:
+        cls.HEADER_NAMES.clear()
+      cls.HEADER_NAMES[key] = name
+      return name
+
+  # ############################################################################
+  # Methods for minimum dictionary likeness
+  #
+  def __contains__(self, name):
+    return self.EnvKey(name) in self.env
+
+  def __getitem__(self, name):
+    try:
+      return self.env[self.EnvKey(name)]
+    except KeyError:
+      raise KeyError(name)
+
+  def __iter__(self):
+    for key in self.env:
+      name = self.HeaderName(key)
+      if name is not None:
+        yield name
+
+  def __len__(self):
+    return sum(1 for _name in self)
+
+  def __repr__(self):
+    return '%s(%r)' % (type(self).__name__, dict(self.iteritems()))
+
+  def get(self, name, default=None):
+    """Returns the value of the given header, or the default if it's absent."""
+    return self.env.get(self.EnvKey(name), default)
+
+  def iteritems(self):
+    """Returns an iterator for the header names and values."""
+    for key, value in self.env.iteritems():
+      name = self.HeaderName(key)
+      if name is not None:
+        yield name, value
+
+  def iterkeys(self):
+    """Returns an iterator for the header names."""
+    return iter(self)
+
+  def itervalues(self):
+    """Returns an iterator for the header values."""
+    return (value for _name, value in self.iteritems())
+
+  def items(self):
+    """Returns a list with the header names and values."""
+    return list(self.iteritems())
+
+  def keys(self):
+    """Returns a list with the header names."""
+    return list(self)
+
+  def values(self):
+    """Returns a list with the header values."""
+    return list(self.itervalues())
 
 
 class Request(object):
+  """The request as received from the WSGI server.
+
+  Request headers, cookies, query arguments and POST data are parsed lazily,
+  when they are first used, so that the request setup cost scales with what the
+  request handler actually uses. The same goes for JSON request bodies, which
+  are available decoded as `json`.
+  """
   def __init__(self, env, registry):
     self.env = env
-    self.headers = dict(self.headers_from_env(env))
     self.registry = registry
+    self._body = None
+    self._json = NOT_LOADED
+    self._headers = None
     self._out_headers = []
     self._out_status = 200
     self._response = None
+    self.max_body_size = getattr(registry, 'max_body_size', None)
 
     # `self.vars` setup, will contain keys 'cookie', 'get' and 'post'
-    self.vars = {'cookie': dict((name, value.value) for name, value in
-                                Cookie(self.env.get('HTTP_COOKIE')).items()),
-                 'get': QueryArgsDict(cgi.parse_qs(self.env['QUERY_STRING']))}
-    if self.env['REQUEST_METHOD'] == 'POST':
-      self.vars['post'] = ParseForm(env['wsgi.input'], env)
-    else:
-      self.vars['post'] = IndexedFieldStorage()
+    self.vars = LazyRequestVars({'cookie': self._ParseCookies,
+                                 'get': self._ParseQueryString,
+                                 'post': self._ParsePost})
+
+  def _ParseCookies(self):
+    """Returns a dictionary of the cookie names and values in the request."""
+    return CookieDict(self.env.get('HTTP_COOKIE'))
+
+  def _ParsePost(self):
+    """Returns the parsed POST data, empty for requests of other methods.
+
+    The body may not exceed the request's `max_body_size`. The size above which
+    uploaded files are spooled to disk is taken from the registry, as set up by
+    NewWeb.
+    """
+    if self.env['REQUEST_METHOD'] != 'POST' or self.is_json:
+      return IndexedFieldStorage.FromFields(())
+    stream = self.env['wsgi.input']
+    if self._body is not None:
+      stream = cStringIO.StringIO(self._body)
+    return ParseForm(
+        stream, self.env, max_size=self.max_body_size,
+        spool_size=getattr(self.registry, 'spool_size', SPOOL_SIZE))
+
+  def _ParseQueryString(self):
+    """Returns the parsed query arguments of the request."""
+    return ParseUrlencoded(
+        self.env['QUERY_STRING'], indexed=False, encoding=None)
+
+  @property
+  def body(self):
+    """Returns the raw request body, which is read on first access.
+
+    Raises:
+      RequestTooLargeError: The body exceeds the request's `max_body_size`.
+    """
+    if self._body is None:
+      self._body = self._BodyReader().read()
+    return self._body
+
+  @property
+  def is_head(self):
+    """Returns whether this is a HEAD request.
+
+    HEAD requests are routed to the handlers for GET, and their response body
+    is dropped before it is sent. Handlers may check this to skip rendering the
+    body; the response then only has a Content-Length if the handler sets it.
+    """
+    return self.env['REQUEST_METHOD'] == 'HEAD'
+
+  @property
+  def is_json(self):
+    """Returns whether the request body has a JSON content type."""
+    content_type = self.env.get('CONTENT_TYPE', '').split(';', 1)[0].strip()
+    return content_type == 'application/json' or content_type.endswith('+json')
+
+  @property
+  def json(self):
+    """Returns the decoded JSON request body, None for other content types.
+
+    The body is decoded on first access, directly from the `body` buffer.
+
+    Raises:
+      RequestTooLargeError: The body exceeds the request's `max_body_size`.
+      ValueError: The request body is not valid JSON.
+    """
+    if self._json is NOT_LOADED:
+      self._json = simplejson.loads(self.body) if self.is_json else None
+    return self._json
+
+  @property
+  def headers(self):
+    """Returns a case-insensitive view of the request headers in the env."""
+    if self._headers is None:
+      self._headers = EnvironHeaders(self.env)
+    return self._headers
 
   @property
   def path(self):
@@ -77,13 +381,68 @@ class Request(object):
       self._response = response.Response()
     return self._response
 
-  def headers_from_env(self, env):
-    for key, value in env.iteritems():
-      if key.startswith('HTTP_'):
-        yield key[5:].lower().replace('_', '-'), value
+  def _BodyReader(self):
+    """Returns a BodyReader for the request body, if it is within limits."""
+    length = BodyLength(self.env)
+    CheckBodySize(length, self.max_body_size)
+    return BodyReader(self.env['wsgi.input'], length, self.max_body_size)
+
+  def IterJSON(self):
+    """Returns an iterator over the items of a JSON array request body.
+
+    Unless the body has already been read, it is decoded incrementally while
+    it is read from the input stream, and is not kept afterwards. This allows
+    handling large arrays without holding their full text in memory.
+
+    Raises:
+      RequestTooLargeError: The body exceeds the request's `max_body_size`.
+      ValueError: The request body is not a valid JSON array.
+    """
+    if self._body is not None:
+      return IterJSONArray(cStringIO.StringIO(self._body))
+    return IterJSONArray(self._BodyReader())
+
+  def CheckBodySize(self):
+    """Rejects a request body that is known to exceed `max_body_size`.
+
+    The `max_body_size` starts out as the global maximum from the registry,
+    NewWeb replaces it with that of the routed handler (if it has one) and
+    calls this before the handler runs. Chunked bodies are checked as they are
+    read instead.
+
+    Raises:
+      RequestTooLargeError: The Content-Length exceeds the maximum body size.
+    """
+    CheckBodySize(BodyLength(self.env), self.max_body_size)
+
+  def AcceptsEncoding(self, coding):
+    """Returns whether the client's Accept-Encoding allows the content-coding.
+
+    Codings with a quality value of 0 are refused. A coding that is not listed
+    explicitly is accepted if the wildcard '*' is.
+    """
+    qualities = {}
+    for item in self.headers.get('accept-encoding', '').split(','):
+      name, _sep, params = item.partition(';')
+      quality = 1.0
+      for param in params.split(';'):
+        key, _sep, value = param.strip().partition('=')
+        if key.strip().lower() == 'q':
+          try:
+            quality = float(value)
+          except ValueError:
+            quality = 0.0
+      qualities[name.strip().lower()] = quality
+    if coding in qualities:
+      return qualities[coding] > 0
+    return qualities.get('*', 0) > 0
 
   def AddCookie(self, key, value, **attrs):
-    """Adds a new cookie header to the repsonse.
+    """Adds a new cookie to the response.
+
+    Cookies are collected on the response and rendered into Set-Cookie headers
+    when the response is served, so any number of cookies can be set. Setting
+    a cookie again (with the same path and domain) replaces it.
 
     Arguments:
       @ key: str
@@ -112,13 +471,13 @@ class Request(object):
         When True, the cookie is only used for http(s) requests, and is not
         accessible through Javascript (DOM).
     """
-    new_cookie = Cookie({key.encode('ascii'): value})
-    if 'max_age' in attrs:
-      attrs['max-age'] = attrs.pop('max_age')
-    new_cookie[key].update(attrs)
-    self.AddHeader('Set-Cookie', new_cookie[key].OutputString())
+    self.response.SetCookie(key, value, **attrs)
 
   def AddHeader(self, name, value):
+    """Sets a header on the response, replacing earlier values of the header.
+
+    Repeated headers can be added with the `Add` method of response.headers.
+    """
     self.response.headers[name] = value
 
 
@@ -134,30 +493,279 @@ class IndexedFieldStorage(cgi.FieldStorage):
        Multiple occurrances of 'foo[bar]' will result in unspecified behavior.
     3) Automatically attempts to parse all input as UTF8. This is the proposed
        standard as of 2005: http://tools.ietf.org/html/rfc3986.
+
+  The parsed fields are kept in a QueryArgsDict of value lists; the items that
+  cgi.FieldStorage works with are only created for item access (`storage[key]`)
+  or the `list` attribute.
   """
-  FIELD_AS_ARRAY = re.compile(r'(.*)\[(.*)\]')
+  FIELD_AS_ARRAY = FIELD_AS_ARRAY
+  # QueryArgsDict of the parsed fields; the cgi.FieldStorage item list is only
+  # built from this when it is needed.
+  fields = None
+
+  def __getattr__(self, name):
+    if name == 'list' and self.fields is not None:
+      self.list = [value if isinstance(value, MultipartFile) else
+                   cgi.MiniFieldStorage(key, value)
+                   for key, values in self.fields.iteritems()
+                   for value in values]
+      return self.list
+    return cgi.FieldStorage.__getattr__(self, name)
+
+  def __contains__(self, key):
+    if self.fields is None:
+      return cgi.FieldStorage.__contains__(self, key)
+    return key in self.fields
+
+  def __nonzero__(self):
+    if self.fields is None:
+      return cgi.FieldStorage.__nonzero__(self)
+    return bool(self.fields)
+
+  def getfirst(self, key, default=None):
+    """Returns the first value for the requested key, or a fallback value."""
+    if self.fields is None:
+      return cgi.FieldStorage.getfirst(self, key, default)
+    if key not in self.fields:
+      return default
+    return _FieldValue(self.fields[key][0])
+
+  def getlist(self, key):
+    """Returns a list with all values that were given for the requested key."""
+    if self.fields is None:
+      return cgi.FieldStorage.getlist(self, key)
+    return map(_FieldValue, self.fields.get(key, ()))
+
+  def has_key(self, key):
+    return key in self
+
   def iteritems(self):
     return ((key, self.getlist(key)) for key in self)
 
   def items(self):
     return list(self.iteritems())
 
+  def keys(self):
+    if self.fields is None:
+      return cgi.FieldStorage.keys(self)
+    return self.fields.keys()
+
+  @classmethod
+  def FromFields(cls, fields):
+    """Returns an IndexedFieldStorage holding the given fields.
+
+    Arguments:
+      @ fields: iterable of 2-tuples
+        Each tuple is a field name and its (already decoded) value.
+    """
+    storage = cls(fp=cStringIO.StringIO(), environ={
+        'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': '0',
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded'})
+    storage.SetFields(GroupFields(fields))
+    return storage
+
+  def SetFields(self, fields):
+    """Replaces the contents of the storage with the given QueryArgsDict."""
+    self.fields = fields
+    # Drop the item list, so that it is rebuilt from the fields when used.
+    self.__dict__.pop('list', None)
+
   def read_urlencoded(self):
-    indexed = {}
-    self.list = []
-    for field, value in cgi.parse_qsl(self.fp.read(self.length),
-                                      self.keep_blank_values,
-                                      self.strict_parsing):
-      if self.FIELD_AS_ARRAY.match(field):
-        field_group, field_key = self.FIELD_AS_ARRAY.match(field).groups()
-        indexed.setdefault(field_group, cgi.MiniFieldStorage(field_group, {}))
-        indexed[field_group].value[field_key] = value.decode('utf8')
-      else:
-        self.list.append(cgi.MiniFieldStorage(field, value.decode('utf8')))
-    self.list = indexed.values() + self.list
+    self.SetFields(ParseUrlencoded(self.fp.read(self.length),
+                                   keep_blank_values=self.keep_blank_values))
     self.skip_lines()
 
 
+class BodyReader(object):
+  """Reads a request body from the input stream, enforcing its maximum size.
+
+  At most `length` bytes are read from the stream, or everything up to its end
+  when the length is not known in advance (chunked request bodies). The bytes
+  are counted as they are read, and RequestTooLargeError is raised as soon as
+  the count goes beyond the maximum size, without reading the rest.
+  """
+  def __init__(self, stream, length, max_size=None):
+    """Initializes a BodyReader for the given input stream.
+
+    Arguments:
+      @ stream: file-like
+        The stream to read the request body from (typically `wsgi.input`).
+      @ length: int / None
+        The length of the request body, None if it is unknown.
+      % max_size: int ~~ None
+        The maximum size of the request body in bytes. None means unlimited.
+    """
+    self.stream = stream
+    self.length = length
+    self.max_size = max_size
+    self.count = 0
+
+  def read(self, size=-1):
+    """Returns up to `size` bytes of the body, all of what is left by default.
+
+    Raises:
+      RequestTooLargeError: More than the maximum size has been read.
+    """
+    if size < 0:
+      return ''.join(iter(lambda: self.read(CHUNK_SIZE), ''))
+    if self.length is not None:
+      size = min(size, self.length - self.count)
+    if self.max_size is not None:
+      # Read one byte beyond the maximum, so that an excess is noticed.
+      size = min(size, self.max_size + 1 - self.count)
+    if size <= 0:
+      return ''
+    data = self.stream.read(size)
+    self.count += len(data)
+    if self.max_size is not None and self.count > self.max_size:
+      raise RequestTooLargeError(
+          'Request body exceeds the maximum of %d bytes' % self.max_size)
+    return data
+
+
+class MultipartFile(object):
+  """A file uploaded in a multipart/form-data request body.
+
+  The attributes match those of the file fields of cgi.FieldStorage, so the
+  contents are available as `file` (positioned at the start) and `value`.
+  """
+  def __init__(self, name, filename, content_type, headers, fileobj):
+    self.name = name
+    self.filename = filename
+    self.type = content_type
+    self.headers = headers
+    self.file = fileobj
+
+  def __repr__(self):
+    return '%s(%r, %r)' % (type(self).__name__, self.name, self.filename)
+
+  @property
+  def value(self):
+    """Returns the full contents of the uploaded file."""
+    self.file.seek(0)
+    value = self.file.read()
+    self.file.seek(0)
+    return value
+
+
+class MultipartParser(object):
+  """Streaming parser for multipart/form-data request bodies.
+
+  The body is read from the input stream in chunks of fixed size, and never
+  more than the given length is read. Only the part of the body that is being
+  searched for a boundary is kept in the buffer. The contents of file parts
+  are written to a tempfile.SpooledTemporaryFile, which moves to disk once it
+  grows beyond `spool_size` bytes. Other fields are kept in memory.
+  """
+  def __init__(self, stream, boundary, length,
+               spool_size=SPOOL_SIZE, chunk_size=CHUNK_SIZE):
+    """Initializes a MultipartParser for the given input stream.
+
+    Arguments:
+      @ stream: file-like
+        The stream to read the request body from.
+      @ boundary: str
+        The boundary parameter of the multipart/form-data content type.
+      @ length: int / None
+        The number of bytes to read from the stream, None to read until the
+        end of the stream (for chunked request bodies).
+      % spool_size: int ~~ SPOOL_SIZE
+        Uploaded files larger than this are spooled to a temporary file.
+      % chunk_size: int ~~ CHUNK_SIZE
+        The number of bytes to read from the stream at once.
+    """
+    self.stream = stream
+    self.remaining = length
+    self.spool_size = spool_size
+    self.chunk_size = chunk_size
+    self.delimiter = '\r\n--' + boundary
+    # The first boundary is not preceded by a line break, add one to match it.
+    self.buffer = '\r\n'
+
+  def __iter__(self):
+    """Yields a (name, value) tuple for every part of the body.
+
+    The value of a file part is a MultipartFile, that of others a string.
+    """
+    self._ReadUntil(self.delimiter, None)
+    while True:
+      self._Fill(2)
+      if self.buffer.startswith('--'):
+        return
+      self._ReadUntil('\r\n', None)
+      headers = self._ReadHeaders()
+      _disposition, params = cgi.parse_header(
+          headers.get('content-disposition', ''))
+      name = params.get('name', '')
+      if 'filename' in params:
+        fileobj = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        self._ReadUntil(self.delimiter, fileobj.write)
+        fileobj.seek(0)
+        yield name, MultipartFile(
+            name, params['filename'],
+            headers.get('content-type', 'application/octet-stream'),
+            headers, fileobj)
+      else:
+        value = []
+        self._ReadUntil(self.delimiter, value.append)
+        yield name, ''.join(value)
+
+  def _Fill(self, size):
+    """Reads from the stream until the buffer holds at least `size` bytes."""
+    while len(self.buffer) < size:
+      if not self._Read():
+        raise MultipartError('Unexpected end of multipart data')
+
+  def _Read(self):
+    """Adds the next chunk of the stream to the buffer, if there is any left."""
+    if self.remaining is None:
+      chunk = self.stream.read(self.chunk_size)
+    elif self.remaining > 0:
+      chunk = self.stream.read(min(self.chunk_size, self.remaining))
+    else:
+      return False
+    if not chunk:
+      self.remaining = 0
+      return False
+    if self.remaining is not None:
+      self.remaining -= len(chunk)
+    self.buffer += chunk
+    return True
+
+  def _ReadHeaders(self):
+    """Returns a dictionary of the part headers, with lowercase names."""
+    headers = {}
+    while True:
+      line = []
+      self._ReadUntil('\r\n', line.append)
+      line = ''.join(line)
+      if not line:
+        return headers
+      name, _sep, value = line.partition(':')
+      headers[name.strip().lower()] = value.strip()
+
+  def _ReadUntil(self, marker, sink):
+    """Consumes the input up to and including `marker`.
+
+    Everything before the marker is passed to the `sink` function (if any) as
+    it becomes available, holding back only what might be the marker's start.
+    """
+    while True:
+      index = self.buffer.find(marker)
+      if index >= 0:
+        if sink is not None and index:
+          sink(self.buffer[:index])
+        self.buffer = self.buffer[index + len(marker):]
+        return
+      keep = len(marker) - 1
+      if len(self.buffer) > keep:
+        if sink is not None:
+          sink(self.buffer[:-keep])
+        self.buffer = self.buffer[-keep:]
+      if not self._Read():
+        raise MultipartError('Unexpected end of multipart data')
+
+
 class QueryArgsDict(dict):
   def getfirst(self, key, default=None):
     """Returns the first value for the requested key, or a fallback value."""
@@ -177,13 +785,218 @@ class QueryArgsDict(dict):
       return []
 
 
-def ParseForm(file_handle, environ):
+def ParseForm(file_handle, environ, max_size=None, spool_size=SPOOL_SIZE):
   """Returns an IndexedFieldStorage object from the POST data and environment.
 
-  This small wrapper is necessary because cgi.FieldStorage assumes that the
-  provided file handles supports .readline() iteration. File handles as provided
-  by BaseHTTPServer do not support this, so we need to convert them to proper
-  cStringIO objects first.
+  Multipart bodies are parsed by a MultipartParser while they are read from the
+  `file_handle`, so uploaded files are never held in memory as a whole. Other
+  bodies are read in full before parsing, because cgi.FieldStorage assumes that
+  the provided file handles supports .readline() iteration. File handles as
+  provided by BaseHTTPServer do not support this, so we need to convert them to
+  proper cStringIO objects first.
+
+  Arguments:
+    @ file_handle: file-like
+      The stream to read the request body from (typically `wsgi.input`).
+    @ environ: dict
+      The WSGI environment of the request.
+    % max_size: int ~~ None
+      The maximum size of the request body in bytes. None means unlimited.
+    % spool_size: int ~~ SPOOL_SIZE
+      Uploaded files larger than this many bytes are spooled to disk.
+
+  Raises:
+    RequestTooLargeError: The body exceeds `max_size`. If its length is given,
+        none of it is read; chunked bodies are read up to the maximum size.
+    MultipartError: The multipart body is malformed.
   """
-  data = cStringIO.StringIO(file_handle.read(int(environ['CONTENT_LENGTH'])))
+  length = BodyLength(environ)
+  CheckBodySize(length, max_size)
+  body = BodyReader(file_handle, length, max_size=max_size)
+  content_type, params = cgi.parse_header(environ.get('CONTENT_TYPE', ''))
+  if content_type == 'multipart/form-data':
+    if not params.get('boundary'):
+      raise MultipartError('Multipart request body without boundary')
+    parser = MultipartParser(
+        body, params['boundary'], length, spool_size=spool_size)
+    return IndexedFieldStorage.FromFields(
+        (name, value.decode('utf8') if isinstance(value, str) else value)
+        for name, value in parser)
+  data = cStringIO.StringIO(body.read())
   return IndexedFieldStorage(fp=data, environ=environ)
+
+
+def BodyLength(environ):
+  """Returns the length of the request body, or None for chunked bodies.
+
+  Without a chunked Transfer-Encoding or a Content-Length, a request has no body
+  and its length is 0.
+  """
+  if 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+    return None
+  return int(environ.get('CONTENT_LENGTH') or 0)
+
+
+def CheckBodySize(length, max_size):
+  """Raises RequestTooLargeError if the body `length` exceeds `max_size`.
+
+  Bodies of unknown length (None) and unlimited sizes (None) pass this check;
+  the former are limited while they are read by a BodyReader.
+  """
+  if None not in (length, max_size) and length > max_size:
+    raise RequestTooLargeError(
+        'Request body of %d bytes exceeds the maximum of %d' % (
+            length, max_size))
+
+
+def GroupFields(fields, indexed=True):
+  """Returns a QueryArgsDict with a list of values for each field name.
+
+  Fields named in the form 'foo[bar]' are grouped in a dictionary, which is the
+  first value for 'foo'. Multiple occurrances of 'foo[bar]' will result in the
+  last value for 'bar' being kept.
+
+  Arguments:
+    @ fields: iterable of 2-tuples
+      Each tuple is a field name and its value, in the order they were given.
+    % indexed: bool ~~ True
+      Whether to group fields in the form 'foo[bar]' in a dictionary.
+  """
+  grouped = QueryArgsDict()
+  groups = {}
+  for name, value in fields:
+    if indexed and ']' in name:
+      match = FIELD_AS_ARRAY.match(name)
+      if match is not None:
+        group, key = match.groups()
+        if group not in groups:
+          groups[group] = {}
+          grouped.setdefault(group, []).insert(0, groups[group])
+        groups[group][key] = value
+        continue
+    if name in grouped:
+      grouped[name].append(value)
+    else:
+      grouped[name] = [value]
+  return grouped
+
+
+def DecodeUrlencoded(data, encoding='utf8', keep_blank_values=False):
+  """Returns a list with the name and value of every field in urlencoded `data`.
+
+  Fields are separated by '&' or ';', as with cgi.parse_qsl. Unless the data
+  contains escaped separators, it is percent-decoded as a whole before it is
+  split up in fields. Otherwise, only names and values with escapes are
+  percent-decoded one by one.
+
+  Arguments:
+    @ data: str
+      The urlencoded data, as received in a query string or POST body.
+    % encoding: str ~~ 'utf8'
+      The encoding to decode values with. None keeps them as byte strings.
+    % keep_blank_values: bool ~~ False
+      Whether fields without a value should be included, with an empty value.
+  """
+  if ';' in data:
+    data = data.replace(';', '&')
+  if '+' in data:
+    data = data.replace('+', ' ')
+  unquote = None
+  if '%' in data:
+    if ESCAPED_SEPARATORS.search(data):
+      unquote = urllib.unquote
+    else:
+      data = urllib.unquote(data)
+  fields = []
+  for field in data.split('&'):
+    name, separator, value = field.partition('=')
+    if not value and not (keep_blank_values and (separator or name)):
+      continue
+    if unquote is not None:
+      if '%' in name:
+        name = unquote(name)
+      if '%' in value:
+        value = unquote(value)
+    if encoding is not None:
+      value = value.decode(encoding)
+    fields.append((name, value))
+  return fields
+
+
+def ParseUrlencoded(data, indexed=True, encoding='utf8',
+                    keep_blank_values=False):
+  """Returns a QueryArgsDict with the fields of urlencoded `data`.
+
+  This decodes query strings and urlencoded POST bodies in one pass over the
+  fields, see DecodeUrlencoded and GroupFields for the arguments.
+  """
+  return GroupFields(
+      DecodeUrlencoded(data, encoding=encoding,
+                       keep_blank_values=keep_blank_values),
+      indexed=indexed)
+
+
+def _FieldValue(value):
+  """Returns the value of a form field, the contents for uploaded files."""
+  if isinstance(value, MultipartFile):
+    return value.value
+  return value
+
+
+def IterJSONArray(stream, chunk_size=CHUNK_SIZE):
+  """Yields the items of the JSON array that is read from `stream`.
+
+  The stream is read in chunks, and every item is decoded and yielded as soon
+  as the text that follows it shows it is complete. Only the text of the items
+  that have not been decoded yet is kept in memory.
+
+  Arguments:
+    @ stream: file-like
+      The stream to read the JSON text from.
+    % chunk_size: int ~~ CHUNK_SIZE
+      The number of bytes to read from the stream at once.
+
+  Raises:
+    ValueError: The text is not a valid JSON array.
+  """
+  buffer = ''
+  position = 0
+  exhausted = False
+  # What comes next: the opening bracket, the first item (or the end of an empty
+  # array), an item after a comma, or a comma or the end after an item.
+  expect = 'open'
+  while True:
+    while position < len(buffer) and buffer[position] in JSON_WHITESPACE:
+      position += 1
+    char = buffer[position:position + 1]
+    if not char:
+      if exhausted:
+        raise ValueError('Unexpected end of JSON array')
+    elif expect in ('open', 'next') or (expect == 'first' and char == ']'):
+      if char == ']' and expect != 'open':
+        return
+      if char != ('[' if expect == 'open' else ','):
+        raise ValueError('Unexpected %r at position %d of JSON array' % (
+            char, position))
+      position += 1
+      expect = 'first' if expect == 'open' else 'item'
+      continue
+    else:
+      try:
+        item, end = JSON_DECODER.raw_decode(buffer, position)
+      except ValueError:
+        if exhausted:
+          raise
+      else:
+        # An item is only known to be complete when it is followed by text that
+        # may follow an item. A number at the end of the buffer, or followed by
+        # a partial fraction or exponent, might continue in the next chunk.
+        if exhausted or buffer[end:end + 1] in JSON_ITEM_ENDS:
+          yield item
+          position = end
+          expect = 'next'
+          continue
+    chunk = stream.read(chunk_size)
+    exhausted = not chunk
+    buffer = buffer[position:] + chunk
+    position = 0
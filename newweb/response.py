@@ -2,7 +2,321 @@
 """newWeb response classes."""
 
 # Standard modules
+import binascii
+import calendar
+import collections
+import Cookie as cookie
+import email.utils
 import httplib
+import os
+import re
+import zlib
+
+# Block size used when reading file-like response content.
+BLOCK_SIZE = 64 * 1024
+# Maximum number of ranges in a Range header, beyond this it is ignored.
+MAX_BYTE_RANGES = 32
+# Response codes that never have a body, and thus have no Content-Length.
+BODILESS_STATUS = frozenset((100, 101, 204, 304))
+# Cookie attributes in the order they are rendered in, with their names.
+COOKIE_ATTRIBUTES = (
+    ('comment', 'Comment'), ('domain', 'Domain'), ('expires', 'expires'),
+    ('httponly', 'httponly'), ('max-age', 'Max-Age'), ('path', 'Path'),
+    ('secure', 'secure'), ('version', 'Version'))
+COOKIE_FLAGS = frozenset(('httponly', 'secure'))
+COOKIE_NAME = re.compile('[%s]+$' % re.escape(cookie._LegalChars))
+# Status lines for all known response codes.
+STATUS_LINES = dict((code, '%d %s' % (code, reason))
+                    for code, reason in httplib.responses.iteritems())
+
+
+def CookieHeader(name, value, attrs):
+  """Returns the Set-Cookie header value for a cookie and its attributes.
+
+  The output is that of Cookie.Morsel.OutputString, without creating a Morsel:
+  the value is quoted where needed, and attributes are rendered in alphabetical
+  order. Attributes that are None or empty are left out, as are flags (secure,
+  httponly) that are false. An integer `expires` is the number of seconds from
+  now that the cookie expires.
+  """
+  parts = ['%s=%s' % (name, cookie._quote(str(value)))]
+  for attr, label in COOKIE_ATTRIBUTES:
+    attr_value = attrs.get(attr)
+    if attr_value is None or attr_value == '':
+      continue
+    if attr in COOKIE_FLAGS:
+      if attr_value:
+        parts.append(label)
+      continue
+    if attr == 'expires' and isinstance(attr_value, (int, long)):
+      attr_value = cookie._getdate(attr_value)
+    parts.append('%s=%s' % (label, attr_value))
+  return '; '.join(parts)
+
+
+def ParseByteRanges(range_header, length):
+  """Returns the byte ranges of a Range header for an entity of `length`.
+
+  The ranges are returned as a list of (start, end) tuples, where `end` is
+  exclusive. Overlapping and adjacent ranges are merged, and the result is
+  sorted by offset. Ranges that cannot be satisfied are left out, so an empty
+  list means none of them can be.
+
+  None is returned if the header is syntactically invalid or does not use the
+  'bytes' unit; the Range header should then be ignored. To avoid sending the
+  entity many times over, this is also the case for headers with more than
+  MAX_BYTE_RANGES ranges, or whose ranges together are larger than the entity.
+  """
+  unit, _sep, specs = range_header.partition('=')
+  if unit.strip().lower() != 'bytes':
+    return None
+  if specs.count(',') >= MAX_BYTE_RANGES:
+    return None
+  ranges = []
+  for spec in specs.split(','):
+    spec = spec.strip()
+    if not spec:
+      continue
+    first, sep, last = spec.partition('-')
+    first, last = first.strip(), last.strip()
+    if not sep or not (first or last):
+      return None
+    if (first and not first.isdigit()) or (last and not last.isdigit()):
+      return None
+    if not first:
+      # Suffix range, the last `last` bytes of the entity.
+      if int(last):
+        ranges.append((max(length - int(last), 0), length))
+    elif last and int(last) < int(first):
+      return None
+    elif int(first) < length:
+      end = int(last) + 1 if last else length
+      ranges.append((int(first), min(end, length)))
+  if not ranges and not any(spec.strip() for spec in specs.split(',')):
+    return None
+  if sum(end - start for start, end in ranges) > length:
+    return None
+  merged = []
+  for start, end in sorted(ranges):
+    if merged and start <= merged[-1][1]:
+      merged[-1] = merged[-1][0], max(end, merged[-1][1])
+    else:
+      merged.append((start, end))
+  return merged
+
+
+class ChunkIterator(object):
+  """Iterates over the chunks of a streaming response body.
+
+  Unicode chunks are encoded using the given charset, everything else that is
+  not a string is converted using str(). Closing the ChunkIterator closes the
+  underlying iterable where it supports this (e.g. generators).
+  """
+  def __init__(self, chunks, charset):
+    self.chunks = chunks
+    self.charset = charset
+
+  def __iter__(self):
+    for chunk in self.chunks:
+      if isinstance(chunk, unicode):
+        yield chunk.encode(self.charset)
+      else:
+        yield str(chunk)
+
+  def close(self):
+    """Closes the underlying iterable, if it can be closed."""
+    if hasattr(self.chunks, 'close'):
+      self.chunks.close()
+
+
+class FileIterator(object):
+  """Iterates over a file-like object in blocks, closing the file afterwards."""
+  def __init__(self, fileobj, block_size=BLOCK_SIZE):
+    self.fileobj = fileobj
+    self.block_size = block_size
+
+  def __iter__(self):
+    read = self.fileobj.read
+    while True:
+      block = read(self.block_size)
+      if not block:
+        break
+      yield block
+
+  def close(self):
+    """Closes the underlying file-like object."""
+    if hasattr(self.fileobj, 'close'):
+      self.fileobj.close()
+
+
+class RangeIterator(object):
+  """Yields selected byte ranges of a string or file, with literal separators.
+
+  The `pieces` are literal strings (yielded as they are) and (start, end)
+  tuples, for which the corresponding bytes of the source are yielded. For
+  file sources, only the requested ranges are read from disk.
+  """
+  def __init__(self, source, pieces, block_size=BLOCK_SIZE):
+    self.source = source
+    self.pieces = pieces
+    self.block_size = block_size
+
+  def __iter__(self):
+    for piece in self.pieces:
+      if isinstance(piece, str):
+        yield piece
+      elif isinstance(self.source, str):
+        yield self.source[piece[0]:piece[1]]
+      else:
+        start, end = piece
+        self.source.seek(start)
+        while start < end:
+          block = self.source.read(min(self.block_size, end - start))
+          if not block:
+            break
+          start += len(block)
+          yield block
+
+  def close(self):
+    """Closes the underlying file-like object."""
+    if hasattr(self.source, 'close'):
+      self.source.close()
+
+
+class GzipIterator(object):
+  """Compresses the chunks of a response body into a gzip stream."""
+  def __init__(self, chunks, level):
+    self.chunks = chunks
+    self.level = level
+
+  def __iter__(self):
+    compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in self.chunks:
+      compressed = compressor.compress(chunk)
+      if compressed:
+        yield compressed
+    yield compressor.flush()
+
+  def close(self):
+    """Closes the underlying iterable, if it can be closed."""
+    if hasattr(self.chunks, 'close'):
+      self.chunks.close()
+
+
+class Headers(dict):
+  """Dictionary of response headers, which can hold repeated headers.
+
+  Setting a header replaces all of its values, and looking one up returns its
+  first value. Add() gives a header another value (as is needed for multiple
+  Set-Cookie headers), all values are returned by GetAll().
+
+  The list of headers with encoded values is built once, and kept until the
+  headers are changed. Creating Headers from another Headers dictionary (or
+  updating from one) copies its repeated headers as well.
+  """
+  # Repeated values per header name, and the encoded header list. These are
+  # set on the instance when needed, keeping construction as cheap as a dict's.
+  _extra = None
+  _header_list = None
+
+  def __init__(self, *args, **kwds):
+    super(Headers, self).__init__(*args, **kwds)
+    if args and isinstance(args[0], Headers):
+      self._CopyExtra(args[0], kwds)
+
+  def __setitem__(self, name, value):
+    if self._header_list is not None:
+      self._header_list = None
+    if self._extra:
+      self._extra.pop(name, None)
+    dict.__setitem__(self, name, value)
+
+  def __delitem__(self, name):
+    dict.__delitem__(self, name)
+    if self._extra:
+      self._extra.pop(name, None)
+    self._header_list = None
+
+  def _CopyExtra(self, other, replaced):
+    """Copies the repeated values of headers from another Headers dictionary.
+
+    Headers in `replaced` have been given a new value, their repetitions are
+    not copied.
+    """
+    # Accessing the protected members of another instance of this class.
+    # pylint: disable=W0212
+    for name, values in (other._extra or {}).iteritems():
+      if name not in replaced:
+        if not self._extra:
+          self._extra = {}
+        self._extra[name] = list(values)
+    # pylint: enable=W0212
+
+  def clear(self):
+    """Removes all headers."""
+    dict.clear(self)
+    self._extra = None
+    self._header_list = None
+
+  def pop(self, name, *default):
+    """Removes a header and returns its first value."""
+    value = dict.pop(self, name, *default)
+    if self._extra:
+      self._extra.pop(name, None)
+    self._header_list = None
+    return value
+
+  def popitem(self):
+    """Removes a header and returns its name and first value."""
+    name, value = dict.popitem(self)
+    if self._extra:
+      self._extra.pop(name, None)
+    self._header_list = None
+    return name, value
+
+  def setdefault(self, name, default=None):
+    """Returns the value of a header, setting it to `default` if it's absent."""
+    if name not in self:
+      self[name] = default
+    return self[name]
+
+  def update(self, *args, **kwds):
+    """Sets the headers from a dictionary or iterable of pairs, and keywords.
+
+    Repeated headers of another Headers dictionary are copied along.
+    """
+    for name, value in dict(*args, **kwds).iteritems():
+      self[name] = value
+    if args and isinstance(args[0], Headers):
+      self._CopyExtra(args[0], kwds)
+
+  def Add(self, name, value):
+    """Adds a value for a header, keeping the values it already has."""
+    if name in self:
+      if not self._extra:
+        self._extra = {}
+      self._extra.setdefault(name, []).append(value)
+      self._header_list = None
+    else:
+      self[name] = value
+
+  def GetAll(self, name):
+    """Returns a list of all values of the given header."""
+    if name not in self:
+      return []
+    return [self[name]] + (self._extra or {}).get(name, [])
+
+  def HeaderList(self):
+    """Returns a list of all header names and ASCII encoded values."""
+    if self._header_list is None:
+      header_list = []
+      extra = self._extra or {}
+      for name, value in self.iteritems():
+        header_list.append((name, value.encode('ascii')))
+        for value in extra.get(name, ()):
+          header_list.append((name, value.encode('ascii')))
+      self._header_list = header_list
+    return list(self._header_list)
 
 
 class Response(object):
@@ -10,7 +324,16 @@ class Response(object):
 
   The full response consists of a required content part, and then optional
   http response code, cookies, additional headers, and a content-type.
+
+  The content is either a string, or a streaming body: a file-like object or an
+  iterable of string chunks (a list, tuple, generator or other iterator). These
+  are not read until the response is served, using `app_iter`.
+
+  The `headers` are a Headers dictionary, which supports repeated headers.
+  Cookies set with SetCookie are kept apart from these, and are rendered into
+  Set-Cookie headers when the header list is retrieved.
   """
+  __slots__ = 'charset', 'content', 'httpcode', '_cookies', '_headers'
   # Default content-type for Page objects
   CONTENT_TYPE = 'text/html'
 
@@ -19,9 +342,10 @@ class Response(object):
     """Initializes a Page object.
 
     Arguments:
-      @ content: str
+      @ content: str / file / iterable of str
         The content to return to the client. This can be either plain text, html
-        or the contents of a file (images for example).
+        or the contents of a file (images for example). File-like objects and
+        iterables of chunks are streamed to the client without joining them.
       % content_type: str ~~ CONTENT_TYPE ('text/html' by default)
         The content type of the response. This should NOT be set in headers.
       % httpcode: int ~~ 200
@@ -32,10 +356,12 @@ class Response(object):
     self.charset = kwds.get('charset', 'utf8')
     self.text = content
     self.httpcode = httpcode
-    self.headers = headers or {}
+    self._cookies = None
+    self._headers = Headers(headers) if headers else Headers()
     if ';' not in content_type:
       content_type = '%s; charset=%s' % (content_type, self.charset)
-    self.content_type = content_type
+    # The headers are new, there is no header list to invalidate yet.
+    dict.__setitem__(self._headers, 'Content-Type', content_type)
 
   # Get and set content-type header
   @property
@@ -44,11 +370,23 @@ class Response(object):
 
   @content_type.setter
   def content_type(self, content_type):
-    current = self.headers.get('Content-Type', '')
-    if ';' in current:
-      content_type = '%s; %s' % (content_type, current.split(';', 1)[-1])
+    _current, separator, params = self.headers.get(
+        'Content-Type', '').partition(';')
+    if separator:
+      content_type = '%s;%s' % (content_type, params)
     self.headers['Content-Type'] = content_type
 
+  # Get and set the headers, any dictionary is converted to Headers
+  @property
+  def headers(self):
+    return self._headers
+
+  @headers.setter
+  def headers(self, headers):
+    if not isinstance(headers, Headers):
+      headers = Headers(headers)
+    self._headers = headers
+
   # Get and set body text
   @property
   def text(self):
@@ -58,27 +396,261 @@ class Response(object):
   def text(self, content):
     if isinstance(content, unicode):
       self.content = content.encode(self.charset)
+    elif isinstance(content, str):
+      self.content = content
+    elif (hasattr(content, 'read') or isinstance(content, (list, tuple)) or
+          hasattr(content, 'next')):
+      self.content = content
     else:
       self.content = str(content)
 
+  @property
+  def streaming(self):
+    """Returns whether the content is a file-like object or chunk iterable."""
+    return not isinstance(self.content, str)
+
+  @property
+  def file_backed(self):
+    """Returns whether the content is a file-like object."""
+    return hasattr(self.content, 'read')
+
+  @property
+  def content_length(self):
+    """Returns the length of the response body, or None if it is not known.
+
+    The length is known for string content, lists and tuples of strings and
+    files that can be stat'ed. For those, the length is what remains to be read
+    from their current position.
+    """
+    content = self.content
+    if isinstance(content, str):
+      return len(content)
+    if isinstance(content, (list, tuple)):
+      if all(isinstance(chunk, str) for chunk in content):
+        return sum(map(len, content))
+      return None
+    try:
+      return os.fstat(content.fileno()).st_size - content.tell()
+    except (AttributeError, EnvironmentError, ValueError):
+      return None
+
+  @property
+  def app_iter(self):
+    """Returns the response body as an iterable for the WSGI server."""
+    if isinstance(self.content, str):
+      return [self.content]
+    if self.file_backed:
+      return FileIterator(self.content)
+    return ChunkIterator(self.content, self.charset)
+
+  @property
+  def cookies(self):
+    """Returns the cookies to set, as a list of (name, value, attrs) tuples."""
+    if self._cookies is None:
+      return []
+    return [(name, value, attrs)
+            for (name, _path, _domain), (value, attrs)
+            in self._cookies.iteritems()]
+
+  def SetCookie(self, name, value, **attrs):
+    """Sets a cookie on the client, refer to Request.AddCookie for arguments.
+
+    Setting a cookie with the same name, path and domain as one that is already
+    set replaces it. Cookies are rendered into Set-Cookie headers when the
+    header list is retrieved.
+
+    Raises:
+      Cookie.CookieError: The name or an attribute of the cookie is invalid.
+    """
+    if isinstance(name, unicode):
+      name = name.encode('ascii')
+    if not COOKIE_NAME.match(name) or name.lower() in cookie.Morsel._reserved:
+      raise cookie.CookieError('Illegal cookie name %r' % name)
+    if 'max_age' in attrs:
+      attrs['max-age'] = attrs.pop('max_age')
+    for attr in attrs:
+      if attr not in cookie.Morsel._reserved:
+        raise cookie.CookieError('Invalid cookie attribute %r' % attr)
+    if self._cookies is None:
+      self._cookies = collections.OrderedDict()
+    key = name, attrs.get('path'), attrs.get('domain')
+    self._cookies.pop(key, None)
+    self._cookies[key] = value, attrs
+
+  def AddVary(self, field):
+    """Adds the given request header field to the Vary header."""
+    current = self.headers.get('Vary')
+    if not current:
+      self.headers['Vary'] = field
+    elif field.lower() not in (
+        name.strip().lower() for name in current.split(',')):
+      self.headers['Vary'] = '%s, %s' % (current, field)
+
+  def ApplyRange(self, range_header, if_range=None):
+    """Limits the response to the byte ranges requested by the client.
+
+    This only applies to 200 responses that have an `Accept-Ranges: bytes`
+    header, and string content or seekable file content of a known size (files
+    that can be stat'ed). A single range results in a 206 response with a
+    Content-Range header, multiple ranges in a 206 response with a
+    multipart/byteranges body. If none of the ranges can be satisfied, the
+    response becomes a 416. An invalid Range header is ignored.
+
+    Arguments:
+      @ range_header: str
+        The value of the request's Range header. None means no ranges.
+      % if_range: str ~~ None
+        The value of the request's If-Range header. If this does not match the
+        response's ETag or Last-Modified header, the full response is sent.
+    """
+    if (range_header is None or self.httpcode != 200 or
+        self.headers.get('Accept-Ranges') != 'bytes'):
+      return
+    if not (isinstance(self.content, str) or (
+        self.file_backed and hasattr(self.content, 'seek'))):
+      return
+    if if_range is not None and not self._IfRangeMatches(if_range):
+      return
+    length = self.content_length
+    if length is None:
+      return
+    ranges = ParseByteRanges(range_header, length)
+    if ranges is None:
+      return
+    offset = 0
+    if self.file_backed:
+      offset = self.content.tell()
+      ranges = [(start + offset, end + offset) for start, end in ranges]
+    if not ranges:
+      if self.file_backed:
+        self.content.close()
+      self.httpcode = 416
+      self.content = ''
+      self.headers['Content-Range'] = 'bytes */%d' % length
+      return
+    self.httpcode = 206
+    if len(ranges) == 1:
+      start, end = ranges[0]
+      pieces = ranges
+      self.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+          start - offset, end - offset - 1, length)
+    else:
+      boundary = binascii.hexlify(os.urandom(16))
+      pieces = []
+      for start, end in ranges:
+        pieces.append(
+            '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d'
+            '\r\n\r\n' % (boundary, self.headers['Content-Type'],
+                          start - offset, end - offset - 1, length))
+        pieces.append((start, end))
+      pieces.append('\r\n--%s--\r\n' % boundary)
+      self.headers['Content-Type'] = (
+          'multipart/byteranges; boundary=%s' % boundary)
+    self.headers['Content-Length'] = str(sum(
+        len(piece) if isinstance(piece, str) else piece[1] - piece[0]
+        for piece in pieces))
+    self.content = RangeIterator(self.content, pieces)
+
+  def _IfRangeMatches(self, if_range):
+    """Returns whether the If-Range validator matches the response.
+
+    Entity tags are compared using the strong comparison function, dates
+    should exactly match the Last-Modified date.
+    """
+    if_range = if_range.strip()
+    if if_range.startswith(('"', 'W/')):
+      return (not if_range.startswith('W/') and
+              if_range == self.headers.get('ETag'))
+    last_modified = self.headers.get('Last-Modified')
+    if last_modified is None:
+      return False
+    if_range_date = email.utils.parsedate(if_range)
+    last_modified_date = email.utils.parsedate(last_modified)
+    return (if_range_date is not None and last_modified_date is not None and
+            calendar.timegm(if_range_date) == calendar.timegm(
+                last_modified_date))
+
+  def DiscardBody(self, gzip=False):
+    """Drops the response body, keeping the Content-Length it would have had.
+
+    This is used for responses to HEAD requests. Files and iterables that make
+    up the body are closed without being read.
+
+    With `gzip`, the headers are set to those of a gzip compressed body (refer
+    to Gzip), without compressing it. The length of the compressed body is not
+    known then, so there is no Content-Length. Neither is there for bodies of
+    unknown length, such as generators.
+    """
+    if gzip:
+      self._SetGzipHeaders()
+    elif ('Content-Length' not in self._headers and
+          self.httpcode not in BODILESS_STATUS):
+      content_length = self.content_length
+      if content_length is not None:
+        self._headers['Content-Length'] = str(content_length)
+    if hasattr(self.content, 'close'):
+      self.content.close()
+    # Without a known length, an empty string would be sent with a length of 0.
+    self.content = '' if 'Content-Length' in self._headers else iter(())
+
+  def Gzip(self, level=6):
+    """Compresses the response body using gzip content-coding.
+
+    String content is compressed right away, a streaming body is compressed
+    chunk by chunk while it is served. A strong ETag is made weak, since the
+    compressed body is not byte-identical to the entity it was computed for.
+    """
+    if self.streaming:
+      self.content = GzipIterator(self.app_iter, level)
+    else:
+      compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+      self.content = compressor.compress(self.content) + compressor.flush()
+    self._SetGzipHeaders()
+
+  def _SetGzipHeaders(self):
+    """Sets the headers for a body with gzip content-coding."""
+    self.headers.pop('Accept-Ranges', None)
+    self.headers.pop('Content-Length', None)
+    self.headers['Content-Encoding'] = 'gzip'
+    etag = self.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+      self.headers['ETag'] = 'W/' + etag
+
   # Retrieve a header list
   @property
   def headerlist(self):
-    return [(key, val.encode('ascii')) for key, val in self.headers.iteritems()]
+    headers = self._headers.HeaderList()
+    if self._cookies:
+      headers.extend(('Set-Cookie', CookieHeader(name, value, attrs))
+                     for (name, _path, _domain), (value, attrs)
+                     in self._cookies.iteritems())
+    if ('Content-Length' not in self._headers and
+        self.httpcode not in BODILESS_STATUS):
+      if isinstance(self.content, str):
+        headers.append(('Content-Length', str(len(self.content))))
+      else:
+        content_length = self.content_length
+        if content_length is not None:
+          headers.append(('Content-Length', str(content_length)))
+    return headers
 
   @property
   def status(self):
-    return '%d %s' % (self.httpcode, httplib.responses[self.httpcode])
+    return STATUS_LINES.get(self.httpcode) or '%d %s' % (
+        self.httpcode, httplib.responses[self.httpcode])
 
   def __repr__(self):
     return '<%s instance at %#x>' % (self.__class__.__name__, id(self))
 
   def __str__(self):
+    if self.streaming:
+      return ''.join(self.app_iter)
     return self.content
 
 
 class Redirect(Response):
   """A response tailored to do redirects."""
+  __slots__ = ()
   REDIRECT_PAGE = ('<!DOCTYPE html><html><head><title>Page moved</title></head>'
                    '<body>Page moved, please follow <a href="%s">this link</a>'
                    '</body></html>')
@@ -0,0 +1,319 @@
+#!/usr/bin/python
+"""newWeb compiled route tables.
+
+Classes:
+  RouteTable: Precompiled dispatch structure for an ordered list of routes.
+  RouteCache: Bounded, thread-safe LRU cache in front of a request router.
+"""
+
+# Standard modules
+import re
+import threading
+
+# Characters that end the literal prefix of a route pattern.
+REGEX_SPECIAL = frozenset('.^$*+?{}[]\\|()')
+# Characters that make the preceding literal optional or repeatable.
+REGEX_QUANTIFIERS = frozenset('*+?{')
+# Python's regex engine refuses patterns with 100 or more capturing groups.
+MAX_GROUPS = 99
+# Numbered backreferences and group conditionals break when groups renumber.
+NUMBERED_GROUP_REFERENCE = re.compile(r'\\[1-9]|\(\?\(\d')
+# Inline flags apply to the whole pattern, they'd spread to combined routes.
+INLINE_FLAGS = re.compile(r'\(\?[iLmsux]+\)')
+
+
+def LiteralPrefix(pattern):
+  """Returns the literal string that every match of `pattern` must start with.
+
+  Scanning stops at the first character with special meaning in a regex. A
+  literal that is followed by a quantifier is not part of the prefix, and any
+  alternation at the outermost level of the pattern disqualifies the prefix
+  completely, since either branch may then match. So do inline flags anywhere
+  in the pattern, as they may make the prefix case-insensitive.
+  """
+  prefix = []
+  for char in pattern:
+    if char in REGEX_SPECIAL:
+      if char in REGEX_QUANTIFIERS and prefix:
+        prefix.pop()
+      break
+    prefix.append(char)
+  if INLINE_FLAGS.search(pattern) or _HasTopLevelAlternation(pattern):
+    return ''
+  return ''.join(prefix)
+
+
+def _HasTopLevelAlternation(pattern):
+  """Returns whether `pattern` has a pipe outside of all groups and classes."""
+  depth = 0
+  chars = iter(pattern)
+  for char in chars:
+    if char == '\\':
+      next(chars, None)
+    elif char == '[':
+      # Skip the character class; a leading ']' is part of the class.
+      char = next(chars, None)
+      if char == '^':
+        char = next(chars, None)
+      while char is not None:
+        char = next(chars, None)
+        if char == '\\':
+          next(chars, None)
+        elif char == ']':
+          break
+    elif char == '(':
+      depth += 1
+    elif char == ')':
+      depth -= 1
+    elif char == '|' and not depth:
+      return True
+  return False
+
+
+class RouteTable(object):
+  """Precompiled dispatch structure for an ordered list of routes.
+
+  Each route is a regex pattern (matched against the full url) with an opaque
+  target. The literal prefixes of all patterns are collected in a trie, and
+  every prefix gets a single alternation regex of all routes whose prefix leads
+  up to it, in their original order. The trie is then flattened into a mapping
+  from prefix to combined regex.
+
+  Looking up a url finds the longest route prefix the url starts with, trying
+  only the known prefix lengths, and runs that prefix's combined regex. The
+  number of regex attempts therefore depends on how many routes share the url's
+  prefix, not on the size of the route table, while the first-match semantics
+  of a linear scan are retained.
+  """
+  def __init__(self, routes, flags=re.UNICODE):
+    """Initializes a RouteTable from an iterable of routes.
+
+    Arguments:
+      @ routes: iterable of 2-tuples
+        Each tuple is a regex `pattern` and the `target` to return for it.
+      % flags: int ~~ re.UNICODE
+        Regex flags used to compile the patterns.
+    """
+    self.flags = flags
+    self.routes = []
+    trie = {}
+    for index, (pattern, target) in enumerate(routes):
+      compiled = re.compile(pattern + '$', flags)
+      self.routes.append((compiled, target))
+      node = trie
+      for char in LiteralPrefix(pattern):
+        node = node.setdefault(char, {})
+      node.setdefault(None, []).append(index)
+    self.prefixes = {}
+    self._CompileNode(trie, '', [])
+    self.prefix_lengths = sorted(set(map(len, self.prefixes)), reverse=True)
+
+  def __len__(self):
+    return len(self.routes)
+
+  def _CompileNode(self, node, prefix, inherited):
+    """Stores matchers for the candidate routes of every prefix in the trie.
+
+    The candidates of a prefix are the routes of all shorter prefixes leading up
+    to it plus its own, so that the longest prefix of a url holds all routes
+    that can possibly match that url.
+    """
+    if None in node:
+      inherited = sorted(inherited + node[None])
+      self.prefixes[prefix] = self._Matchers(inherited)
+    for char, child in node.iteritems():
+      if char is not None:
+        self._CompileNode(child, prefix + char, inherited)
+
+  def _Matchers(self, indices):
+    """Returns a tuple of combined regexes covering the given route indices.
+
+    Each combined regex is a tuple of (regex, group_map, indices), where the
+    group map translates the index of a route's wrapping group into the route
+    index and the slice of groups that belong to the route itself. Routes are
+    chunked to stay within the regex engine's group limit, and a route reusing
+    a group name of the current chunk starts a new one. Routes with numbered
+    group references are never combined, their numbering would shift. Neither
+    are routes with inline flags, which would apply to all combined routes.
+    """
+    matchers = []
+    chunk = []
+    group_count = 0
+    group_names = set()
+    for index in indices:
+      compiled = self.routes[index][0]
+      if (NUMBERED_GROUP_REFERENCE.search(compiled.pattern) or
+          INLINE_FLAGS.search(compiled.pattern)):
+        if chunk:
+          matchers.extend(self._CombineChunk(chunk))
+          chunk, group_count, group_names = [], 0, set()
+        matchers.append((compiled, None, [index]))
+        continue
+      groups = compiled.groups + 1
+      if chunk and (group_count + groups > MAX_GROUPS or
+                    group_names.intersection(compiled.groupindex)):
+        matchers.extend(self._CombineChunk(chunk))
+        chunk, group_count, group_names = [], 0, set()
+      chunk.append(index)
+      group_count += groups
+      group_names.update(compiled.groupindex)
+    if chunk:
+      matchers.extend(self._CombineChunk(chunk))
+    return tuple(matchers)
+
+  def _CombineChunk(self, indices):
+    """Returns a list of combined regexes for the given route indices.
+
+    Should the combined regex fail to compile, the routes are kept separate.
+    """
+    parts = []
+    group_map = {}
+    offset = 1
+    for index in indices:
+      compiled = self.routes[index][0]
+      parts.append('(%s)' % compiled.pattern)
+      group_map[offset] = index, offset, offset + compiled.groups
+      offset += compiled.groups + 1
+    try:
+      return [(re.compile('|'.join(parts), self.flags), group_map, indices)]
+    except (re.error, AssertionError):
+      if len(indices) == 1:
+        compiled = self.routes[indices[0]][0]
+        return [(compiled, None, indices)]
+      return [matcher for index in indices
+              for matcher in self._CombineChunk([index])]
+
+  def _Candidates(self, url):
+    """Returns the matchers for the longest route prefix `url` starts with."""
+    prefixes = self.prefixes
+    for length in self.prefix_lengths:
+      matchers = prefixes.get(url[:length])
+      if matchers is not None:
+        return matchers
+    return ()
+
+  def Match(self, url):
+    """Returns the target and match groups of the first route matching `url`.
+
+    Returns None if none of the routes match.
+    """
+    for regex, group_map, indices in self._Candidates(url):
+      match = regex.match(url)
+      if match is not None:
+        if group_map is None:
+          return self.routes[indices[0]][1], match.groups()
+        index, start, end = group_map[match.lastindex]
+        return self.routes[index][1], match.groups()[start:end]
+    return None
+
+  def MatchAll(self, url):
+    """Yields target and match groups for every route matching `url`, in order.
+
+    The first match is found using the combined regexes, after which the
+    remaining candidate routes are tried one by one.
+    """
+    candidates = self._Candidates(url)
+    for position, (regex, group_map, indices) in enumerate(candidates):
+      match = regex.match(url)
+      if match is None:
+        continue
+      if group_map is None:
+        first = indices[0]
+        yield self.routes[first][1], match.groups()
+      else:
+        first, start, end = group_map[match.lastindex]
+        yield self.routes[first][1], match.groups()[start:end]
+      for _regex, _group_map, indices in candidates[position:]:
+        for index in indices:
+          if index > first:
+            compiled, target = self.routes[index]
+            match = compiled.match(url)
+            if match is not None:
+              yield target, match.groups()
+      return
+
+
+class RouteCache(object):
+  """Bounded, thread-safe LRU cache in front of a request router.
+
+  Successfully resolved routes are stored by (url, method). Failed lookups are
+  not cached, they raise from the wrapped router every time. The entries are
+  kept in a circular doubly linked list, ordered from least to most recently
+  used, so that both lookups and evictions are constant time.
+  """
+  # Indices of the fields in the linked list entries.
+  PREV, NEXT, KEY, RESULT = 0, 1, 2, 3
+
+  def __init__(self, request_router, size):
+    """Initializes a RouteCache for the given router.
+
+    Arguments:
+      @ request_router: function
+        The request router (as returned by newweb.router) to cache results of.
+      @ size: int
+        The maximum number of cached routes.
+    """
+    if size < 1:
+      raise ValueError('RouteCache size must be at least 1, got %r' % size)
+    self.request_router = request_router
+    self.size = size
+    self.hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+    self._Reset()
+
+  def __call__(self, url, method):
+    """Returns the cached handler and arguments, or routes the request."""
+    key = url, method
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        self.hits += 1
+        self._Unlink(entry)
+        self._Append(entry)
+        return entry[self.RESULT]
+      self.misses += 1
+    result = self.request_router(url, method)
+    with self._lock:
+      if key not in self._entries:
+        if len(self._entries) >= self.size:
+          oldest = self._root[self.NEXT]
+          self._Unlink(oldest)
+          del self._entries[oldest[self.KEY]]
+        entry = [None, None, key, result]
+        self._entries[key] = entry
+        self._Append(entry)
+    return result
+
+  def __len__(self):
+    return len(self._entries)
+
+  def _Append(self, entry):
+    """Places the entry at the most recently used end of the list."""
+    last = self._root[self.PREV]
+    entry[self.PREV] = last
+    entry[self.NEXT] = self._root
+    last[self.NEXT] = self._root[self.PREV] = entry
+
+  def _Reset(self):
+    """Sets up an empty entry mapping and linked list."""
+    self._entries = {}
+    self._root = []
+    self._root[:] = [self._root, self._root, None, None]
+
+  def _Unlink(self, entry):
+    """Removes the entry from its position in the linked list."""
+    prev_entry, next_entry = entry[self.PREV], entry[self.NEXT]
+    prev_entry[self.NEXT] = next_entry
+    next_entry[self.PREV] = prev_entry
+
+  def Flush(self):
+    """Removes all cached routes. The hit and miss counters are kept."""
+    with self._lock:
+      self._Reset()
+
+  @property
+  def hit_ratio(self):
+    """Returns the fraction of lookups answered from the cache."""
+    lookups = self.hits + self.misses
+    return float(self.hits) / lookups if lookups else 0.0
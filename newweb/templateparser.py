@@ -3,6 +3,10 @@
 
 Classes:
   Parser: Parses a template by replacing tags with their values.
+  TemplateCache: Directory of parsed template files, for fast startup.
+  TemplateCompiler: Compiles a Template into a Python rendering function.
+
+Running this module warms a template cache, refer to main() for usage.
 
 Error classes:
   Error: Base class for all errors generated by this module
@@ -11,9 +15,17 @@ Error classes:
 """
 
 # Standard modules
+import hashlib
+import itertools
+import marshal
+import optparse
 import os
 import re
+import sys
+import tempfile
+import time
 import urllib
+import weakref
 
 
 class Error(Exception):
@@ -44,57 +56,6 @@ class TemplateReadError(Error, IOError):
   """Template file could not be read or found."""
 
 
-class LazyTagValueRetrieval(object):
-  """Provides a means for lazy tag value retrieval.
-
-  This is necessary for instance for TemplateConditional.Expression, where
-  lazy retrieval of tag values means that shortcircuit conditional expressions
-  become possible.
-  """
-  def __init__(self, values):
-    self._values = values
-    self._tags = {}
-
-  # ############################################################################
-  # Methods for delayed tag value retrieval
-  #
-  def __getitem__(self, key):
-    return self._tags[key].GetValue(self._values)
-
-  def __setitem__(self, key, value):
-    self._tags[key] = value
-
-  # ############################################################################
-  # Methods for minimum dictionary likeness
-  #
-  def __iter__(self):
-    return iter(self._tags)
-
-  def iteritems(self):
-    """Returns an iterator for the items of the LazyTagValueRetrieval dict."""
-    return ((key, self[key]) for key in self)
-
-  def iterkeys(self):
-    """Returns an iterator for the keys of the LazyTagValueRetrieval dict."""
-    return iter(self)
-
-  def itervalues(self):
-    """Returns an iterator for the values of the LazyTagValueRetrieval dict."""
-    return (self[key] for key in self)
-
-  def items(self):
-    """Returns a list with the items of the LazyTagValueRetrieval dict."""
-    return list(self.iteritems())
-
-  def keys(self):
-    """Returns a list with the keys of the LazyTagValueRetrieval dict."""
-    return list(self)
-
-  def values(self):
-    """Returns a list with the values of the LazyTagValueRetrieval dict."""
-    return list(self.itervalues())
-
-
 class Parser(dict):
   """A template parser that loads and caches templates and parses them by name.
 
@@ -116,8 +77,12 @@ class Parser(dict):
   Beyond parsing, the parser grants easy access to the TAG_FUNCTIONS dictionary,
   providing the `RegisterFunction` method to add or replace functions in this
   module constant.
+
+  Given a `cache_dir`, template files are parsed once and stored there, refer to
+  TemplateCache. Later parsers (in new processes) load the parsed templates from
+  the cache for as long as the template files are not modified.
   """
-  def __init__(self, path='.', templates=()):
+  def __init__(self, path='.', templates=(), cache_dir=None):
     """Initializes a Parser instance.
 
     This sets up the template directory and preloads any templates given.
@@ -127,9 +92,12 @@ class Parser(dict):
         Search path for loading templates using AddTemplate().
       % templates: iter of str ~~ None
         Names of templates to preload.
+      % cache_dir: str ~~ None
+        Directory to keep parsed template files in, no caching if not given.
     """
     super(Parser, self).__init__()
     self.template_dir = path
+    self.cache = TemplateCache(cache_dir) if cache_dir else None
     for template in templates:
       self.AddTemplate(template)
 
@@ -194,6 +162,23 @@ class Parser(dict):
     """
     return self[template].Parse(**replacements)
 
+  def Stream(self, template, **replacements):
+    """Yields the referenced template in chunks, with its tags replaced.
+
+    Like Parse, this loads the template if it doesn't exist yet. Refer to
+    Template.Stream for details on the chunks.
+
+    Arguments:
+      @ template: str
+        Template name, or the relative path to find it on.
+      @ **replacements: dict
+        Dictionary of replacement objects. Tags are looked up in here.
+
+    Returns:
+      generator: Yields the parsed template as strings.
+    """
+    return self[template].Stream(**replacements)
+
   def ParseString(self, template, **replacements):
     """Returns the given `template` with its tags replaced by **replacements.
 
@@ -230,6 +215,8 @@ class SafeString(str):
 
 class Template(list):
   """Contained for template parts, allowing for rich content construction."""
+  # Target size of the chunks yielded by Stream().
+  CHUNK_SIZE = 16 * 1024
   FUNCTION = re.compile(r'\s*\{\{\s*(.*?)\s*\}\}')
   # For a full tag syntax exlanation, refer to the TAG regex in TemplateTag.
   TAG = re.compile("""
@@ -254,6 +241,9 @@ class Template(list):
     super(Template, self).__init__()
     self.parser = parser
     self.scopes = [self]
+    self.dependencies = []
+    self.dependents = weakref.WeakValueDictionary()
+    self._render = self._stream = None
     self.AddString(raw_template)
 
   def __eq__(self, other):
@@ -289,7 +279,12 @@ class Template(list):
     """
     if self.parser is None:
       raise TypeError('The template requires parser for adding template files.')
-    return self._AddToOpenScope(self.parser[name])
+    template = self.parser[name]
+    self._Invalidate()
+    if not any(template is dependency for dependency in self.dependencies):
+      self.dependencies.append(template)
+      template.dependents[id(self)] = self
+    return self._AddToOpenScope(template)
 
   def AddString(self, raw_template):
     """Extends the Template by adding a raw template string.
@@ -299,6 +294,7 @@ class Template(list):
     Raises:
       TemplateSyntaxError: Unbalanced number of scopes in added template.
     """
+    self._Invalidate()
     scope_depth = len(self.scopes)
     nodes = self.FUNCTION.split(raw_template)
     for index, node in enumerate(nodes):
@@ -306,6 +302,34 @@ class Template(list):
         self._ExtendFunction(node)
       else:
         self._ExtendText(node)
+    self._VerifyScopeDepth(scope_depth)
+
+  def _AddTokens(self, tokens):
+    """Extends the Template by adding the parts given by template tokens.
+
+    Tokens are generated by Tokenize, the result is the same as adding the
+    template string they were generated from.
+
+    Raises:
+      TemplateSyntaxError: Unbalanced number of scopes in added template.
+    """
+    self._Invalidate()
+    scope_depth = len(self.scopes)
+    for token in tokens:
+      if token[0] == 'text':
+        self._AddToOpenScope(TemplateText(token[1]))
+      elif token[0] == 'tag':
+        self._AddToOpenScope(TemplateTag(*token[1:]))
+      else:
+        self._ExtendFunction(token[1])
+    self._VerifyScopeDepth(scope_depth)
+
+  def _VerifyScopeDepth(self, scope_depth):
+    """Verifies that the scopes are back at the given depth after adding.
+
+    Raises:
+      TemplateSyntaxError: There are more or less scopes open than before.
+    """
     if len(self.scopes) != scope_depth:
       scope_diff = len(self.scopes) - scope_depth
       if scope_diff < 0:
@@ -315,9 +339,105 @@ class Template(list):
   def Parse(self, **kwds):
     """Returns the parsed template as SafeString.
 
-    The template is parsed by parsing each of its members and combining that.
+    The template is rendered by its compiled function, refer to _Render.
+    """
+    return SafeString(''.join(self._Render(kwds)))
+
+  def _Render(self, kwds):
+    """Returns a list of the output strings for the given replacements.
+
+    On first use, the template is compiled into a Python function by the
+    TemplateCompiler. This function is kept until the template is changed.
+    Modified template files are reloaded first, refer to ReloadIfModified.
+    """
+    self.ReloadIfModified()
+    if self._render is None:
+      self._render = TemplateCompiler().Compile(self)
+    return self._render(kwds)
+
+  def Stream(self, **kwds):
+    """Yields the parsed template in chunks of about CHUNK_SIZE bytes.
+
+    The output is that of Parse, but it is never held in memory completely.
+    The template is rendered by a compiled generator, which hands over its
+    output at the end of loop iterations once enough of it is collected. This
+    output is combined into chunks of at least CHUNK_SIZE bytes (except for the
+    last one), which makes the generator suitable as a streaming response body.
+    """
+    pending = []
+    pending_size = 0
+    for parts in self._Stream(kwds):
+      chunk = ''.join(parts)
+      pending.append(chunk)
+      pending_size += len(chunk)
+      if pending_size >= self.CHUNK_SIZE:
+        yield ''.join(pending)
+        pending = []
+        pending_size = 0
+    if pending_size:
+      yield ''.join(pending)
+
+  def _Stream(self, kwds):
+    """Returns a generator of lists of output strings for the replacements.
+
+    On first use, the template is compiled into a generator function by the
+    TemplateCompiler. This function is kept until the template is changed.
+    Modified template files are reloaded first, refer to ReloadIfModified.
+    """
+    self.ReloadIfModified()
+    if self._stream is None:
+      self._stream = TemplateCompiler(streaming=True).Compile(self)
+    return self._stream(kwds)
+
+  def ReloadIfModified(self):
+    """Reloads the modified template files that this template depends on.
+
+    The dependencies are the templates added by {{ inline }}, each of which
+    checks its own dependencies in turn. A reloaded template invalidates the
+    compiled functions of all templates that inlined it, refer to _Invalidate.
+
+    Returns:
+      bool: Whether any of the dependencies was reloaded.
     """
-    return SafeString(''.join(tag.Parse(**kwds) for tag in self))
+    reloaded = False
+    for dependency in self.dependencies:
+      if dependency.ReloadIfModified():
+        reloaded = True
+    return reloaded
+
+  def _Invalidate(self):
+    """Discards the compiled functions of this template and its dependents.
+
+    Compiled functions include the code of inlined templates, so a change to a
+    template requires all templates that (indirectly) inline it to recompile.
+    """
+    self._render = self._stream = None
+    for dependent in self.dependents.values():
+      dependent._Invalidate()
+
+  def _RemoveDependencies(self):
+    """Removes this template from the dependents of its dependencies."""
+    for dependency in self.dependencies:
+      dependency.dependents.pop(id(self), None)
+    self.dependencies = []
+
+  @classmethod
+  def Tokenize(cls, raw_template):
+    """Yields the tokens of a template string, as tuples of strings.
+
+    These are ('text', text), ('tag', name, indices, functions) for tags and
+    ('function', function) for template functions like {{ for }}. Tokens only
+    hold strings, tuples and lists, which allows them to be stored by marshal.
+    """
+    for index, node in enumerate(cls.FUNCTION.split(raw_template)):
+      if index % 2:
+        yield 'function', node
+        continue
+      for part in cls.TagSplit(node):
+        if isinstance(part, TemplateTag):
+          yield 'tag', part.name, tuple(part.indices), tuple(part.functions)
+        else:
+          yield 'text', str(part)
 
   @classmethod
   def TagSplit(cls, template):
@@ -393,6 +513,7 @@ class Template(list):
   #
   def _AddToOpenScope(self, item):
     """Adds a template part to the current open scope."""
+    self._render = self._stream = None
     self.scopes[-1].append(item)
 
   def _CloseScope(self, scope_cls):
@@ -437,18 +558,28 @@ class FileTemplate(Template):
     try:
       self._file_name = os.path.abspath(template_path)
       self._file_mtime = os.path.getmtime(self._file_name)
-      raw_template = file(self._file_name).read()
-      super(FileTemplate, self).__init__(raw_template, parser=parser)
+      tokens = self._ReadTokens(self._file_mtime, parser)
+      super(FileTemplate, self).__init__('', parser=parser)
+      self._AddTokens(tokens)
     except (IOError, OSError):
       raise TemplateReadError('Cannot open: %r' % template_path)
 
-  def Parse(self, **kwds):
-    """Returns the parsed template as SafeString.
+  def _ReadTokens(self, mtime, parser):
+    """Returns the tokens of the template file, as modified at `mtime`.
 
-    The template is parsed by parsing each of its members and combining that.
+    If the parser has a TemplateCache, the tokens are taken from there. If they
+    are not cached, the file is read and tokenized, and the result is cached.
     """
-    self.ReloadIfModified()
-    return super(FileTemplate, self).Parse(**kwds)
+    cache = getattr(parser, 'cache', None)
+    if cache is not None:
+      tokens = cache.Get(self._file_name, mtime)
+      if tokens is not None:
+        return tokens
+    with file(self._file_name) as template:
+      tokens = list(self.Tokenize(template.read()))
+    if cache is not None:
+      cache.Put(self._file_name, mtime, tokens)
+    return tokens
 
   def ReloadIfModified(self):
     """Reloads the template file if it was modified on disk.
@@ -459,19 +590,347 @@ class FileTemplate(Template):
 
     If the new template has a syntax error or other problem during looading,
     that error *will* be raised.
+
+    After checking its own file, the inlined templates are checked as well.
+    Templates that inline this one are invalidated when it is reloaded.
+
+    Returns:
+      bool: Whether this template or any of its dependencies was reloaded.
     """
+    reloaded = False
     try:
       mtime = os.path.getmtime(self._file_name)
       if mtime > self._file_mtime:
-        template = file(self._file_name).read()
+        tokens = self._ReadTokens(mtime, self.parser)
+        self._RemoveDependencies()
         del self[:]
         self.scopes = [self]
-        self.AddString(template)
+        self._AddTokens(tokens)
         self._file_mtime = mtime
+        reloaded = True
     except (IOError, OSError):
       # File cannot be stat'd or read. No longer exists or we lack permissions.
       # We shouldn't error in this case, but carry on with the template we have.
       pass
+    return super(FileTemplate, self).ReloadIfModified() or reloaded
+
+
+class TemplateCache(object):
+  """Directory of parsed template files, to skip parsing them on startup.
+
+  The tokens of each template file (refer to Template.Tokenize) are marshalled
+  to a file named after the SHA1 of the template's path. Each entry holds the
+  cache version, the path and the modification time of the template file, and
+  is only used when all of these match. Modified templates are therefore
+  parsed again, after which their entry is replaced.
+
+  Failures to write the cache are ignored, the templates are then simply parsed
+  again next time. Entries are readable by all users, so that a cache warmed
+  by a deploy user can be used by the processes of the web server.
+  """
+  # Version of the cache entries, to be raised when the tokens change.
+  VERSION = 1
+  # File mode of the cache entries.
+  ENTRY_MODE = 0644
+
+  def __init__(self, directory):
+    """Initializes a TemplateCache, creating the directory if needed.
+
+    Arguments:
+      @ directory: str
+        The directory where the cache entries are stored.
+    """
+    self.directory = directory
+    if not os.path.isdir(directory):
+      try:
+        os.makedirs(directory)
+      except OSError:
+        pass
+
+  def _EntryKey(self, path, mtime):
+    """Returns the key stored with entries, to verify they are current."""
+    return self.VERSION, marshal.version, path, mtime
+
+  def _EntryPath(self, path):
+    """Returns the path of the cache entry for the given template path."""
+    return os.path.join(self.directory, hashlib.sha1(path).hexdigest())
+
+  def Get(self, path, mtime):
+    """Returns the cached tokens of a template, or None if not cached.
+
+    Arguments:
+      @ path: str
+        The absolute path of the template file.
+      @ mtime: float
+        The modification time of the template file.
+    """
+    try:
+      with open(self._EntryPath(path), 'rb') as entry:
+        key, tokens = marshal.load(entry)
+    except (EnvironmentError, EOFError, TypeError, ValueError):
+      return None
+    if key != self._EntryKey(path, mtime):
+      return None
+    return tokens
+
+  def Put(self, path, mtime, tokens):
+    """Stores the tokens of a template in the cache.
+
+    The entry is written to a temporary file first, which is then renamed. This
+    way, other processes never read a partially written entry.
+
+    Arguments:
+      @ path: str
+        The absolute path of the template file.
+      @ mtime: float
+        The modification time of the template file.
+      @ tokens: list of tuple
+        The tokens of the template, as returned by Template.Tokenize.
+    """
+    try:
+      handle, temp_path = tempfile.mkstemp(dir=self.directory)
+    except EnvironmentError:
+      return
+    try:
+      os.fchmod(handle, self.ENTRY_MODE)
+      with os.fdopen(handle, 'wb') as entry:
+        marshal.dump((self._EntryKey(path, mtime), tokens), entry)
+      os.rename(temp_path, self._EntryPath(path))
+    except EnvironmentError:
+      try:
+        os.unlink(temp_path)
+      except OSError:
+        pass
+
+
+class TemplateCompiler(object):
+  """Compiles a Template into a Python function that renders it.
+
+  The generated function takes the dictionary of replacements and returns a
+  list of output strings. Adjacent texts are combined into constants, and tag
+  lookups, index chains and function pipelines are written out inline. Their
+  behaviour is that of TemplateTag.Parse and TemplateLoop.Parse; the output is
+  identical to parsing the template's node tree.
+
+  Conditional expressions are evaluated by their TemplateConditional. The code
+  of nested templates (added by {{ inline }}) is included in the function, the
+  nested template invalidates the function when it is modified or reloaded.
+  Tag functions are looked up in TAG_FUNCTIONS on every render, as before.
+
+  For streaming, a generator function is compiled instead. It yields its list
+  of output strings at the end of a loop iteration or nested template once the
+  list has STREAM_PARTS entries, and starts a new list after that.
+  """
+  STREAM_PARTS = 256
+
+  def __init__(self, streaming=False):
+    """Initializes a TemplateCompiler.
+
+    Arguments:
+      % streaming: bool ~~ False
+        Whether to compile a generator of output lists rather than a function
+        that returns the complete output list.
+    """
+    self.streaming = streaming
+    self.lines = []
+    self.namespace = {
+        'SafeString': SafeString,
+        'TAG_FUNCTIONS': TAG_FUNCTIONS,
+        'TemplateNameError': TemplateNameError,
+        'TemplateTypeError': TemplateTypeError,
+        'TemplateValueError': TemplateValueError}
+    self.counter = itertools.count(1)
+
+  def Compile(self, template):
+    """Returns the rendering function for the given Template.
+
+    Templates that nest too deeply for the Python compiler are rendered by
+    parsing their node tree instead.
+    """
+    self._Line(0, 'def Render(scope_0):')
+    self._Line(1, 'output = []')
+    self._Line(1, 'write = output.append')
+    self._EmitParts(template, 'scope_0', 1)
+    if self.streaming:
+      self._Line(1, 'yield output')
+    else:
+      self._Line(1, 'return output')
+    try:
+      code = compile('\n'.join(self.lines), '<template>', 'exec')
+    except SyntaxError:
+      if self.streaming:
+        return lambda kwds: self._StreamParts(template, kwds)
+      return lambda kwds: [part.Parse(**kwds) for part in template]
+    exec code in self.namespace
+    return self.namespace['Render']
+
+  @staticmethod
+  def _StreamParts(template, kwds):
+    """Yields the output of the template's parts, parsing their node trees.
+
+    This is the streaming fallback for templates that cannot be compiled. Every
+    part is handed over separately, nested templates are streamed themselves.
+    """
+    for part in template:
+      if isinstance(part, Template):
+        for parts in part._Stream(kwds):
+          yield parts
+      else:
+        yield [part.Parse(**kwds)]
+
+  def _Bind(self, obj):
+    """Returns the name under which `obj` is made available to the code."""
+    name = 'node_%d' % next(self.counter)
+    self.namespace[name] = obj
+    return name
+
+  def _Line(self, depth, line):
+    """Adds a line of code at the given indentation depth."""
+    self.lines.append('  ' * depth + line)
+
+  def _EmitFlush(self, depth):
+    """Adds code yielding the output list once it has STREAM_PARTS entries."""
+    self._Line(depth, 'if len(output) >= %d:' % self.STREAM_PARTS)
+    self._Line(depth + 1, 'yield output')
+    self._Line(depth + 1, 'output = []')
+    self._Line(depth + 1, 'write = output.append')
+
+  def _EmitParts(self, parts, scope, depth):
+    """Adds the code for a sequence of template parts.
+
+    A `pass` statement is added for sequences that generate no code, so that
+    the parts can form the body of a block.
+    """
+    line_count = len(self.lines)
+    text = []
+    for part in parts:
+      if isinstance(part, TemplateText):
+        text.append(str(part))
+        continue
+      if text:
+        self._Line(depth, 'write(%r)' % ''.join(text))
+        text = []
+      if isinstance(part, TemplateTag):
+        self._EmitTag(part, scope, depth)
+      elif isinstance(part, TemplateLoop):
+        self._EmitLoop(part, scope, depth)
+      elif isinstance(part, TemplateConditional):
+        self._EmitConditional(part, scope, depth)
+      elif isinstance(part, Template):
+        self._EmitParts(part, scope, depth)
+        if self.streaming:
+          self._EmitFlush(depth)
+      else:
+        self._Line(depth, 'write(%s.Parse(**%s))' % (self._Bind(part), scope))
+    if text:
+      self._Line(depth, 'write(%r)' % ''.join(text))
+    if len(self.lines) == line_count:
+      self._Line(depth, 'pass')
+
+  def _EmitConditional(self, conditional, scope, depth):
+    """Adds the code for a TemplateConditional and its branches.
+
+    TemplateExpressions are called directly, other branch expressions are
+    evaluated by the Expression method of the conditional.
+    """
+    name = self._Bind(conditional)
+    for number, (expr, branch) in enumerate(conditional.branches):
+      clause = 'elif' if number else 'if'
+      if isinstance(expr, TemplateExpression):
+        self._Line(depth, '%s %s(%s):' % (clause, self._Bind(expr), scope))
+      else:
+        self._Line(depth, '%s %s.Expression(%s, **%s):' % (
+            clause, name, self._Bind(expr), scope))
+      self._EmitParts(branch, scope, depth + 1)
+    if conditional.default:
+      self._Line(depth, 'else:')
+      self._EmitParts(conditional.default, scope, depth + 1)
+
+  def _EmitIndices(self, indices, depth):
+    """Adds the lookups of `indices` on `value`, as done by _GetIndex.
+
+    Failing lookups raise AttributeError or LookupError, to be handled by the
+    code surrounding the lookups.
+    """
+    for index in indices:
+      self._Line(depth, 'try:')
+      if index.isdigit():
+        self._Line(depth + 1, 'value = value[%d]' % int(index))
+        self._Line(depth, 'except KeyError:')
+        self._Line(depth + 1, 'value = value[%r]' % index)
+      else:
+        self._Line(depth + 1, 'value = value[%r]' % index)
+        self._Line(depth, 'except (KeyError, TypeError):')
+        self._Line(depth + 1, 'value = getattr(value, %r)' % index)
+
+  def _EmitLoop(self, loop, scope, depth):
+    """Adds the code for a TemplateLoop, as done by TemplateLoop.Parse."""
+    number = next(self.counter)
+    loop_scope = 'scope_%d' % number
+    item = 'item_%d' % number
+    tag = loop.tag
+    self._Line(depth, 'try:')
+    self._Line(depth + 1, 'value = %s[%r]' % (scope, tag.name))
+    self._Line(depth, 'except KeyError:')
+    self._Line(depth + 1, 'raise TemplateNameError(%r)' % (
+        'No replacement with name %r' % tag.name))
+    if tag.indices:
+      self._Line(depth, 'try:')
+      self._EmitIndices(tag.indices, depth + 1)
+      self._Line(depth, 'except (AttributeError, LookupError):')
+      self._Line(depth + 1, 'value = ()')
+      if tag.functions:
+        self._Line(depth, 'else:')
+    for func in tag.functions:
+      self._Line(depth + bool(tag.indices),
+                 'value = TAG_FUNCTIONS[%r](value)' % func)
+    self._Line(depth, '%s = %s.copy()' % (loop_scope, scope))
+    self._Line(depth, 'for %s in value:' % item)
+    if loop.aliascount == 1:
+      self._Line(depth + 1, '%s[%r] = %s' % (loop_scope, loop.aliases[0], item))
+    else:
+      count = loop.aliascount
+      self._Line(depth + 1, 'try:')
+      self._Line(depth + 2, 'if %d != len(%s):' % (count, item))
+      self._Line(depth + 3, 'raise TemplateValueError(%r %% len(%s))' % (
+          'Cannot unpack %%d values into %d tags' % count, item))
+      self._Line(depth + 1, 'except TypeError:')
+      self._Line(depth + 2, 'raise TemplateValueError(%r %% type(%s))' % (
+          'Cannot unpack %%s into %d tags' % count, item))
+      self._Line(depth + 1, '%s.update(zip(%r, %s))' % (
+          loop_scope, tuple(loop.aliases), item))
+    self._EmitParts(loop, loop_scope, depth + 1)
+    if self.streaming:
+      self._EmitFlush(depth + 1)
+
+  def _EmitTag(self, tag, scope, depth):
+    """Adds the code for a TemplateTag, as done by TemplateTag.Parse."""
+    self._Line(depth, 'try:')
+    self._Line(depth + 1, 'value = %s[%r]' % (scope, tag.name))
+    self._EmitIndices(tag.indices, depth + 1)
+    self._Line(depth, 'except (AttributeError, LookupError):')
+    self._Line(depth + 1, 'write(%r)' % str(tag))
+    self._Line(depth, 'else:')
+    depth += 1
+    for func in tag.functions:
+      if TemplateTag.FUNC_CLOSURE.match(func):
+        self._Line(depth, 'value = %s._ApplyFunction(%r, value)' % (
+            self._Bind(tag), func))
+        continue
+      self._Line(depth, 'try:')
+      self._Line(depth + 1, 'value = TAG_FUNCTIONS[%r](value)' % func)
+      self._Line(depth, 'except TypeError, error:')
+      self._Line(depth + 1, 'raise TemplateTypeError(error)')
+      self._Line(depth, 'except KeyError, error:')
+      self._Line(depth + 1, 'raise TemplateNameError(%r %% error.args[0])' % (
+          'Unknown template tag function %r'))
+    if not tag.functions:
+      self._Line(depth, 'if not isinstance(value, SafeString):')
+      self._Line(depth + 1, "value = TAG_FUNCTIONS['default'](value)")
+    self._Line(depth, 'if isinstance(value, unicode):')
+    self._Line(depth + 1, "write(value.encode('utf8'))")
+    self._Line(depth, 'else:')
+    self._Line(depth + 1, 'write(str(value))')
 
 
 class TemplateConditional(object):
@@ -533,25 +992,12 @@ class TemplateConditional(object):
 
   @staticmethod
   def Expression(expr, **kwds):
-    """Returns the eval()'ed result of a tag expression."""
-    nodes = []
-    local_vars = LazyTagValueRetrieval(kwds)
-    for num, node in enumerate(expr):
-      if isinstance(node, TemplateTag):
-        node_name = '__tmpl_var_%d' % num
-        local_vars[node_name] = node
-        nodes.append(node_name)
-      else:
-        nodes.append(node)
-    try:
-      #XXX(Elmer): This uses eval, it's so much easier than lexing and parsing
-      return eval(''.join(nodes), None, local_vars)
-    except NameError, error:
-      raise TemplateNameError(str(error).capitalize() + '. Try it as tagname?')
+    """Returns the result of a branch's TemplateExpression."""
+    return expr(kwds)
 
   def NewBranch(self, expr):
     """Begins a new branch based on the given expression."""
-    self.branches.append((tuple(Template.TagSplit(expr)), []))
+    self.branches.append((TemplateExpression(Template.TagSplit(expr)), []))
 
   def Parse(self, **kwds):
     """Returns the TemplateConditional parsed as string.
@@ -575,6 +1021,48 @@ class TemplateConditional(object):
     return ''
 
 
+class TemplateExpression(tuple):
+  """The expression of a conditional branch, as a tuple of texts and tags.
+
+  On first evaluation, the expression is compiled into a Python function. The
+  tags are replaced by calls to their GetValue method, so that tag values are
+  only retrieved when the expression needs them, and short-circuiting works as
+  it does in Python. Other names in the expression are resolved in the module
+  namespace and builtins. Later evaluations only call the compiled function.
+  """
+  _function = None
+
+  def __call__(self, values):
+    """Returns the value of the expression for the given replacements."""
+    if self._function is None:
+      self._function = self._Compile()
+    try:
+      return self._function(values)
+    except NameError, error:
+      message = str(error).replace('global name', 'name', 1)
+      raise TemplateNameError(message.capitalize() + '. Try it as tagname?')
+
+  def _Compile(self):
+    """Returns a function that evaluates the expression for replacements.
+
+    Raises:
+      SyntaxError: The expression is not valid Python syntax.
+    """
+    tags = []
+    nodes = []
+    for node in self:
+      if isinstance(node, TemplateTag):
+        nodes.append('__tmpl_tags[%d].GetValue(__tmpl_values)' % len(tags))
+        tags.append(node)
+      else:
+        nodes.append(node)
+    source = ''.join(nodes)
+    # The source is compiled on its own first, so that it fails like eval().
+    compile(source, '<template expression>', 'eval')
+    return eval('lambda __tmpl_tags: lambda __tmpl_values: (%s\n)' % source)(
+        tuple(tags))
+
+
 class TemplateConditionalPresence(TemplateConditional):
   """A template construct to safely check for the presence of tags."""
   @staticmethod
@@ -669,6 +1157,9 @@ class TemplateTag(object):
       re.VERBOSE)
   FUNC_FINDER = re.compile('\|([\w-]+(?:\([^()]*?\))?)')
   FUNC_CLOSURE = re.compile('(\w+)\((.*)\)')
+  # Function names and compiled closure arguments, by function string. This is
+  # set on the instance when the first closure is applied.
+  _compiled_functions = None
 
   def __init__(self, name, indices=(), functions=()):
     """Initializes a TemplateTag instant.
@@ -739,17 +1230,58 @@ class TemplateTag(object):
       raise TemplateNameError('No replacement with name %r' % self.name)
 
   @classmethod
-  def ApplyFunction(cls, func, value):
+  def _CompileFunction(cls, func):
+    """Returns the name and arguments function for a tag function string.
+
+    For closures, the arguments are compiled into a function that returns the
+    tuple of arguments, given the tag value. Plain functions have no arguments
+    function.
+
+    Raises:
+      TemplateSyntaxError: The closure arguments are not valid syntax.
+    """
     closure = cls.FUNC_CLOSURE.match(func)
+    if not closure:
+      return func, None
+    name, args = closure.groups()
     try:
-      if not closure:
-        return TAG_FUNCTIONS[func](value)
-      func, args = closure.groups()
-      #XXX(Elmer): This uses eval, it's so much easier than lexing and parsing
-      args = eval(args + ',') if args.strip() else ()
-      return TAG_FUNCTIONS[func](*args)(value)
+      if args.strip():
+        return name, eval('lambda value: (%s,\n)' % args)
+      return name, lambda value: ()
     except SyntaxError:
       raise TemplateSyntaxError('Invalid argument syntax: %r' % args)
+
+  def _GetFunction(self, func):
+    """Returns the compiled tag function string, kept on the tag for reuse."""
+    if self._compiled_functions is None:
+      self._compiled_functions = {}
+    try:
+      return self._compiled_functions[func]
+    except KeyError:
+      return self._compiled_functions.setdefault(
+          func, self._CompileFunction(func))
+
+  @classmethod
+  def ApplyFunction(cls, func, value):
+    """Returns the value after applying the named tag function to it.
+
+    Closure arguments are compiled for every call. Tags apply their functions
+    through _ApplyFunction instead, which compiles them once per tag.
+    """
+    return cls._CallFunction(cls._CompileFunction(func), value)
+
+  def _ApplyFunction(self, func, value):
+    """Returns the value after applying one of the tag's functions to it."""
+    return self._CallFunction(self._GetFunction(func), value)
+
+  @staticmethod
+  def _CallFunction(function, value):
+    """Returns the value after calling a compiled tag function on it."""
+    func, arguments = function
+    try:
+      if arguments is None:
+        return TAG_FUNCTIONS[func](value)
+      return TAG_FUNCTIONS[func](*arguments(value))(value)
     except TypeError, err_obj:
       raise TemplateTypeError(err_obj)
     except KeyError, err_obj:
@@ -783,7 +1315,7 @@ class TemplateTag(object):
     # Process functions, or apply default if value is not SafeString
     if self.functions:
       for func in self.functions:
-        value = self.ApplyFunction(func, value)
+        value = self._ApplyFunction(func, value)
     else:
       if not isinstance(value, SafeString):
         value = TAG_FUNCTIONS['default'](value)
@@ -899,3 +1431,58 @@ TAG_FUNCTIONS = {
     'values': lambda d: d.values(),
     'sorted': sorted,
     'len': len}
+
+
+def WarmCache(template_dir, cache_dir):
+  """Parses all templates in `template_dir` into the cache in `cache_dir`.
+
+  Every file below the template directory, other than hidden files, is loaded
+  as a template. Templates that fail to load are reported but don't stop the
+  others from being cached.
+
+  Returns:
+    2-tuple: the names of the cached templates, and a list of the names and
+    errors of the templates that could not be loaded.
+  """
+  parser = Parser(template_dir, cache_dir=cache_dir)
+  cached = []
+  failed = []
+  for directory, subdirs, files in os.walk(template_dir):
+    subdirs[:] = sorted(name for name in subdirs if not name.startswith('.'))
+    for name in sorted(files):
+      if name.startswith('.'):
+        continue
+      name = os.path.relpath(os.path.join(directory, name), template_dir)
+      try:
+        parser[name]
+        cached.append(name)
+      except Error, error:
+        failed.append((name, error))
+  return cached, failed
+
+
+def main():
+  """Warms the template cache for a template directory.
+
+  Usage: python -m newweb.templateparser TEMPLATE_DIR CACHE_DIR
+
+  This is meant to be run at deploy time, with the same directories that the
+  application's Parser uses, so that new processes start with parsed templates.
+  """
+  option_parser = optparse.OptionParser(
+      usage='%prog TEMPLATE_DIR CACHE_DIR',
+      description='Parses all templates in TEMPLATE_DIR into CACHE_DIR.')
+  _options, args = option_parser.parse_args()
+  if len(args) != 2:
+    option_parser.error('expected TEMPLATE_DIR and CACHE_DIR')
+  start = time.time()
+  cached, failed = WarmCache(*args)
+  for name, error in failed:
+    print >> sys.stderr, 'Failed to load %s: %s' % (name, error)
+  print 'Cached %d templates in %.2fs, %d failed.' % (
+      len(cached), time.time() - start, len(failed))
+  return 1 if failed else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,235 @@
+#!/usr/bin/python
+"""Tests for the NewWeb WSGI application."""
+
+# Too many public methods
+# pylint: disable=R0904
+
+# Standard modules
+import cStringIO
+import gzip
+import os
+import sys
+import unittest
+
+# Unittest target
+import newweb
+
+
+class DispatchPageMaker(newweb.pagemaker.BasePageMaker):
+  """Minimal PageMaker for request dispatching tests."""
+  def Index(self):
+    """Returns a fixed string."""
+    return 'index'
+
+  def Item(self, item):
+    """Returns the item taken from the url."""
+    return 'item %s' % item
+
+  def Stream(self):
+    """Returns a streaming body, without rendering it for HEAD requests."""
+    if self.req.is_head:
+      return newweb.Response(headers={'Content-Length': '8'})
+    return newweb.Response(chunk for chunk in ('spam', 'eggs'))
+
+  def Chunks(self):
+    """Returns a streaming body of unknown length."""
+    return newweb.Response(chunk for chunk in ('spam', 'eggs'))
+
+  def Form(self):
+    """Returns the posted value of 'q'."""
+    return 'q=%s' % self.post.getfirst('q')
+
+  @newweb.pagemaker.MaxBodySize(100)
+  def Upload(self):
+    """Returns the posted value of 'q', from a larger body."""
+    return 'q=%s' % self.post.getfirst('q')
+
+
+class ReloadPageMaker(DispatchPageMaker):
+  """PageMaker with a Reload handler, for the route cache flushing test."""
+  def Reload(self):
+    """Reloads the PageMaker module."""
+    super(ReloadPageMaker, self).Reload()
+
+
+class PostInitPageMaker(DispatchPageMaker):
+  """PageMaker that reads the request body before the handler is called."""
+  def _PostInit(self):
+    """Reads the posted value of 'q'."""
+    self.query = self.post.getfirst('q')
+
+
+class NewWebDispatch(unittest.TestCase):
+  """Tests request dispatching through the NewWeb WSGI application."""
+  def setUp(self):
+    # Reloading the PageMaker module would reload this test module while its
+    # tests are running, reload() is replaced by one that records the modules.
+    self.reloaded = []
+    newweb.reload = lambda module: self.reloaded.append(module) or 'reloaded'
+    self.app = newweb.NewWeb(DispatchPageMaker, [
+        ('/', ('GET',), 'Index'),
+        ('/item/(\w+)', ('GET', 'DELETE'), 'Item'),
+        ('/stream', ('GET',), 'Stream'),
+        ('/chunks', ('GET',), 'Chunks'),
+        ('/form', ('POST',), 'Form'),
+        ('/upload', ('POST',), 'Upload')],
+                             config={'routing': {'cache_size': 8},
+                                     'request': {'max_body_size': '20'}})
+
+  def tearDown(self):
+    del newweb.reload
+
+  def Request(self, path, method='GET', data='', **env):
+    """Returns the status, headers and body for a request to the application."""
+    started = []
+    env.setdefault('CONTENT_LENGTH', str(len(data)))
+    env.update({'PATH_INFO': path, 'REQUEST_METHOD': method, 'QUERY_STRING': '',
+                'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+                'wsgi.input': cStringIO.StringIO(data)})
+    body = ''.join(self.app(env, lambda *args: started.extend(args)))
+    status, headers = started
+    return status, dict(headers), body
+
+  def testHandlerResponse(self):
+    """[NewWeb] Routed requests return the handler's output"""
+    status, _headers, body = self.Request('/item/spam')
+    self.assertEqual(status, '200 OK')
+    self.assertEqual(body, 'item spam')
+
+  def testMethodNotAllowed(self):
+    """[NewWeb] Requests with a rejected method get a 405 with Allow header"""
+    status, headers, _body = self.Request('/item/spam', method='POST')
+    self.assertEqual(status, '405 Method Not Allowed')
+    self.assertEqual(headers['Allow'], 'DELETE, GET, HEAD')
+
+  def testHeadRequest(self):
+    """[NewWeb] HEAD requests get the GET headers and no body"""
+    status, headers, body = self.Request('/item/spam', method='HEAD')
+    self.assertEqual(status, '200 OK')
+    self.assertEqual(headers['Content-Length'], str(len('item spam')))
+    self.assertEqual(body, '')
+
+  def testHeadRequestNotCompressed(self):
+    """[NewWeb] HEAD requests get the gzip headers without compressing"""
+    self.app.compress_level = 6
+    self.app.compress_minimum = 0
+    _status, get_headers, _body = self.Request(
+        '/item/spam', HTTP_ACCEPT_ENCODING='gzip')
+    _status, headers, body = self.Request(
+        '/item/spam', method='HEAD', HTTP_ACCEPT_ENCODING='gzip')
+    self.assertEqual(body, '')
+    self.assertEqual(headers['Content-Encoding'], 'gzip')
+    self.assertEqual(headers['Vary'], 'Accept-Encoding')
+    self.assertFalse('Content-Length' in headers)
+    del get_headers['Content-Length']
+    self.assertEqual(headers, get_headers)
+
+  def testHeadRequestUnknownLength(self):
+    """[NewWeb] HEAD requests for bodies of unknown length have no length"""
+    _status, headers, body = self.Request('/chunks')
+    self.assertFalse('Content-Length' in headers)
+    self.assertEqual(body, 'spameggs')
+    _status, headers, body = self.Request('/chunks', method='HEAD')
+    self.assertFalse('Content-Length' in headers)
+    self.assertEqual(body, '')
+
+  def testHeadRequestSkipsRendering(self):
+    """[NewWeb] Handlers can detect HEAD requests and skip rendering"""
+    _status, _headers, body = self.Request('/stream')
+    self.assertEqual(body, 'spameggs')
+    _status, headers, body = self.Request('/stream', method='HEAD')
+    self.assertEqual(headers['Content-Length'], '8')
+    self.assertEqual(body, '')
+
+  def testCompressionOptIn(self):
+    """[NewWeb] Responses are only gzipped when compression is configured"""
+    _status, headers, body = self.Request(
+        '/item/spam', HTTP_ACCEPT_ENCODING='gzip')
+    self.assertFalse('Content-Encoding' in headers)
+    self.assertEqual(body, 'item spam')
+    self.app.compress_level = 6
+    self.app.compress_minimum = 0
+    _status, headers, body = self.Request(
+        '/item/spam', HTTP_ACCEPT_ENCODING='gzip')
+    self.assertEqual(headers['Content-Encoding'], 'gzip')
+    self.assertEqual(headers['Content-Length'], str(len(body)))
+    self.assertEqual(
+        gzip.GzipFile(fileobj=cStringIO.StringIO(body)).read(), 'item spam')
+
+  def testUnknownHandler(self):
+    """[NewWeb] Routes to missing handlers are rejected at startup"""
+    self.assertRaises(newweb.UnknownHandlerError, newweb.NewWeb,
+                      DispatchPageMaker, [('/', 'Missing')], config={})
+
+  def testStaticmethodHandler(self):
+    """[NewWeb] Inherited staticmethod handlers are resolved and called"""
+    self.app = newweb.NewWeb(
+        DispatchPageMaker, [('/reload', ('GET',), 'Reload')], config={})
+    status, _headers, body = self.Request('/reload')
+    self.assertEqual(status, '200 OK')
+    self.assertEqual(body, 'Reloading ... \nreloaded')
+
+  def testPathsSetupOnce(self):
+    """[NewWeb] PageMaker paths are set up on the class by the first request"""
+    self.Request('/')
+    public_dir = DispatchPageMaker.PUBLIC_DIR
+    self.assertTrue(os.path.isabs(public_dir))
+    self.Request('/')
+    self.assertEqual(DispatchPageMaker.PUBLIC_DIR, public_dir)
+
+  def testRouteCacheFlushedOnReload(self):
+    """[NewWeb] The route cache is enabled by config and flushed on reload"""
+    self.app = newweb.NewWeb(ReloadPageMaker, [
+        ('/item/(\w+)', ('GET',), 'Item'),
+        ('/reload', ('GET',), 'Reload')],
+                             config={'routing': {'cache_size': 8}})
+    self.Request('/item/spam')
+    self.Request('/item/spam')
+    self.assertEqual(self.app.route_cache.hits, 1)
+    self.Request('/reload')
+    self.assertEqual(len(self.app.route_cache), 0)
+    self.assertEqual(self.reloaded, [sys.modules[__name__]])
+
+  def testBodySizeLimit(self):
+    """[NewWeb] Bodies beyond the maximum size get a 413 without being read"""
+    status, _headers, body = self.Request('/form', 'POST', 'q=spam')
+    self.assertEqual(status, '200 OK')
+    self.assertEqual(body, 'q=spam')
+    status, _headers, _body = self.Request(
+        '/form', 'POST', 'q=spam', CONTENT_LENGTH='1000000')
+    self.assertEqual(status, '413 Request Entity Too Large')
+
+  def testChunkedBodySizeLimit(self):
+    """[NewWeb] Chunked bodies are rejected once they exceed the maximum size"""
+    status, _headers, body = self.Request(
+        '/form', 'POST', 'q=spam', CONTENT_LENGTH='',
+        HTTP_TRANSFER_ENCODING='chunked')
+    self.assertEqual(status, '200 OK')
+    self.assertEqual(body, 'q=spam')
+    status, _headers, body = self.Request(
+        '/form', 'POST', 'q=' + 'spam' * 10, CONTENT_LENGTH='',
+        HTTP_TRANSFER_ENCODING='chunked')
+    self.assertEqual(status, '413 Request Entity Too Large')
+    self.assertFalse('spam' in body)
+
+  def testHandlerBodySizeLimit(self):
+    """[NewWeb] Handlers can have their own maximum request body size"""
+    status, _headers, body = self.Request('/upload', 'POST', 'q=' + 'x' * 50)
+    self.assertEqual(status, '200 OK')
+    status, _headers, _body = self.Request('/upload', 'POST', 'q=' + 'x' * 99)
+    self.assertEqual(status, '413 Request Entity Too Large')
+
+  def testHandlerBodySizeLimitInPostInit(self):
+    """[NewWeb] The handler's maximum body size applies to _PostInit reads"""
+    self.app = newweb.NewWeb(PostInitPageMaker, [
+        ('/upload', ('POST',), 'Upload')],
+                             config={'request': {'max_body_size': '20'}})
+    status, _headers, body = self.Request('/upload', 'POST', 'q=' + 'x' * 50)
+    self.assertEqual(status, '200 OK')
+    self.assertEqual(body, 'q=' + 'x' * 50)
+    status, _headers, _body = self.Request('/upload', 'POST', 'q=' + 'x' * 99)
+    self.assertEqual(status, '413 Request Entity Too Large')
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
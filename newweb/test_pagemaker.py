@@ -0,0 +1,281 @@
+#!/usr/bin/python
+"""Tests for the pagemaker module."""
+
+# Too many public methods
+# pylint: disable=R0904
+
+# Standard modules
+import cStringIO
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Unittest target
+import newweb
+from . import pagemaker
+
+
+class StaticPageMaker(pagemaker.BasePageMaker):
+  """PageMaker serving static files from a directory set up by the tests."""
+
+
+class StaticFiles(unittest.TestCase):
+  """Tests serving of static files through BasePageMaker.Static."""
+  def setUp(self):
+    self.public_dir = tempfile.mkdtemp()
+    StaticPageMaker.LOCAL_DIR = StaticPageMaker.PUBLIC_DIR = self.public_dir
+    StaticPageMaker.PERSISTENT = pagemaker.CacheStorage()
+    self.content = 'body { color: red; }\n' * 100
+    with open(os.path.join(self.public_dir, 'style.css'), 'wb') as static:
+      static.write(self.content)
+    self.app = newweb.NewWeb(
+        StaticPageMaker, [('/static/(.*)', 'Static')], config={})
+
+  def tearDown(self):
+    shutil.rmtree(self.public_dir)
+
+  def Request(self, path, **env):
+    """Returns status, headers and response iterable for a GET request."""
+    started = []
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET', 'QUERY_STRING': '',
+               'wsgi.input': cStringIO.StringIO()}
+    environ.update(env)
+    app_iter = self.app(environ, lambda *args: started.extend(args))
+    status, headers = started
+    return status, dict(headers), app_iter
+
+  def testStaticFile(self):
+    """[Static] Static files are served with type and length"""
+    status, headers, app_iter = self.Request('/static/style.css')
+    self.assertEqual(status, '200 OK')
+    self.assertTrue(headers['Content-Type'].startswith('text/css'))
+    self.assertEqual(headers['Content-Length'], str(len(self.content)))
+    self.assertTrue('Expires' in headers)
+    self.assertEqual(''.join(app_iter), self.content)
+    if hasattr(app_iter, 'close'):
+      app_iter.close()
+
+  def testFileWrapper(self):
+    """[Static] The server's wsgi.file_wrapper is used where available"""
+    wrapped = []
+    def FileWrapper(fileobj, block_size):
+      """Records the wrapped file and returns its content."""
+      wrapped.append(fileobj)
+      return [fileobj.read()]
+    _status, _headers, app_iter = self.Request(
+        '/static/style.css', **{'wsgi.file_wrapper': FileWrapper})
+    self.assertEqual(app_iter, [self.content])
+    self.assertEqual(len(wrapped), 1)
+
+  def testValidatorHeaders(self):
+    """[Static] Static files have ETag and Last-Modified headers"""
+    _status, headers, _app_iter = self.Request('/static/style.css')
+    file_stat = os.stat(os.path.join(self.public_dir, 'style.css'))
+    self.assertEqual(headers['ETag'], pagemaker.StaticETag(file_stat))
+    self.assertEqual(headers['Last-Modified'], time.strftime(
+        pagemaker.RFC_1123_DATE, time.gmtime(file_stat.st_mtime)))
+
+  def testIfNoneMatch(self):
+    """[Static] A matching If-None-Match results in a bodiless 304"""
+    _status, headers, _app_iter = self.Request('/static/style.css')
+    etag = headers['ETag']
+    for if_none_match in (etag, 'W/' + etag, '"other", ' + etag, '*'):
+      status, headers, app_iter = self.Request(
+          '/static/style.css', HTTP_IF_NONE_MATCH=if_none_match)
+      self.assertEqual(status, '304 Not Modified')
+      self.assertEqual(headers['ETag'], etag)
+      self.assertFalse('Content-Length' in headers)
+      self.assertEqual(''.join(app_iter), '')
+    status, _headers, _app_iter = self.Request(
+        '/static/style.css', HTTP_IF_NONE_MATCH='"other"')
+    self.assertEqual(status, '200 OK')
+
+  def testIfModifiedSince(self):
+    """[Static] If-Modified-Since is compared with the modification time"""
+    _status, headers, _app_iter = self.Request('/static/style.css')
+    status, _headers, _app_iter = self.Request(
+        '/static/style.css', HTTP_IF_MODIFIED_SINCE=headers['Last-Modified'])
+    self.assertEqual(status, '304 Not Modified')
+    status, _headers, _app_iter = self.Request(
+        '/static/style.css',
+        HTTP_IF_MODIFIED_SINCE='Thu, 01 Jan 1970 00:00:00 GMT')
+    self.assertEqual(status, '200 OK')
+
+  def testIfNoneMatchPrecedence(self):
+    """[Static] If-Modified-Since is ignored when If-None-Match is present"""
+    _status, headers, _app_iter = self.Request('/static/style.css')
+    status, _headers, _app_iter = self.Request(
+        '/static/style.css', HTTP_IF_NONE_MATCH='"other"',
+        HTTP_IF_MODIFIED_SINCE=headers['Last-Modified'])
+    self.assertEqual(status, '200 OK')
+
+  def testNotCompressedOnTheFly(self):
+    """[Static] Files without gzipped sibling are sent as-is, not compressed"""
+    self.app.compress_level = 6
+    for _attempt in range(2):
+      _status, headers, app_iter = self.Request(
+          '/static/style.css', HTTP_ACCEPT_ENCODING='gzip, deflate')
+      self.assertFalse('Content-Encoding' in headers)
+      self.assertFalse('Vary' in headers)
+      self.assertFalse(headers['ETag'].startswith('W/'))
+      self.assertEqual(headers['Content-Length'], str(len(self.content)))
+      self.assertEqual(''.join(app_iter), self.content)
+      if hasattr(app_iter, 'close'):
+        app_iter.close()
+
+  def testPrecompressedSibling(self):
+    """[Static] A gzipped sibling file is served instead of compressing"""
+    precompressed = os.path.join(self.public_dir, 'style.css.gz')
+    with open(precompressed, 'wb') as static:
+      static.write('precompressed')
+    _status, headers, app_iter = self.Request(
+        '/static/style.css', HTTP_ACCEPT_ENCODING='gzip')
+    self.assertEqual(''.join(app_iter), 'precompressed')
+    self.assertEqual(headers['Content-Encoding'], 'gzip')
+    self.assertEqual(headers['Content-Length'], '13')
+    self.assertEqual(headers['ETag'],
+                     pagemaker.StaticETag(os.stat(precompressed)))
+    self.assertEqual(headers['Vary'], 'Accept-Encoding')
+    for accept_encoding in ('gzip;q=0', None):
+      environ = {}
+      if accept_encoding is not None:
+        environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+      _status, headers, app_iter = self.Request('/static/style.css', **environ)
+      self.assertEqual(''.join(app_iter), self.content)
+      self.assertFalse('Content-Encoding' in headers)
+      self.assertEqual(headers['Vary'], 'Accept-Encoding')
+      if hasattr(app_iter, 'close'):
+        app_iter.close()
+
+  def testRangeRequest(self):
+    """[Static] Range requests are answered with the requested bytes"""
+    status, headers, app_iter = self.Request(
+        '/static/style.css', HTTP_RANGE='bytes=5-9',
+        HTTP_ACCEPT_ENCODING='gzip')
+    self.assertEqual(status, '206 Partial Content')
+    self.assertEqual(headers['Content-Range'],
+                     'bytes 5-9/%d' % len(self.content))
+    self.assertFalse('Content-Encoding' in headers)
+    self.assertEqual(''.join(app_iter), self.content[5:10])
+    app_iter.close()
+
+  def testMissingFile(self):
+    """[Static] Missing files and directories result in a 404"""
+    os.mkdir(os.path.join(self.public_dir, 'subdir'))
+    for path in ('/static/missing.css', '/static/subdir', '/static/../etc'):
+      status, _headers, _app_iter = self.Request(path)
+      self.assertEqual(status, '404 Not Found')
+
+
+class StaticCaching(StaticFiles):
+  """Runs the static file tests with the in-memory static cache enabled."""
+  def setUp(self):
+    super(StaticCaching, self).setUp()
+    self.app.config['static'] = {'cache_size': '4096',
+                                 'cache_file_size': '4096',
+                                 'cache_revalidate': '0'}
+
+  def StaticCache(self):
+    """Returns the static cache of the PageMaker class."""
+    return StaticPageMaker.PERSISTENT.Get('__static_cache')
+
+  def testFileWrapper(self):
+    """[StaticCache] Cached files are served from memory, not file_wrapper"""
+    _status, _headers, app_iter = self.Request(
+        '/static/style.css', **{'wsgi.file_wrapper': None})
+    self.assertEqual(app_iter, [self.content])
+
+  def testCacheHits(self):
+    """[StaticCache] Repeated requests for a small file are cached"""
+    for _request in range(3):
+      _status, _headers, app_iter = self.Request('/static/style.css')
+      self.assertEqual(''.join(app_iter), self.content)
+    cache = self.StaticCache()
+    self.assertEqual((cache.hits, cache.misses), (2, 1))
+    self.assertEqual(cache.bytes_held, len(self.content))
+
+  def testNormalizedPaths(self):
+    """[StaticCache] Different paths to the same file share one cache entry"""
+    for path in ('style.css', './style.css', 'sub/../style.css'):
+      _status, _headers, app_iter = self.Request('/static/' + path)
+      self.assertEqual(''.join(app_iter), self.content)
+    cache = self.StaticCache()
+    self.assertEqual((cache.hits, cache.misses), (2, 1))
+    self.assertEqual(len(cache), 1)
+
+  def testCacheRevalidation(self):
+    """[StaticCache] Cached files are reloaded when they change on disk"""
+    self.Request('/static/style.css')
+    with open(os.path.join(self.public_dir, 'style.css'), 'wb') as static:
+      static.write('new content')
+    _status, headers, app_iter = self.Request('/static/style.css')
+    self.assertEqual(''.join(app_iter), 'new content')
+    self.assertEqual(headers['Content-Length'], '11')
+
+  def testLargeFilesNotCached(self):
+    """[StaticCache] Files over the maximum file size are not cached"""
+    with open(os.path.join(self.public_dir, 'big.txt'), 'wb') as static:
+      static.write('x' * 5000)
+    _status, _headers, app_iter = self.Request('/static/big.txt')
+    self.assertEqual(len(''.join(app_iter)), 5000)
+    app_iter.close()
+    self.assertEqual(len(self.StaticCache()), 0)
+
+
+class RequestVariables(unittest.TestCase):
+  """Tests the request variable attributes of the PageMaker."""
+  def testAssignment(self):
+    """[PageMaker] Request variables can be replaced, e.g. in _PostInit"""
+    req = newweb.request.Request(
+        {'REQUEST_METHOD': 'GET', 'QUERY_STRING': 'a=1', 'PATH_INFO': '/'}, None)
+    page_maker = StaticPageMaker(req)
+    self.assertEqual(page_maker.get.getfirst('a'), '1')
+    page_maker.get = {'a': ['2']}
+    page_maker.post = {}
+    page_maker.cookies = {'session': 'abcd'}
+    self.assertEqual(page_maker.get, {'a': ['2']})
+    self.assertEqual(page_maker.post, {})
+    self.assertEqual(req.vars['cookie'], {'session': 'abcd'})
+
+
+class StaticCache(unittest.TestCase):
+  """Tests the size bounds of the StaticCache."""
+  def setUp(self):
+    self.cache = pagemaker.StaticCache(10, 6, 60)
+    self.file_stat = os.stat(__file__)
+
+  def StaticFile(self, content):
+    """Returns a StaticFile instance with the given content."""
+    static = pagemaker.StaticFile(__file__, 'text/plain', self.file_stat)
+    static.content = content
+    return static
+
+  def testLeastRecentlyUsedEviction(self):
+    """[StaticCache] Least recently used files are evicted to make room"""
+    self.cache.Set('a', self.StaticFile('aaaa'))
+    self.cache.Set('b', self.StaticFile('bbbb'))
+    self.cache.Get('a')
+    self.cache.Set('c', self.StaticFile('cccc'))
+    self.assertEqual(self.cache.Get('b'), None)
+    self.assertEqual(self.cache.Get('a').content, 'aaaa')
+    self.assertEqual(self.cache.bytes_held, 8)
+
+  def testMaximumFileSize(self):
+    """[StaticCache] Files larger than the maximum file size are not cached"""
+    self.cache.Set('a', self.StaticFile('a' * 7))
+    self.assertEqual(len(self.cache), 0)
+    self.assertEqual(self.cache.bytes_held, 0)
+
+  def testHitRatio(self):
+    """[StaticCache] The hit ratio is the fraction of successful lookups"""
+    self.assertEqual(self.cache.hit_ratio, 0)
+    self.cache.Set('a', self.StaticFile('a'))
+    self.cache.Get('a')
+    self.cache.Get('b')
+    self.assertEqual(self.cache.hit_ratio, 0.5)
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
@@ -8,7 +8,9 @@
 # pylint: disable-msg=R0904
 
 # Standard modules
+import cgi
 import cStringIO
+import Cookie
 import unittest
 import urllib
 
@@ -73,5 +75,385 @@ class IndexedFieldStorageTest(unittest.TestCase):
     self.assertEqual(form_data[2], 'fourth')
 
 
+class BodyReader(unittest.TestCase):
+  """Tests for reading request bodies within their length and maximum size."""
+  def testContentLength(self):
+    """No more than the body length is read from the input stream"""
+    reader = request.BodyReader(cStringIO.StringIO('body+trailing'), 4)
+    self.assertEqual(reader.read(), 'body')
+    self.assertEqual(reader.read(10), '')
+
+  def testChunkedBody(self):
+    """Bodies of unknown length are read until the end of the stream"""
+    reader = request.BodyReader(cStringIO.StringIO('x' * 100000), None)
+    self.assertEqual(len(reader.read()), 100000)
+
+  def testMaximumSize(self):
+    """Reading beyond the maximum size raises without reading the rest"""
+    stream = cStringIO.StringIO('x' * 100)
+    reader = request.BodyReader(stream, None, max_size=10)
+    self.assertEqual(reader.read(10), 'x' * 10)
+    self.assertRaises(request.RequestTooLargeError, reader.read)
+    self.assertEqual(stream.tell(), 11)
+
+  def testCheckBodySize(self):
+    """Requests with a Content-Length beyond the maximum are rejected"""
+    env = {'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': '11'}
+    req = request.Request(env, None)
+    req.CheckBodySize()
+    req.max_body_size = 10
+    self.assertRaises(request.RequestTooLargeError, req.CheckBodySize)
+    env['HTTP_TRANSFER_ENCODING'] = 'chunked'
+    req.CheckBodySize()
+
+
+class JSONBody(unittest.TestCase):
+  """Tests for decoding JSON request bodies."""
+  @staticmethod
+  def CreateRequest(body, content_type='application/json'):
+    """Returns a Request for a POST request with the given body."""
+    env = {'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': content_type,
+           'CONTENT_LENGTH': str(len(body)),
+           'wsgi.input': cStringIO.StringIO(body)}
+    return request.Request(env, None)
+
+  def testDecoding(self):
+    """The JSON body is decoded once and is not treated as POST data"""
+    req = self.CreateRequest('{"name": "Arthur", "knights": [1, 2]}')
+    self.assertEqual(req.json, {'name': 'Arthur', 'knights': [1, 2]})
+    self.assertTrue(req.json is req.json)
+    self.assertFalse(req.vars['post'])
+    self.assertEqual(req.body, '{"name": "Arthur", "knights": [1, 2]}')
+
+  def testContentTypes(self):
+    """JSON bodies are recognized by their content type"""
+    self.assertEqual(
+        self.CreateRequest('null', 'application/json; charset=utf-8').json,
+        None)
+    self.assertEqual(
+        self.CreateRequest('[1]', 'application/vnd.api+json').json, [1])
+    req = self.CreateRequest('q=spam', 'application/x-www-form-urlencoded')
+    self.assertEqual(req.json, None)
+    self.assertEqual(req.vars['post'].getfirst('q'), 'spam')
+
+  def testMaximumSize(self):
+    """JSON bodies beyond the maximum body size are not read"""
+    req = self.CreateRequest('[1, 2, 3]')
+    req.max_body_size = 5
+    self.assertRaises(request.RequestTooLargeError, getattr, req, 'json')
+    self.assertEqual(req.env['wsgi.input'].tell(), 0)
+
+  def testIterJSON(self):
+    """Items of a JSON array body are decoded as the body is read"""
+    body = '[%s]' % ', '.join('{"id": %d}' % num for num in range(10000))
+    req = self.CreateRequest(body)
+    items = req.IterJSON()
+    self.assertEqual(next(items), {'id': 0})
+    self.assertTrue(req.env['wsgi.input'].tell() < len(body))
+    self.assertEqual(len(list(items)), 9999)
+
+  def testIterJSONChunks(self):
+    """Items split over chunks are decoded once they are complete"""
+    stream = cStringIO.StringIO('[ 12.5e3, "sp\xc3\xa4m", {"a": [true]} ,null]')
+    self.assertEqual(list(request.IterJSONArray(stream, chunk_size=3)),
+                     [12.5e3, u'sp\xe4m', {'a': [True]}, None])
+    for text in ('{}', '[1,', '[1 2]', '[1,]'):
+      self.assertRaises(ValueError, list, request.IterJSONArray(
+          cStringIO.StringIO(text), chunk_size=2))
+
+
+class UrlencodedDecoding(unittest.TestCase):
+  """Tests for the urlencoded decoder of query strings and POST bodies."""
+  def testQueryString(self):
+    """Query arguments are not grouped, and their values are not decoded"""
+    args = request.ParseUrlencoded(
+        'd[name]=Arthur&q=caf%C3%A9&q=two+words', indexed=False, encoding=None)
+    self.assertEqual(args, {'d[name]': ['Arthur'],
+                            'q': ['caf\xc3\xa9', 'two words']})
+    self.assertEqual(args.getfirst('q'), 'caf\xc3\xa9')
+
+  def testEscapedSeparators(self):
+    """Escaped separators are part of the field names and values"""
+    args = request.ParseUrlencoded('a%3Db=c%26d&e=f%3Bg;h=%25%32%36')
+    self.assertEqual(args, {'a=b': [u'c&d'], 'e': [u'f;g'], 'h': [u'%26']})
+
+  def testBlankValues(self):
+    """Blank values are skipped unless they are explicitly kept"""
+    self.assertEqual(request.ParseUrlencoded('a=&b&c=1'), {'c': [u'1']})
+    self.assertEqual(
+        request.ParseUrlencoded('a=&b&c=1', keep_blank_values=True),
+        {'a': [u''], 'b': [u''], 'c': [u'1']})
+
+  def testMatchesCgi(self):
+    """Decoded query strings equal those of cgi.parse_qs"""
+    query = 'a=1&b=%2B+2;a=3&&c%5B1%5D=%E2%99%A5&=x&d='
+    self.assertEqual(
+        request.ParseUrlencoded(query, indexed=False, encoding=None),
+        cgi.parse_qs(query))
+
+  def testFieldStorageItems(self):
+    """IndexedFieldStorage items are available for dictionary style access"""
+    ifs = request.IndexedFieldStorage(
+        cStringIO.StringIO('key=value&arg=1&arg=2'),
+        environ={'REQUEST_METHOD': 'POST'})
+    self.assertEqual(ifs['key'].value, 'value')
+    self.assertEqual([item.value for item in ifs['arg']], ['1', '2'])
+    self.assertEqual(sorted(ifs.keys()), ['arg', 'key'])
+    self.assertEqual(ifs.getvalue('arg'), ['1', '2'])
+
+
+class RequestHeaders(unittest.TestCase):
+  """Tests for header based functionality of the Request object."""
+  @staticmethod
+  def CreateRequest(**headers):
+    """Returns a Request for a GET request with the given headers."""
+    env = {'REQUEST_METHOD': 'GET', 'QUERY_STRING': '', 'PATH_INFO': '/'}
+    env.update(('HTTP_' + key.upper(), value)
+               for key, value in headers.iteritems())
+    return request.Request(env, None)
+
+  def testAcceptsEncoding(self):
+    """Listed content-codings are accepted unless their quality is zero"""
+    req = self.CreateRequest(accept_encoding='gzip, deflate;q=0')
+    self.assertTrue(req.AcceptsEncoding('gzip'))
+    self.assertFalse(req.AcceptsEncoding('deflate'))
+    self.assertFalse(req.AcceptsEncoding('br'))
+
+  def testAcceptsEncodingWildcard(self):
+    """Unlisted content-codings are accepted through the wildcard"""
+    req = self.CreateRequest(accept_encoding='*;q=0.5, br;q=0')
+    self.assertTrue(req.AcceptsEncoding('gzip'))
+    self.assertFalse(req.AcceptsEncoding('br'))
+
+  def testHeadersMemoized(self):
+    """The request headers view is created once, on first access"""
+    req = self.CreateRequest(user_agent='test')
+    self.assertEqual(req.headers['user-agent'], 'test')
+    self.assertTrue(req.headers is req.headers)
+
+  def testCaseInsensitive(self):
+    """Headers can be looked up by name in any case"""
+    req = self.CreateRequest(user_agent='test', x_forwarded_for='10.0.0.1')
+    self.assertEqual(req.headers.get('User-Agent'), 'test')
+    self.assertEqual(req.headers['X-FORWARDED-FOR'], '10.0.0.1')
+    self.assertTrue('user-agent' in req.headers)
+    self.assertFalse('Referer' in req.headers)
+    self.assertEqual(req.headers.get('referer', 'none'), 'none')
+    self.assertRaises(KeyError, req.headers.__getitem__, 'Referer')
+
+  def testIteration(self):
+    """Iterating the headers yields lowercase names of only the headers"""
+    req = self.CreateRequest(user_agent='test', accept='text/html')
+    req.env['CONTENT_TYPE'] = 'text/plain'
+    self.assertEqual(sorted(req.headers),
+                     ['accept', 'content-type', 'user-agent'])
+    self.assertEqual(dict(req.headers.iteritems()), {
+        'accept': 'text/html', 'content-type': 'text/plain',
+        'user-agent': 'test'})
+    self.assertEqual(len(req.headers), 3)
+
+  def testAddCookie(self):
+    """Every cookie added to the request's response is sent to the client"""
+    req = self.CreateRequest()
+    req.AddCookie(u'session', 'deleted', path='/', max_age=1, httponly=True)
+    req.AddCookie('spam', 'eggs')
+    req.AddCookie(u'session', 'abcd', path='/', max_age=3600, httponly=True)
+    self.assertEqual(
+        [value for name, value in req.response.headerlist
+         if name == 'Set-Cookie'],
+        ['spam=eggs', 'session=abcd; httponly; Max-Age=3600; Path=/'])
+
+  def testAddHeaderReplaces(self):
+    """AddHeader replaces an existing header on the response"""
+    req = self.CreateRequest()
+    req.AddHeader('Content-Type', 'application/json')
+    self.assertEqual(
+        [value for name, value in req.response.headerlist
+         if name == 'Content-Type'],
+        ['application/json'])
+
+  def testNoAcceptEncoding(self):
+    """Without Accept-Encoding header, no content-coding is accepted"""
+    self.assertFalse(self.CreateRequest().AcceptsEncoding('gzip'))
+
+
+class LazyRequestVars(unittest.TestCase):
+  """Tests that request variables are only parsed when they are used."""
+  class UnreadableInput(object):
+    """A wsgi.input replacement that fails the test when it is read."""
+    def read(self, *_args):
+      """Signals that the request body was read."""
+      raise AssertionError('wsgi.input should not be read')
+
+  def CreateRequest(self, method='POST', query='', cookie=None):
+    """Returns a Request with an input stream that may not be read."""
+    env = {'REQUEST_METHOD': method, 'QUERY_STRING': query, 'PATH_INFO': '/',
+           'CONTENT_LENGTH': '3', 'wsgi.input': self.UnreadableInput()}
+    if cookie is not None:
+      env['HTTP_COOKIE'] = cookie
+    return request.Request(env, None)
+
+  def testUnusedPostNotRead(self):
+    """The request body is not read when the POST data is not used"""
+    req = self.CreateRequest(query='q=spam', cookie='c=eggs')
+    self.assertEqual(req.vars['get'].getfirst('q'), 'spam')
+    self.assertEqual(req.vars['cookie'], {'c': 'eggs'})
+
+  def testMemoized(self):
+    """Parsed request variables are kept for later access"""
+    req = self.CreateRequest(method='GET', query='q=spam')
+    self.assertTrue(req.vars['get'] is req.vars['get'])
+    self.assertTrue(req.vars['post'] is req.vars['post'])
+
+  def testDictionaryLikeness(self):
+    """The request variables can be used as a dictionary"""
+    req = self.CreateRequest(method='GET', cookie='c=eggs')
+    self.assertEqual(sorted(req.vars), ['cookie', 'get', 'post'])
+    self.assertTrue('cookie' in req.vars)
+    self.assertEqual(req.vars.get('cookie'), {'c': 'eggs'})
+    self.assertEqual(req.vars.get('missing', 'default'), 'default')
+
+
+class CookieParsing(unittest.TestCase):
+  """Tests for parsing the Cookie header into request variables."""
+  def testFirstOccurrenceWins(self):
+    """The first, most specific, value of a repeated cookie name is used"""
+    cookies = request.CookieDict('id=specific; theme=dark; id=generic')
+    self.assertEqual(cookies, {'id': 'specific', 'theme': 'dark'})
+
+  def testAttributesSkipped(self):
+    """Cookie attributes and malformed pairs are not taken as cookies"""
+    cookies = request.CookieDict(
+        '$Version=1; a=1; $Path=/; path=/; flag; =empty;  b = 2 ; c=')
+    self.assertEqual(cookies, {'a': '1', 'b': '2', 'c': ''})
+
+  def testQuotedValues(self):
+    """Quoted values are stored decoded, for all dictionary operations"""
+    cookies = request.CookieDict(r'plain=spam; quoted="a\073b c"')
+    self.assertEqual(dict(cookies), {'plain': 'spam', 'quoted': 'a;b c'})
+    self.assertEqual(cookies.copy()['quoted'], 'a;b c')
+    self.assertEqual(cookies.pop('quoted'), 'a;b c')
+
+  def testQuotedSeparators(self):
+    """Quoted values containing separators and escapes match SimpleCookie"""
+    for header in ('q="a;b"; r=1', 'consent="analytics, marketing"',
+                   r'e="say \"hi\"\073 \\o/"; f="x;y;z"'):
+      self.assertEqual(
+          request.CookieDict(header),
+          dict((key, morsel.value)
+               for key, morsel in Cookie.SimpleCookie(header).iteritems()))
+
+  def testFirstOccurrenceKept(self):
+    """The first, most specific value of a cookie name is kept"""
+    header = r'a=1; b="x\"y"; $Path=/; a=2; c=3; Domain=example.com'
+    self.assertEqual(request.CookieDict(header),
+                     {'a': '1', 'b': 'x"y', 'c': '3'})
+
+  def testEmptyHeader(self):
+    """A missing or empty Cookie header gives no cookies"""
+    self.assertEqual(request.CookieDict(None), {})
+    self.assertEqual(request.CookieDict(''), {})
+
+
+class MultipartForm(unittest.TestCase):
+  """Tests for the streaming parser of multipart/form-data bodies."""
+  BOUNDARY = 'xYzZY'
+
+  class ChunkedInput(object):
+    """A wsgi.input replacement that records the size of every read."""
+    def __init__(self, data):
+      self.data = cStringIO.StringIO(data)
+      self.reads = []
+
+    def read(self, size=-1):
+      """Reads from the data and records the requested size."""
+      self.reads.append(size)
+      return self.data.read(size)
+
+  def CreateBody(self, *parts):
+    """Returns a multipart body for the given (name, value, filename) parts."""
+    body = []
+    for name, value, filename in parts:
+      body.append('--%s\r\n' % self.BOUNDARY)
+      if filename is None:
+        body.append('Content-Disposition: form-data; name="%s"\r\n' % name)
+      else:
+        body.append('Content-Disposition: form-data; name="%s"; '
+                    'filename="%s"\r\nContent-Type: text/plain\r\n' % (
+                        name, filename))
+      body.append('\r\n%s\r\n' % value)
+    body.append('--%s--\r\n' % self.BOUNDARY)
+    return ''.join(body)
+
+  def ParseBody(self, body, **kwds):
+    """Returns the IndexedFieldStorage for the given multipart body."""
+    env = {'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': str(len(body)),
+           'CONTENT_TYPE': 'multipart/form-data; boundary=%s' % self.BOUNDARY}
+    return request.ParseForm(self.ChunkedInput(body), env, **kwds)
+
+  def testFields(self):
+    """Multipart fields are available through getfirst and getlist"""
+    ifs = self.ParseBody(self.CreateBody(
+        ('arg', '1', None), ('arg', '2', None),
+        ('q', u'We \u2665 Unicode'.encode('utf8'), None)))
+    self.assertEqual(ifs.getlist('arg'), ['1', '2'])
+    self.assertEqual(ifs.getfirst('q'), u'We \u2665 Unicode')
+
+  def testDictionaryFunctionality(self):
+    """Multipart fields in the form 'foo[bar]' are grouped in a dictionary"""
+    ifs = self.ParseBody(self.CreateBody(
+        ('d[name]', 'Arthur', None), ('d[type]', 'King', None)))
+    self.assertEqual(ifs.getfirst('d'), {'name': 'Arthur', 'type': 'King'})
+
+  def testFileUpload(self):
+    """Uploaded files are available as file objects"""
+    ifs = self.ParseBody(self.CreateBody(
+        ('upload', 'file\r\ncontents', 'spam.txt')))
+    upload = ifs['upload']
+    self.assertEqual(upload.filename, 'spam.txt')
+    self.assertEqual(upload.type, 'text/plain')
+    self.assertEqual(upload.file.read(), 'file\r\ncontents')
+    self.assertEqual(ifs.getfirst('upload'), 'file\r\ncontents')
+
+  def testFileSpooling(self):
+    """Uploaded files beyond the spool size are moved to disk"""
+    contents = 'spam\r\n' * 100
+    ifs = self.ParseBody(self.CreateBody(
+        ('small', 'eggs', 'small.txt'), ('large', contents, 'large.txt')),
+                         spool_size=100)
+    # pylint: disable=W0212
+    self.assertFalse(ifs['small'].file._rolled)
+    self.assertTrue(ifs['large'].file._rolled)
+    # pylint: enable=W0212
+    self.assertEqual(ifs['large'].value, contents)
+
+  def testChunkedReading(self):
+    """The body is read in chunks that do not exceed the content length"""
+    contents = '-' * 5000
+    body = self.CreateBody(('upload', contents, 'dashes.txt'))
+    stream = self.ChunkedInput(body)
+    parser = request.MultipartParser(
+        stream, self.BOUNDARY, len(body), chunk_size=1000)
+    ifs = request.IndexedFieldStorage.FromFields(parser)
+    self.assertEqual(ifs.getfirst('upload'), contents)
+    self.assertEqual(stream.reads[:-1], [1000] * (len(body) // 1000))
+    self.assertEqual(sum(stream.reads), len(body))
+
+  def testTruncatedBody(self):
+    """A multipart body without closing boundary is rejected"""
+    body = self.CreateBody(('arg', '1', None))
+    self.assertRaises(request.MultipartError, self.ParseBody, body[:-10])
+
+  def testMaximumSize(self):
+    """Bodies larger than the maximum size are rejected before being read"""
+    body = self.CreateBody(('arg', '1', None))
+    env = {'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': str(len(body)),
+           'CONTENT_TYPE': 'multipart/form-data; boundary=%s' % self.BOUNDARY}
+    stream = self.ChunkedInput(body)
+    self.assertRaises(request.RequestTooLargeError, request.ParseForm,
+                      stream, env, max_size=len(body) - 1)
+    self.assertFalse(stream.reads)
+
+
 if __name__ == '__main__':
   unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
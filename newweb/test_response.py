@@ -0,0 +1,337 @@
+#!/usr/bin/python
+"""Tests for the response module."""
+
+# Too many public methods
+# pylint: disable=R0904
+
+# Standard modules
+import Cookie
+import cStringIO
+import gzip
+import tempfile
+import unittest
+
+# Unittest target
+from . import response
+
+
+class ResponseContent(unittest.TestCase):
+  """Tests string and streaming content of Response objects."""
+  def testStringContent(self):
+    """[Response] String content is served as a single chunk with length"""
+    resp = response.Response(u'caf\xe9')
+    self.assertFalse(resp.streaming)
+    self.assertEqual(list(resp.app_iter), ['caf\xc3\xa9'])
+    self.assertEqual(dict(resp.headerlist)['Content-Length'], '5')
+
+  def testGeneratorContent(self):
+    """[Response] Generators are streamed and have no Content-Length"""
+    resp = response.Response(chunk for chunk in ('a', u'\xe9', 3))
+    self.assertTrue(resp.streaming)
+    self.assertNotIn('Content-Length', dict(resp.headerlist))
+    self.assertEqual(list(resp.app_iter), ['a', '\xc3\xa9', '3'])
+
+  def testChunkListContent(self):
+    """[Response] Lists of string chunks are streamed with known length"""
+    resp = response.Response(['foo', 'bar'])
+    self.assertEqual(dict(resp.headerlist)['Content-Length'], '6')
+    self.assertEqual(str(resp), 'foobar')
+
+  def testCloseGenerator(self):
+    """[Response] Closing the response iterable closes the generator"""
+    closed = []
+    def Generator():
+      """Yields chunks and records being closed."""
+      try:
+        yield 'first'
+        yield 'second'
+      finally:
+        closed.append(True)
+    app_iter = response.Response(Generator()).app_iter
+    self.assertEqual(next(iter(app_iter)), 'first')
+    app_iter.close()
+    self.assertEqual(closed, [True])
+
+  def testFileContent(self):
+    """[Response] Files are streamed in blocks with their size as length"""
+    with tempfile.NamedTemporaryFile() as tmp:
+      tmp.write('x' * (response.BLOCK_SIZE + 10))
+      tmp.flush()
+      resp = response.Response(open(tmp.name, 'rb'))
+      self.assertEqual(dict(resp.headerlist)['Content-Length'],
+                       str(response.BLOCK_SIZE + 10))
+      app_iter = resp.app_iter
+      self.assertEqual(map(len, app_iter), [response.BLOCK_SIZE, 10])
+      app_iter.close()
+      self.assertTrue(resp.content.closed)
+
+  def testExplicitContentLength(self):
+    """[Response] An explicitly set Content-Length header is left alone"""
+    resp = response.Response(iter(['abc']), headers={'Content-Length': '3'})
+    self.assertEqual(resp.headerlist.count(('Content-Length', '3')), 1)
+
+
+class ResponseHeaders(unittest.TestCase):
+  """Tests header manipulation and content-coding of Response objects."""
+  @staticmethod
+  def Gunzip(data):
+    """Returns the decompressed gzip data."""
+    return gzip.GzipFile(fileobj=cStringIO.StringIO(data)).read()
+
+  def testAddVary(self):
+    """[Response] Fields are added to the Vary header only once"""
+    resp = response.Response(headers={'Vary': 'Cookie'})
+    resp.AddVary('Accept-Encoding')
+    resp.AddVary('accept-encoding')
+    self.assertEqual(resp.headers['Vary'], 'Cookie, Accept-Encoding')
+
+  def testRepeatedHeaders(self):
+    """[Response] Headers can be repeated, setting one replaces all values"""
+    resp = response.Response()
+    resp.headers.Add('Set-Cookie', 'a=1')
+    resp.headers.Add('Set-Cookie', 'b=2')
+    self.assertEqual(resp.headers['Set-Cookie'], 'a=1')
+    self.assertEqual(resp.headers.GetAll('Set-Cookie'), ['a=1', 'b=2'])
+    self.assertEqual(
+        [value for name, value in resp.headerlist if name == 'Set-Cookie'],
+        ['a=1', 'b=2'])
+    resp.headers['Set-Cookie'] = 'c=3'
+    self.assertEqual(resp.headers.GetAll('Set-Cookie'), ['c=3'])
+
+  def testCopyRepeatedHeaders(self):
+    """[Response] Copying Headers keeps the repeated values of headers"""
+    headers = response.Headers({'X-Spam': 'eggs'})
+    headers.Add('Set-Cookie', 'a=1')
+    headers.Add('Set-Cookie', 'b=2')
+    copied = response.Headers(headers)
+    self.assertEqual(copied.GetAll('Set-Cookie'), ['a=1', 'b=2'])
+    self.assertEqual(copied.HeaderList(), headers.HeaderList())
+    copied.Add('Set-Cookie', 'c=3')
+    self.assertEqual(headers.GetAll('Set-Cookie'), ['a=1', 'b=2'])
+    resp = response.Response(headers=headers)
+    self.assertEqual(resp.headers.GetAll('Set-Cookie'), ['a=1', 'b=2'])
+    self.assertEqual(response.Headers(response.Headers()), {})
+
+  def testHeaderListInvalidation(self):
+    """[Response] The encoded header list is rebuilt when headers change"""
+    resp = response.Response('body', headers={'X-Spam': u'eggs'})
+    self.assertEqual(dict(resp.headerlist)['X-Spam'], 'eggs')
+    self.assertTrue(isinstance(dict(resp.headerlist)['X-Spam'], str))
+    resp.headers['X-Spam'] = 'ham'
+    resp.headers.update({'X-Eggs': 'bacon'})
+    headers = dict(resp.headerlist)
+    self.assertEqual((headers['X-Spam'], headers['X-Eggs']), ('ham', 'bacon'))
+    resp.headers.pop('X-Spam')
+    self.assertFalse('X-Spam' in dict(resp.headerlist))
+    resp.headers = {'X-Ham': 'spam'}
+    self.assertEqual(resp.headerlist, [('X-Ham', 'spam'),
+                                       ('Content-Length', '4')])
+
+  def testStatusLine(self):
+    """[Response] The status line is looked up for the response code"""
+    resp = response.Response(httpcode=404)
+    self.assertEqual(resp.status, '404 Not Found')
+    resp.httpcode = 201
+    self.assertEqual(resp.status, '201 Created')
+
+  def testSlots(self):
+    """[Response] Responses have no instance dictionary"""
+    self.assertFalse(hasattr(response.Response(), '__dict__'))
+    self.assertFalse(hasattr(response.Redirect('/'), '__dict__'))
+
+  def testDiscardBody(self):
+    """[Response] A discarded body is closed unread, its length is kept"""
+    def Chunks():
+      """Yields the body, recording that it was read."""
+      read.append(True)
+      yield 'spam'
+    read = []
+    chunks = Chunks()
+    resp = response.Response(chunks)
+    resp.DiscardBody()
+    self.assertEqual((list(resp.app_iter), read), ([], []))
+    self.assertRaises(StopIteration, next, chunks)
+    self.assertFalse('Content-Length' in dict(resp.headerlist))
+    resp = response.Response('spam' * 10)
+    resp.DiscardBody()
+    self.assertEqual(dict(resp.headerlist)['Content-Length'], '40')
+    self.assertEqual(list(resp.app_iter), [''])
+
+  def testGzipString(self):
+    """[Response] String content is compressed with updated headers"""
+    resp = response.Response('spam' * 100, headers={'ETag': '"x"'})
+    resp.Gzip()
+    headers = dict(resp.headerlist)
+    self.assertEqual(headers['Content-Encoding'], 'gzip')
+    self.assertEqual(headers['ETag'], 'W/"x"')
+    self.assertEqual(int(headers['Content-Length']), len(resp.content))
+    self.assertEqual(self.Gunzip(resp.content), 'spam' * 100)
+
+  def testGzipStreaming(self):
+    """[Response] Streaming content is compressed while it is served"""
+    resp = response.Response(chunk for chunk in ('spam', 'eggs') * 50)
+    resp.Gzip()
+    self.assertFalse('Content-Length' in dict(resp.headerlist))
+    self.assertEqual(self.Gunzip(''.join(resp.app_iter)), 'spameggs' * 50)
+
+
+class ResponseCookies(unittest.TestCase):
+  """Tests the Set-Cookie headers rendered for cookies set on a Response."""
+  @staticmethod
+  def SetCookies(resp):
+    """Returns the values of the Set-Cookie headers of the response."""
+    return [value for name, value in resp.headerlist if name == 'Set-Cookie']
+
+  def testMultipleCookies(self):
+    """[Cookie] Every cookie set gets its own Set-Cookie header"""
+    resp = response.Response()
+    resp.SetCookie('spam', 'eggs')
+    resp.SetCookie('ham', 'bacon')
+    self.assertEqual(self.SetCookies(resp), ['spam=eggs', 'ham=bacon'])
+
+  def testReplaceCookie(self):
+    """[Cookie] Setting a cookie again replaces it, unless the path differs"""
+    resp = response.Response()
+    resp.SetCookie('spam', 'eggs', path='/')
+    resp.SetCookie('ham', 'bacon')
+    resp.SetCookie('spam', 'beans', path='/')
+    resp.SetCookie('spam', 'toast', path='/admin')
+    self.assertEqual(self.SetCookies(resp), [
+        'ham=bacon', 'spam=beans; Path=/', 'spam=toast; Path=/admin'])
+
+  def testAttributes(self):
+    """[Cookie] Values are quoted and attributes rendered as by Morsel"""
+    resp = response.Response()
+    resp.SetCookie('session', 'a b', path='/', max_age=1, httponly=True,
+                   secure=False, domain='')
+    self.assertEqual(self.SetCookies(resp),
+                     ['session="a b"; httponly; Max-Age=1; Path=/'])
+
+  def testInvalidCookie(self):
+    """[Cookie] Illegal cookie names and unknown attributes are refused"""
+    resp = response.Response()
+    self.assertRaises(Cookie.CookieError, resp.SetCookie, 'a b', 'c')
+    self.assertRaises(Cookie.CookieError, resp.SetCookie, 'path', 'c')
+    self.assertRaises(Cookie.CookieError, resp.SetCookie, 'a', 'b', spam=1)
+    self.assertEqual(self.SetCookies(resp), [])
+
+
+class ByteRanges(unittest.TestCase):
+  """Tests parsing of Range headers and partial responses."""
+  def testParseByteRanges(self):
+    """[Range] Range headers are parsed into start and end offsets"""
+    parse = response.ParseByteRanges
+    self.assertEqual(parse('bytes=0-9', 100), [(0, 10)])
+    self.assertEqual(parse('bytes=90-', 100), [(90, 100)])
+    self.assertEqual(parse('bytes=-10', 100), [(90, 100)])
+    self.assertEqual(parse('bytes=-200', 100), [(0, 100)])
+    self.assertEqual(parse('bytes=95-200', 100), [(95, 100)])
+    self.assertEqual(parse('bytes=0-0, 5-9', 100), [(0, 1), (5, 10)])
+
+  def testUnsatisfiableRanges(self):
+    """[Range] Ranges outside of the entity are left out"""
+    self.assertEqual(response.ParseByteRanges('bytes=100-', 100), [])
+    self.assertEqual(response.ParseByteRanges('bytes=-0', 100), [])
+    self.assertEqual(
+        response.ParseByteRanges('bytes=100-, 0-1', 100), [(0, 2)])
+
+  def testMergedRanges(self):
+    """[Range] Overlapping and adjacent ranges are merged and sorted"""
+    parse = response.ParseByteRanges
+    self.assertEqual(parse('bytes=10-19, 0-4, 5-9', 100), [(0, 20)])
+    self.assertEqual(parse('bytes=0-9, 5-14, 50-59', 100), [(0, 15), (50, 60)])
+    self.assertEqual(parse('bytes=-10, 80-', 100), [(80, 100)])
+
+  def testAmplifiedRanges(self):
+    """[Range] Too many ranges, or ranges larger than the entity, are ignored"""
+    parse = response.ParseByteRanges
+    self.assertEqual(parse('bytes=0-,0-', 100), None)
+    self.assertEqual(parse('bytes=0-59,40-', 100), None)
+    many = 'bytes=' + ','.join(
+        '%d-%d' % (start, start) for start in range(0, 66, 2))
+    self.assertEqual(parse(many, 100), None)
+    self.assertEqual(len(parse(many.rsplit(',', 1)[0], 100)), 32)
+    resp = self.RangedResponse('0123456789', 'bytes=' + ','.join(['0-'] * 200))
+    self.assertEqual(resp.httpcode, 200)
+    self.assertEqual(''.join(resp.app_iter), '0123456789')
+
+  def testInvalidRanges(self):
+    """[Range] Invalid Range headers are rejected as a whole"""
+    for header in ('bytes=', 'items=0-1', 'bytes=5-1', 'bytes=a-b',
+                   'bytes=1', 'bytes=-', 'bytes=0-1,x'):
+      self.assertEqual(response.ParseByteRanges(header, 100), None, header)
+
+  def RangedResponse(self, content, range_header, **headers):
+    """Returns a response of the content, limited to the given ranges."""
+    headers.setdefault('Accept-Ranges', 'bytes')
+    resp = response.Response(content, content_type='text/plain',
+                             headers=headers)
+    resp.ApplyRange(range_header, headers.pop('If-Range', None))
+    return resp
+
+  def testSingleRange(self):
+    """[Range] A single range results in a 206 with Content-Range"""
+    resp = self.RangedResponse('0123456789', 'bytes=2-4')
+    self.assertEqual(resp.httpcode, 206)
+    self.assertEqual(resp.headers['Content-Range'], 'bytes 2-4/10')
+    self.assertEqual(dict(resp.headerlist)['Content-Length'], '3')
+    self.assertEqual(''.join(resp.app_iter), '234')
+
+  def testFileRange(self):
+    """[Range] Ranges of file content are read from the file"""
+    with tempfile.NamedTemporaryFile() as tmp:
+      tmp.write('0123456789')
+      tmp.flush()
+      resp = self.RangedResponse(open(tmp.name, 'rb'), 'bytes=-3')
+      self.assertEqual(resp.headers['Content-Range'], 'bytes 7-9/10')
+      app_iter = resp.app_iter
+      self.assertEqual(''.join(app_iter), '789')
+      app_iter.close()
+
+  def testMultipleRanges(self):
+    """[Range] Multiple ranges result in a multipart/byteranges body"""
+    resp = self.RangedResponse('0123456789', 'bytes=0-1,8-')
+    content_type = resp.headers['Content-Type']
+    self.assertTrue(content_type.startswith('multipart/byteranges; boundary='))
+    boundary = content_type.split('=', 1)[1]
+    body = ''.join(resp.app_iter)
+    self.assertEqual(dict(resp.headerlist)['Content-Length'], str(len(body)))
+    self.assertEqual(body, (
+        '\r\n--%(b)s\r\nContent-Type: text/plain; charset=utf8\r\n'
+        'Content-Range: bytes 0-1/10\r\n\r\n01'
+        '\r\n--%(b)s\r\nContent-Type: text/plain; charset=utf8\r\n'
+        'Content-Range: bytes 8-9/10\r\n\r\n89'
+        '\r\n--%(b)s--\r\n') % {'b': boundary})
+
+  def testUnsatisfiable(self):
+    """[Range] Unsatisfiable ranges result in a 416"""
+    resp = self.RangedResponse('0123456789', 'bytes=20-')
+    self.assertEqual(resp.httpcode, 416)
+    self.assertEqual(resp.headers['Content-Range'], 'bytes */10')
+
+  def testIfRange(self):
+    """[Range] If-Range must match the ETag or Last-Modified date"""
+    last_modified = 'Sat, 01 Jan 2000 00:00:00 GMT'
+    for if_range, ranged in (('"v1"', True), ('"v2"', False),
+                             ('W/"v1"', False), (last_modified, True),
+                             ('Sun, 02 Jan 2000 00:00:00 GMT', False)):
+      resp = self.RangedResponse('0123456789', 'bytes=0-1', **{
+          'ETag': '"v1"', 'Last-Modified': last_modified,
+          'If-Range': if_range})
+      self.assertEqual(resp.httpcode, 206 if ranged else 200, if_range)
+
+  def testUnsizedFileRange(self):
+    """[Range] File content of unknown size is sent in full"""
+    resp = self.RangedResponse(cStringIO.StringIO('0123456789'), 'bytes=-3')
+    self.assertEqual(resp.httpcode, 200)
+    self.assertEqual(''.join(resp.app_iter), '0123456789')
+
+  def testRangesNotAccepted(self):
+    """[Range] Responses without Accept-Ranges are sent in full"""
+    resp = response.Response('0123456789')
+    resp.ApplyRange('bytes=0-1')
+    self.assertEqual(resp.httpcode, 200)
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
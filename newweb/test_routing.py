@@ -0,0 +1,211 @@
+#!/usr/bin/python
+"""Tests for the routing module and the newweb request router."""
+
+# Too many public methods
+# pylint: disable=R0904
+
+# Standard modules
+import unittest
+
+# Unittest target
+import newweb
+from . import routing
+
+
+class LiteralPrefix(unittest.TestCase):
+  """Tests extraction of the literal prefix of route patterns."""
+  def testPlainPattern(self):
+    """[Prefix] A pattern without special characters is its own prefix"""
+    self.assertEqual(routing.LiteralPrefix('/about'), '/about')
+
+  def testPatternWithGroup(self):
+    """[Prefix] The prefix ends where the first group starts"""
+    self.assertEqual(routing.LiteralPrefix('/user/(\d+)'), '/user/')
+
+  def testQuantifiedLiteral(self):
+    """[Prefix] A literal followed by a quantifier is not part of the prefix"""
+    self.assertEqual(routing.LiteralPrefix('/items?/(\d+)'), '/item')
+    self.assertEqual(routing.LiteralPrefix('/a{2}'), '/')
+
+  def testTopLevelAlternation(self):
+    """[Prefix] Alternation on the outer level means there is no prefix"""
+    self.assertEqual(routing.LiteralPrefix('/foo|/bar'), '')
+    self.assertEqual(routing.LiteralPrefix('/(foo|bar)'), '/')
+    self.assertEqual(routing.LiteralPrefix('/[|]x'), '/')
+
+  def testInlineFlags(self):
+    """[Prefix] Inline flags anywhere in the pattern mean there is no prefix"""
+    self.assertEqual(routing.LiteralPrefix('(?i)/foo'), '')
+    self.assertEqual(routing.LiteralPrefix('/foo(?i)bar'), '')
+    self.assertEqual(routing.LiteralPrefix('/foo/(\d+)(?u)'), '')
+
+
+class RouteTable(unittest.TestCase):
+  """Tests matching behavior of the compiled RouteTable."""
+  def testFirstMatchWins(self):
+    """[RouteTable] The first matching route is used, not the most specific"""
+    table = routing.RouteTable([('/(.*)', 'catchall'), ('/about', 'about')])
+    self.assertEqual(table.Match('/about'), ('catchall', ('about',)))
+
+  def testDeeperPrefixKeepsOrder(self):
+    """[RouteTable] Routes with longer prefixes don't jump ahead in order"""
+    table = routing.RouteTable([
+        ('/user/(\d+)', 'user'), ('/user/admin', 'admin'), ('/(.*)', 'other')])
+    self.assertEqual(table.Match('/user/12'), ('user', ('12',)))
+    self.assertEqual(table.Match('/user/admin'), ('admin', ()))
+    self.assertEqual(table.Match('/users'), ('other', ('users',)))
+
+  def testNoMatch(self):
+    """[RouteTable] A url without matching route returns None"""
+    table = routing.RouteTable([('/about', 'about')])
+    self.assertEqual(table.Match('/contact'), None)
+    self.assertEqual(table.Match('/about/more'), None)
+
+  def testGroupsPerRoute(self):
+    """[RouteTable] Only the groups of the matching route are returned"""
+    table = routing.RouteTable([
+        ('/a/(\d+)/(\d+)', 'first'), ('/b/(\w+)', 'second')])
+    self.assertEqual(table.Match('/a/1/2'), ('first', ('1', '2')))
+    self.assertEqual(table.Match('/b/word'), ('second', ('word',)))
+
+  def testOptionalGroups(self):
+    """[RouteTable] Unmatched optional groups are returned as None"""
+    table = routing.RouteTable([('/page(/\d+)?', 'page')])
+    self.assertEqual(table.Match('/page'), ('page', (None,)))
+    self.assertEqual(table.Match('/page/2'), ('page', ('/2',)))
+
+  def testNamedGroupsAndBackreferences(self):
+    """[RouteTable] Duplicate group names and backreferences stay working"""
+    table = routing.RouteTable([
+        ('/x/(?P<id>\d+)', 'x'), ('/y/(?P<id>\d+)', 'y'),
+        ('/(\w)/\\1', 'double'), ('/(.*)', 'other')])
+    self.assertEqual(table.Match('/y/5'), ('y', ('5',)))
+    self.assertEqual(table.Match('/z/z'), ('double', ('z',)))
+    self.assertEqual(table.Match('/z/q'), ('other', ('z/q',)))
+
+  def testInlineFlags(self):
+    """[RouteTable] Inline flags of a route don't apply to other routes"""
+    table = routing.RouteTable([
+        ('(?i)/bar', 'insensitive'), ('/(foo)', 'sensitive')])
+    self.assertEqual(table.Match('/BAR'), ('insensitive', ()))
+    self.assertEqual(table.Match('/foo'), ('sensitive', ('foo',)))
+    self.assertEqual(table.Match('/FOO'), None)
+
+  def testInlineFlagsAfterLiteral(self):
+    """[RouteTable] Inline flags later in a route also apply to its start"""
+    table = routing.RouteTable([('/foo(?i)bar', 'insensitive')])
+    self.assertEqual(table.Match('/fooBAR'), ('insensitive', ()))
+    self.assertEqual(table.Match('/FOOBAR'), ('insensitive', ()))
+
+  def testManyGroups(self):
+    """[RouteTable] Route tables beyond the regex group limit are chunked"""
+    table = routing.RouteTable(
+        ('/(%d)/(\d+)' % num, num) for num in range(200))
+    self.assertEqual(table.Match('/150/7'), (150, ('150', '7')))
+
+  def testMatchAll(self):
+    """[RouteTable] MatchAll yields every matching route in order"""
+    table = routing.RouteTable([
+        ('/about', 'about'), ('/(\w+)', 'word'), ('/(.*)', 'other')])
+    self.assertEqual(list(table.MatchAll('/about')), [
+        ('about', ()), ('word', ('about',)), ('other', ('about',))])
+
+
+class Router(unittest.TestCase):
+  """Tests the request router closure built by newweb.router."""
+  def testMethodFiltering(self):
+    """[Router] Routes not accepting the request method are skipped"""
+    request_router = newweb.router([
+        ('/form', ('POST',), 'Submit'), ('/(.*)', 'Catchall')])
+    self.assertEqual(request_router('/form', 'POST'), ('Submit', ()))
+    self.assertEqual(request_router('/form', 'GET'), ('Catchall', ('form',)))
+
+  def testNoRoute(self):
+    """[Router] NoRouteError is raised when no route matches"""
+    request_router = newweb.router([('/', 'Index')])
+    self.assertRaises(newweb.NoRouteError, request_router, '/missing', 'GET')
+
+  def testMethodNotAllowed(self):
+    """[Router] A url routed only for other methods lists the allowed methods"""
+    request_router = newweb.router([
+        ('/form', ('POST',), 'Submit'), ('/form', ('PUT',), 'Replace'),
+        ('/', ('GET',), 'Index')])
+    try:
+      request_router('/form', 'GET')
+      self.fail('MethodNotAllowedError not raised')
+    except newweb.MethodNotAllowedError as err:
+      self.assertEqual(err.allowed, {'POST', 'PUT'})
+
+  def testImplicitHead(self):
+    """[Router] Routes accepting GET also accept HEAD"""
+    request_router = newweb.router([
+        ('/form', ('POST',), 'Submit'), ('/(.*)', ('GET',), 'Catchall')])
+    self.assertEqual(request_router('/spam', 'HEAD'), ('Catchall', ('spam',)))
+    try:
+      request_router('/form', 'HEAD')
+    except newweb.MethodNotAllowedError:
+      self.fail('HEAD should be routed to the GET handler')
+
+  def testUnknownMethod(self):
+    """[Router] Methods not used by any route get NoRouteError for bad urls"""
+    request_router = newweb.router([('/', ('GET',), 'Index')])
+    self.assertRaises(newweb.MethodNotAllowedError, request_router, '/', 'FOO')
+    self.assertRaises(newweb.NoRouteError, request_router, '/x', 'FOO')
+
+
+class RouteCache(unittest.TestCase):
+  """Tests the LRU cache of resolved routes."""
+  def setUp(self):
+    self.lookups = []
+    def request_router(url, method):
+      """Records lookups and routes everything except /missing."""
+      self.lookups.append((url, method))
+      if url == '/missing':
+        raise newweb.NoRouteError(url)
+      return 'Handler', (url,)
+    self.cache = routing.RouteCache(request_router, 2)
+
+  def testCachedLookup(self):
+    """[RouteCache] Repeated lookups are answered from the cache"""
+    self.assertEqual(self.cache('/a', 'GET'), ('Handler', ('/a',)))
+    self.assertEqual(self.cache('/a', 'GET'), ('Handler', ('/a',)))
+    self.assertEqual(self.lookups, [('/a', 'GET')])
+    self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+    self.assertEqual(self.cache.hit_ratio, 0.5)
+
+  def testMethodInKey(self):
+    """[RouteCache] The request method is part of the cache key"""
+    self.cache('/a', 'GET')
+    self.cache('/a', 'POST')
+    self.assertEqual(self.lookups, [('/a', 'GET'), ('/a', 'POST')])
+
+  def testLeastRecentlyUsedEviction(self):
+    """[RouteCache] The least recently used route is evicted when full"""
+    self.cache('/a', 'GET')
+    self.cache('/b', 'GET')
+    self.cache('/a', 'GET')
+    self.cache('/c', 'GET')
+    self.assertEqual(len(self.cache), 2)
+    del self.lookups[:]
+    self.cache('/a', 'GET')
+    self.cache('/b', 'GET')
+    self.assertEqual(self.lookups, [('/b', 'GET')])
+
+  def testErrorsNotCached(self):
+    """[RouteCache] Failed lookups are not cached"""
+    for _attempt in range(2):
+      self.assertRaises(newweb.NoRouteError, self.cache, '/missing', 'GET')
+    self.assertEqual(len(self.lookups), 2)
+    self.assertEqual(len(self.cache), 0)
+
+  def testFlush(self):
+    """[RouteCache] Flushing the cache empties it"""
+    self.cache('/a', 'GET')
+    self.cache.Flush()
+    self.assertEqual(len(self.cache), 0)
+    self.cache('/a', 'GET')
+    self.assertEqual(len(self.lookups), 2)
+
+
+if __name__ == '__main__':
+  unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))
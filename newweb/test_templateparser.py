@@ -7,6 +7,8 @@
 # Standard modules
 import os
 import re
+import shutil
+import tempfile
 import time
 import unittest
 
@@ -424,6 +426,24 @@ class TemplateTagFunctionClosures(unittest.TestCase):
     self.assertRaises(templateparser.TemplateSyntaxError,
                       self.parse, template, tag=self.tag)
 
+  def testArgumentsCompiledOnce(self):
+    """[TagClosures] Closure arguments are compiled once and reused after"""
+    template = templateparser.Template('[tag|limit(2 * 10)]')
+    self.assertEqual(template.Parse(tag=self.tag), self.tag[:20])
+    function = template[0]._GetFunction('limit(2 * 10)')
+    self.assertEqual(function[0], 'limit')
+    self.assertEqual(template.Parse(tag=self.tag), self.tag[:20])
+    self.assertTrue(template[0]._GetFunction('limit(2 * 10)') is function)
+    self.assertFalse(hasattr(templateparser.TemplateTag, 'FUNCTIONS'))
+
+  def testApplyFunctionOnClass(self):
+    """[TagClosures] TemplateTag.ApplyFunction works without a tag instance"""
+    apply_function = templateparser.TemplateTag.ApplyFunction
+    self.assertEqual(apply_function('limit(2 * 10)', self.tag), self.tag[:20])
+    self.assertEqual(apply_function('html', '<b>'), '&lt;b&gt;')
+    self.assertRaises(templateparser.TemplateSyntaxError,
+                      apply_function, 'limit(20,)', self.tag)
+
 
 class TemplateUnicodeSupport(unittest.TestCase):
   """TemplateParser handles Unicode gracefully."""
@@ -606,6 +626,15 @@ class TemplateConditionals(unittest.TestCase):
     template = '{{ if [var:present] or [var:absent] }}~ {{ endif }}'
     self.assertEqual(self.parse(template, var={'present': 1}), '~')
 
+  def testExpressionCompiledOnce(self):
+    """{{ if }} Expressions are compiled on first use and reused after"""
+    template = templateparser.Template('{{ if [var] > 1 }}~ {{ endif }}')
+    self.assertEqual(template.Parse(var=2), '~')
+    expr = template[0].branches[0][0]
+    function = expr._function
+    self.assertFalse(template.Parse(var=1))
+    self.assertTrue(expr._function is function)
+
 
 class TemplateLoops(unittest.TestCase):
   """TemplateParser properly handles for-loops."""
@@ -803,6 +832,117 @@ class TemplateNestedScopes(unittest.TestCase):
     self.assertEqual(result_once, 'value: foo')
 
 
+class TemplateCompilation(unittest.TestCase):
+  """Tests for rendering templates through their compiled function."""
+  def setUp(self):
+    """Sets up a testbed."""
+    self.parser = templateparser.Parser()
+    self.tmpl = templateparser.Template
+
+  @staticmethod
+  def Interpret(template, **kwds):
+    """Returns the output of parsing the template's node tree."""
+    return ''.join(part.Parse(**kwds) for part in template)
+
+  def testCompiledOnce(self):
+    """[Compile] Templates are compiled on first parse and reused after"""
+    template = self.tmpl('Hello [name]')
+    template.Parse(name='spam')
+    render = template._render
+    self.assertTrue(render is not None)
+    self.assertEqual(template.Parse(name='eggs'), 'Hello eggs')
+    self.assertTrue(template._render is render)
+
+  def testRecompiledWhenExtended(self):
+    """[Compile] Adding to a template discards its compiled function"""
+    template = self.tmpl('Hello [name]')
+    self.assertEqual(template.Parse(name='spam'), 'Hello spam')
+    template.AddString(', bye [name]')
+    self.assertEqual(template.Parse(name='spam'), 'Hello spam, bye spam')
+
+  def testSameAsInterpreted(self):
+    """[Compile] Compiled templates give the output of their node tree"""
+    self.parser['row'] = self.tmpl('<td>[cell:name|html]</td>')
+    template = self.tmpl(
+        '<h1>[title]</h1>[missing] [page:0:x]'
+        '{{ for key, row in [rows|items|sorted] }}<tr>[key|len]'
+        '{{ for cell in [row] }}{{ inline row }}{{ endfor }}'
+        '{{ if [key] == "b" }}B{{ elif [row] }}R{{ else }}-{{ endif }}'
+        '{{ ifpresent [row:0:name] }}[row:0:name]{{ endif }}</tr>'
+        '{{ endfor }}', parser=self.parser)
+    kwds = {'title': u'\u2665 <b>', 'page': [{'x': 5}],
+            'rows': {'a': [{'name': '<a>'}], 'b': [], 'c': ({'name': 3},)}}
+    self.assertEqual(template.Parse(**kwds), self.Interpret(template, **kwds))
+
+  def testErrorsAsInterpreted(self):
+    """[Compile] Compiled templates raise the errors of their node tree"""
+    self.parser.RegisterFunction('fails', lambda value: {}[value])
+    for template, kwds in (('[tag|missing]', {'tag': 1}),
+                           ('[tag|fails]', {'tag': 'spam'}),
+                           ('{{ for a, b in [tag] }}{{ endfor }}',
+                            {'tag': [1]}),
+                           ('{{ for a in [absent] }}{{ endfor }}', {})):
+      template = self.tmpl(template)
+      self.assertRaises(templateparser.Error, template.Parse, **kwds)
+      self.assertRaises(templateparser.Error, self.Interpret, template, **kwds)
+
+
+class TemplateStreaming(unittest.TestCase):
+  """Tests for rendering templates as a stream of chunks."""
+  def setUp(self):
+    """Sets up a testbed."""
+    self.parser = templateparser.Parser()
+    self.parser['row'] = templateparser.Template(
+        '<li>[row]</li>{{ for cell in [cells] }}[cell]{{ endfor }}')
+    self.tmpl = templateparser.Template(
+        '<ul>{{ for row in [rows] }}{{ inline row }}{{ endfor }}</ul>',
+        parser=self.parser)
+    self.tmpl.CHUNK_SIZE = 100
+
+  def testSameAsParse(self):
+    """[Stream] The streamed chunks add up to the parsed template"""
+    kwds = {'rows': range(1000), 'cells': 'ab'}
+    chunks = list(self.tmpl.Stream(**kwds))
+    self.assertEqual(''.join(chunks), self.tmpl.Parse(**kwds))
+    self.assertTrue(len(chunks) > 1)
+    self.assertTrue(all(len(chunk) >= 100 for chunk in chunks[:-1]))
+
+  def testIncremental(self):
+    """[Stream] Chunks are yielded before the whole template is rendered"""
+    rendered = []
+    def Rows():
+      """Yields row numbers, recording the progress."""
+      for row in range(10000):
+        rendered.append(row)
+        yield row
+
+    stream = self.tmpl.Stream(rows=Rows(), cells='')
+    self.assertEqual(next(stream)[:8], '<ul><li>')
+    self.assertTrue(len(rendered) < 10000)
+    list(stream)
+    self.assertEqual(len(rendered), 10000)
+
+  def testParserStream(self):
+    """[Stream] The Parser streams templates by name"""
+    self.parser['page'] = self.tmpl
+    chunks = self.parser.Stream('page', rows=range(3), cells='x')
+    self.assertEqual(''.join(chunks),
+                     '<ul><li>0</li>x<li>1</li>x<li>2</li>x</ul>')
+
+  def testDeeplyNestedTemplate(self):
+    """[Stream] Templates too deeply nested to compile are streamed per part"""
+    template = templateparser.Template(
+        '<ul>%s[item]%s</ul>' % ('{{ for item in [items] }}' * 25,
+                                 '{{ endfor }}' * 25))
+    template.CHUNK_SIZE = 1
+    self.assertEqual(template.Parse(items=[1]), '<ul>1</ul>')
+    self.assertEqual(list(template.Stream(items=[1])), ['<ul>', '1', '</ul>'])
+
+  def testEmptyTemplate(self):
+    """[Stream] Templates without output yield no chunks"""
+    self.assertEqual(list(templateparser.Template('').Stream()), [])
+
+
 class TemplateReloading(unittest.TestCase):
   """Tests for FileTemplate automatic reloading upon modification."""
   def setUp(self):
@@ -837,7 +977,7 @@ class TemplateReloading(unittest.TestCase):
     self.assertEqual(second, 'new content')
 
   def testInlineReload(self):
-    """[Reload] Inlined templates are not automatically reloaded"""
+    """[Reload] Inlined templates are reloaded when their parent is parsed"""
     first = self.parser[self.loop].Parse(blob='four')
     self.assertEqual(first, self.simple_raw * 4)
     with file(self.simple, 'w') as new_template:
@@ -846,6 +986,45 @@ class TemplateReloading(unittest.TestCase):
     second = self.parser[self.loop].Parse(blob='four')
     self.assertEqual(second, 'new content' * 4)
 
+  def testInlineDependencies(self):
+    """[Reload] Inlined templates are recorded as dependencies"""
+    loop = self.parser[self.loop]
+    simple = self.parser[self.simple]
+    self.assertEqual(loop.dependencies, [simple])
+    self.assertEqual(simple.dependencies, [])
+    self.assertEqual(simple.dependents.values(), [loop])
+
+  def testInlineReloadPropagates(self):
+    """[Reload] A reloaded template invalidates all templates inlining it"""
+    self.parser['other'] = templateparser.Template(
+        '<{{ inline simple.utp }}>', parser=self.parser)
+    self.parser['outer'] = templateparser.Template(
+        '({{ inline loop.utp }})', parser=self.parser)
+    self.assertEqual(self.parser.Parse('other', noun='x'), '<simple x>')
+    self.assertEqual(self.parser.Parse('outer', blob='ab', noun='x'),
+                     '(simple xsimple x)')
+    with file(self.simple, 'w') as new_template:
+      new_template.write('new [noun]')
+      time.sleep(.01) # short pause so that mtime will actually be different
+    self.assertEqual(self.parser.Parse('outer', blob='ab', noun='x'),
+                     '(new xnew x)')
+    self.assertEqual(self.parser.Parse('other', noun='x'), '<new x>')
+
+  def testUnaffectedTemplateKept(self):
+    """[Reload] Templates not inlining a modified template are not rebuilt"""
+    self.parser['other'] = templateparser.Template('[noun]')
+    self.parser.Parse('other', noun='x')
+    self.parser.Parse(self.loop, blob='ab')
+    other_render = self.parser['other']._render
+    loop = self.parser[self.loop]
+    with file(self.simple, 'w') as new_template:
+      new_template.write('new [noun]')
+      time.sleep(.01) # short pause so that mtime will actually be different
+    self.assertTrue(loop.ReloadIfModified())
+    self.assertIs(loop._render, None)
+    self.assertIs(self.parser['other']._render, other_render)
+    self.assertFalse(loop.ReloadIfModified())
+
   def testReloadDeletedTemplate(self):
     """[Reload] Deleted templates are not reloaded and don't trigger errors"""
     os.unlink(self.simple)
@@ -859,5 +1038,66 @@ class TemplateReloading(unittest.TestCase):
     self.assertEqual(self.parser[self.simple].Parse(), self.simple_raw)
 
 
+class TemplateCaching(unittest.TestCase):
+  """Tests for the TemplateCache of parsed template files."""
+  def setUp(self):
+    self.template_dir = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.template_dir, '.cache')
+    self.name = 'cached.utp'
+    self.path = os.path.join(self.template_dir, self.name)
+    self.WriteTemplate('{{ for item in [items] }}<[item]>{{ endfor }}', 1000)
+
+  def tearDown(self):
+    shutil.rmtree(self.template_dir)
+
+  def Parse(self, **kwds):
+    """Returns the cached template parsed by a new Parser."""
+    parser = templateparser.Parser(self.template_dir, cache_dir=self.cache_dir)
+    return parser[self.name].Parse(items='ab', **kwds)
+
+  def WriteTemplate(self, raw_template, mtime):
+    """Writes the template file and sets its modification time."""
+    with file(self.path, 'w') as template:
+      template.write(raw_template)
+    os.utime(self.path, (mtime, mtime))
+
+  def testCacheHit(self):
+    """[Cache] An unmodified template file is loaded from the cache"""
+    self.assertEqual(self.Parse(), '<a><b>')
+    self.WriteTemplate('not read from disk', 1000)
+    self.assertEqual(self.Parse(), '<a><b>')
+
+  def testModifiedTemplate(self):
+    """[Cache] A modified template file is parsed again and recached"""
+    self.assertEqual(self.Parse(), '<a><b>')
+    self.WriteTemplate('{{ for item in [items] }}[item]{{ endfor }}', 2000)
+    self.assertEqual(self.Parse(), 'ab')
+    self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+  def testEntryReadableByAll(self):
+    """[Cache] Cache entries can be read by other users"""
+    self.Parse()
+    entry = os.path.join(self.cache_dir, os.listdir(self.cache_dir)[0])
+    self.assertEqual(os.stat(entry).st_mode & 0777, 0644)
+
+  def testVersionMismatch(self):
+    """[Cache] Entries from a different cache version are ignored"""
+    cache = templateparser.TemplateCache(self.cache_dir)
+    cache.VERSION = 0
+    cache.Put(self.path, 1000, [('text', 'old version')])
+    self.assertEqual(self.Parse(), '<a><b>')
+
+  def testWarmCache(self):
+    """[Cache] WarmCache caches all templates and reports failures"""
+    with file(os.path.join(self.template_dir, 'bad.utp'), 'w') as template:
+      template.write('{{ for item in [items] }}')
+    cached, failed = templateparser.WarmCache(
+        self.template_dir, self.cache_dir)
+    self.assertEqual(cached, [self.name])
+    self.assertEqual([name for name, _error in failed], ['bad.utp'])
+    self.WriteTemplate('not read from disk', 1000)
+    self.assertEqual(self.Parse(), '<a><b>')
+
+
 if __name__ == '__main__':
   unittest.main(testRunner=unittest.TextTestRunner(verbosity=2))